@@ -1,10 +1,46 @@
+import time
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import profiling
+
+rerun_started = time.perf_counter()    # see observe_rerun()
+
+def in_fragment_rerun():
+    # Streamlit has no public way to ask this. Read the script context's fragment ids
+    # when it has them; otherwise every run counts as a full rerun (see profiling.Profiler)
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return bool(getattr(ctx, "fragment_ids_this_run", None))
+
+# Rerun profiling, off unless DAIRY_PROFILE is set (see profiling.py). Each rerun's
+# span tree is kept in this session's state; the Performance page exports it.
+profiler = profiling.Profiler(st.session_state, fragment_run=in_fragment_rerun)
+profiler.begin()
+profiler.section("Imports")
+
 import sqlite3
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+from functools import partial
 import os
+from db import ConnectionPool
+from migrations import migrate
+from checkout import checkout, CheckoutError
+import promotions
+import pricing
+import intake
+import inventory
+import exports
+import attachments
+import messaging
+import notifications
+import outbox
+import queries
+import tracing
+import metrics
+
+profiler.section("Setup")
 
 # ========================
 # ULTIMATE THEME & UI ENHANCEMENTS
@@ -30,7 +66,17 @@ st.set_page_config(
 #         st.success("Database deleted! Restarting fresh...")
 #         st.rerun()
 
-DB_PATH = "dairy_ecosystem.db"
+# DAIRY_DB_PATH points the app at another database, e.g. one from benchmarks/generate_data.py
+DB_PATH = os.environ.get("DAIRY_DB_PATH", "dairy_ecosystem.db")
+# SMS/e-mail go to this local file until a real provider's outbox.Gateway is plugged in
+GATEWAY_LOG = "outbound_messages.jsonl"
+# Set to a file name (e.g. "query_log.db") to keep every traced query across restarts
+QUERY_LOG = None
+# Prometheus metrics (see metrics.py): DAIRY_METRICS_PORT serves them at http://<addr>:<port>/metrics,
+# DAIRY_METRICS_FILE rewrites them to that file every 15 s. Both are off by default.
+METRICS_PORT = os.environ.get("DAIRY_METRICS_PORT")
+METRICS_ADDR = os.environ.get("DAIRY_METRICS_ADDR", "127.0.0.1")
+METRICS_FILE = os.environ.get("DAIRY_METRICS_FILE")
 
 # ========================
 # PAGE CONFIG & STYLE
@@ -53,183 +99,82 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ========================
-# DATABASE INITIALIZATION (CLEAN & COMPLETE)
+# SHARED CONNECTION POOL
 # ========================
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
-    # Internal Users
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS internal_users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL CHECK(role IN ('Admin', 'Manager', 'Sales Clerk', 'Field Staff'))
-        )
-    ''')
-    c.execute("INSERT OR IGNORE INTO internal_users (username, password, role) VALUES ('admin', 'admin123', 'Admin')")
-
-
-    # Dairy Farmers
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS dairy_farmers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            contact TEXT,
-            address TEXT,
-            username TEXT UNIQUE,
-            password TEXT,
-            loyalty_tier TEXT DEFAULT 'Bronze',
-            bonus_earned REAL DEFAULT 0
-        )
-    ''')
-    sample_farmers = [
-        ("Mang Jose Santos", "0917-1234567", "San Teodoro", "jose", "jose123"),
-        ("Aling Maria Reyes", "0928-9876543", "Victoria", "maria", "maria123"),
-        ("Juan dela Cruz", "0999-5551111", "Naujan", "juan", "juan123")
-    ]
-    c.executemany("INSERT OR IGNORE INTO dairy_farmers (name, contact, address, username, password) VALUES (?, ?, ?, ?, ?)", sample_farmers)
-
-    # Customers
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS customers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            type TEXT CHECK(type IN ('Reseller', 'Distributor', 'Institutional Buyer')),
-            contact TEXT,
-            username TEXT UNIQUE,
-            password TEXT,
-            discount_type TEXT DEFAULT 'Percentage',
-            discount_value REAL DEFAULT 0,
-            loyalty_points INTEGER DEFAULT 0,
-            current_balance REAL DEFAULT 0
-        )
-    ''')
-    sample_customers = [
-        ("Juan's Sari-Sari Store", "Reseller", "0909-1112222", "juansstore", "store123", "Percentage", 10.0, 850),
-        ("Reyes Mini Mart", "Distributor", "0918-3334444", "reyesmart", "mart123", "Percentage", 15.0, 2500),
-        ("Mindoro School Canteen", "Institutional Buyer", "0920-5556666", "schoolcanteen", "canteen123", "Fixed", 5.0, 0)
-    ]
-    c.executemany("INSERT OR IGNORE INTO customers (name, type, contact, username, password, discount_type, discount_value, loyalty_points) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", sample_customers)
-
-    # Products
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            category TEXT,
-            srp REAL NOT NULL,
-            unit TEXT,
-            current_stock REAL DEFAULT 0,
-            low_stock_threshold REAL DEFAULT 10,
-            expiry_date TEXT
-        )
-    ''')
-    sample_products = [
-        ("Raw Milk", "Raw Milk", 0, "Liter", 0, 50, None),
-        ("Fresh Milk 1L", "Finished Goods", 50, "Bottle", 100, 20, None),
-        ("Yogurt 500g", "Finished Goods", 80, "Pack", 50, 10, None),
-        ("Cheese 200g", "Finished Goods", 120, "Pack", 30, 5, None)
-    ]
-    c.executemany("INSERT OR IGNORE INTO products (name, category, srp, unit, current_stock, low_stock_threshold, expiry_date) VALUES (?, ?, ?, ?, ?, ?, ?)", sample_products)
-
-    # Milk Collections (all quality fields included from start)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS milk_collections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            farmer_id INTEGER,
-            class_a_litres REAL DEFAULT 0,
-            class_b_litres REAL DEFAULT 0,
-            total_payment REAL,
-            collection_date TEXT DEFAULT (date('now')),
-            notes TEXT,
-            recorded_by TEXT,
-            fat_percentage REAL,
-            snf_percentage REAL,
-            quality_score REAL
-        )
-    ''')
-
-    # Sales & Items
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sales (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            customer_type TEXT,
-            customer_id INTEGER,
-            total_amount REAL,
-            payment_type TEXT,
-            sale_date TEXT DEFAULT (date('now')),
-            recorded_by TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sale_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sale_id INTEGER,
-            product_id INTEGER,
-            quantity REAL,
-            unit_price REAL
-        )
-    ''')
-
-    # Inventory Transactions
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS inventory_transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_id INTEGER,
-            transaction_type TEXT,
-            quantity REAL,
-            reason TEXT,
-            transaction_date TEXT DEFAULT (date('now')),
-            recorded_by TEXT
-        )
-    ''')
-
-    # Announcements, Messages, Notifications
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS announcements (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            target_type TEXT NOT NULL,
-            created_date TEXT DEFAULT (date('now'))
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender_type TEXT NOT NULL,
-            sender_id INTEGER,
-            sender_name TEXT,
-            message TEXT NOT NULL,
-            timestamp TEXT DEFAULT (datetime('now'))
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_type TEXT NOT NULL,
-            user_id INTEGER,
-            message TEXT NOT NULL,
-            is_read INTEGER DEFAULT 0,
-            created_date TEXT DEFAULT (datetime('now'))
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-init_db()
+def current_page():
+    # Page label for query tracing: the page of the session running on this thread;
+    # background work (outbox, exports) is labelled by its thread
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return tracing.thread_name()
+    return st.session_state.get("current_page", "Login")
+
+def set_current_page(name):
+    # Labels this rerun for query tracing and profiling
+    st.session_state.current_page = name
+    profiler.label(name)
+    profiler.section(name)
+
+@st.cache_resource
+def get_pool():
+    # One pool per server process, shared by every session and rerun.
+    # Schema migrations run here too, so startup work happens once, not on every rerun.
+    pool = ConnectionPool(DB_PATH, tracer=tracing.QueryTracer(log_path=QUERY_LOG, page_of=current_page))
+    metrics.watch_query_cache(pool.cache)
+    migrate(pool)
+    with pool.writer() as conn:
+        notifications.compact(conn)
+        outbox.purge(conn)
+    return pool
+
+@st.cache_resource
+def get_dispatcher():
+    # One outbox worker per server process; it delivers what add_notification() queues
+    return outbox.OutboxDispatcher(get_pool(), outbox.FileGateway(GATEWAY_LOG)).start()
+
+@st.cache_resource
+def get_exports():
+    # One export queue per server process; jobs are kept per user
+    return exports.ExportManager(get_pool())
+
+@st.cache_resource(max_entries=2)
+def close_books_for(day):
+    # Once per server process and day (the first rerun after midnight), so the stock
+    # checkpoints keep up on a server that runs for weeks
+    with write_tx() as conn:
+        return inventory.close_books(conn, day)
+
+@st.cache_resource
+def get_metrics_exporters():
+    # One metrics server and/or file writer per server process
+    started = []
+    if METRICS_PORT:
+        started.append(metrics.start_http_server(int(METRICS_PORT), METRICS_ADDR))
+    if METRICS_FILE:
+        started.append(metrics.FileExporter(METRICS_FILE).start())
+    return started
+
+def observe_rerun():
+    # A rerun that reached its end (or the login page's st.stop()), for metrics.RERUN_SECONDS
+    metrics.RERUN_SECONDS.observe(time.perf_counter() - rerun_started, page=st.session_state.get("current_page", "Login"))
+
+# Reads go through the pool's result cache; an entry is dropped as soon as a
+# write to any table it reads from commits. Pass cached=False for one-off lookups.
+def read_df(sql, params=(), cached=True):
+    return get_pool().read_df(sql, params, cached=cached)
+
+def read_one(sql, params=(), cached=True):
+    return get_pool().read_one(sql, params, cached=cached)
+
+def read_all(sql, params=(), cached=True):
+    return get_pool().read_all(sql, params, cached=cached)
+
+def write_tx():
+    # Usage: with write_tx() as conn: ...  (commits on exit, rolls back on error)
+    return get_pool().writer()
 
 # ========================
 # HELPER FUNCTIONS
 # ========================
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 def apply_discount(price, discount_type, discount_value):
     if discount_type == "Percentage":
         return price * (1 - discount_value / 100)
@@ -237,12 +182,32 @@ def apply_discount(price, discount_type, discount_value):
         return max(0, price - discount_value)
     return price
 
-def add_notification(user_type, user_id, message):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO notifications (user_type, user_id, message) VALUES (?, ?, ?)", (user_type, user_id, message))
-    conn.commit()
-    conn.close()
+def discounted_prices(prices, discount_type, discount_value):
+    # apply_discount for a whole price column
+    if discount_type == "Percentage":
+        return prices * (1 - discount_value / 100)
+    elif discount_type == "Fixed":
+        return (prices - discount_value).clip(lower=0)
+    return prices
+
+def todays_price_schedule():
+    # Compiled once per schedule change, shared by the single form and the route-sheet import
+    return pricing.price_book_for(get_pool()).schedule_on(date.today())
+
+def add_notification(user_type, user_id, message, sms=False):
+    # Queued in the caller's write_tx() transaction and delivered by the outbox worker after
+    # the commit. "Internal" with user_id None notifies every staff account.
+    with write_tx() as conn:
+        outbox.enqueue(conn, user_type, user_id, message, (outbox.IN_APP, outbox.SMS) if sms else (outbox.IN_APP,))
+    get_dispatcher().wake()
+
+# Start the outbox worker with the server rather than on the first notification
+get_dispatcher()
+close_books_for(date.today())
+get_metrics_exporters()
+run_ctx = get_script_run_ctx(suppress_warning=True)
+if run_ctx is not None:
+    metrics.SESSIONS.touch(run_ctx.session_id)
 
 # ========================
 # SESSION STATE INITIALIZATION
@@ -260,6 +225,7 @@ if "logged_in" not in st.session_state:
 # LOGIN PAGE
 # ========================
 if not st.session_state.logged_in:
+    set_current_page("Login")
     st.title("🥛 Mindoro Dairy Ecosystem")
     st.markdown("### Welcome! Please select your portal and log in")
 
@@ -275,11 +241,7 @@ if not st.session_state.logged_in:
                 if not username or not password:
                     st.error("Please enter both username and password")
                 else:
-                    conn = get_conn()
-                    c = conn.cursor()
-                    c.execute("SELECT id, username, role FROM internal_users WHERE username = ? AND password = ?", (username, password))
-                    user = c.fetchone()
-                    conn.close()
+                    user = read_one("SELECT id, username, role FROM internal_users WHERE username = ? AND password = ?", (username, password), cached=False)
                     if user:
                         st.session_state.logged_in = True
                         st.session_state.user_type = "Internal"
@@ -301,11 +263,7 @@ if not st.session_state.logged_in:
                 if not username or not password:
                     st.error("Please enter both username and password")
                 else:
-                    conn = get_conn()
-                    c = conn.cursor()
-                    c.execute("SELECT id, name, username FROM dairy_farmers WHERE username = ? AND password = ?", (username, password))
-                    farmer = c.fetchone()
-                    conn.close()
+                    farmer = read_one("SELECT id, name, username FROM dairy_farmers WHERE username = ? AND password = ?", (username, password), cached=False)
                     if farmer:
                         st.session_state.logged_in = True
                         st.session_state.user_type = "Farmer"
@@ -327,11 +285,7 @@ if not st.session_state.logged_in:
                 if not username or not password:
                     st.error("Please enter both username and password")
                 else:
-                    conn = get_conn()
-                    c = conn.cursor()
-                    c.execute("SELECT id, name, username, type FROM customers WHERE username = ? AND password = ?", (username, password))
-                    customer = c.fetchone()
-                    conn.close()
+                    customer = read_one("SELECT id, name, username, type FROM customers WHERE username = ? AND password = ?", (username, password), cached=False)
                     if customer:
                         st.session_state.logged_in = True
                         st.session_state.user_type = "Customer"
@@ -350,11 +304,52 @@ if not st.session_state.logged_in:
     st.caption("**Farmers:** jose / jose123 | maria / maria123 | juan / juan123")
     st.caption("**Customers:** juansstore / store123 | reyesmart / mart123 | schoolcanteen / canteen123")
 
+    observe_rerun()
     st.stop()
 
+# ========================
+# REPORT EXPORTS
+# ========================
+def queue_export(title, file_name, sheets):
+    # sheets: [(sheet name, sql, params)]; the file is built in the background
+    get_exports().submit(st.session_state.username, title, file_name, sheets)
+    st.toast(f"⏳ {title} is being prepared — download it from **My Exports** in the sidebar")
+
+
+@profiler.traced("Exports panel")
+def _export_panel():
+    jobs = get_exports().jobs_for(st.session_state.username)
+    if not jobs:
+        return
+    st.markdown("**📥 My Exports**")
+    for job in jobs:
+        if job.status == exports.DONE:
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.download_button(f"⬇️ {job.title} ({job.rows:,} rows)", job.data, file_name=job.file_name,
+                                   mime=job.mime, key=f"export_download_{job.id}", width="stretch")
+            with col2:
+                if st.button("✖", key=f"export_discard_{job.id}", help="Remove from list"):
+                    get_exports().discard(st.session_state.username, job.id)
+                    st.rerun(scope="fragment")
+        elif job.status == exports.FAILED:
+            st.error(f"{job.title} failed: {job.error}")
+        else:
+            st.caption(f"⏳ {job.title} — {job.status.lower()}…")
+    if not any(job.active for job in jobs) and st.session_state.get("exports_polling"):
+        # Last job finished: stop polling
+        st.session_state.exports_polling = False
+        st.rerun(scope="app")
+
+
+# Polls only while one of the user's jobs is still running
+export_panel = st.fragment(_export_panel)
+export_panel_live = st.fragment(_export_panel, run_every=2)
+
 # ========================
 # SIDEBAR AFTER LOGIN
 # ========================
+profiler.section("Sidebar")
 with st.sidebar:
     if st.session_state.user_type == "Internal":
         display_name = st.session_state.username.title()
@@ -368,7 +363,14 @@ with st.sidebar:
     st.markdown(f"_{role_text}_")
     st.divider()
 
-    if st.button("Logout", type="secondary", use_container_width=True):
+    if st.session_state.user_type == "Internal":
+        st.session_state.exports_polling = any(job.active for job in get_exports().jobs_for(st.session_state.username))
+        if st.session_state.exports_polling:
+            export_panel_live()
+        else:
+            export_panel()
+
+    if st.button("Logout", type="secondary", width="stretch"):
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
@@ -376,6 +378,1413 @@ with st.sidebar:
     st.markdown("---")
     st.caption("Mindoro Dairy Ecosystem © 2025")
 
+# ========================
+# SALES CART (FRAGMENT)
+# ========================
+# Editing the cart only reruns this function, not the customer and product queries
+# above it. The whole catalog is one data_editor grid and every total is computed
+# column-wise, so a keystroke costs the same with 5 or 500 products.
+# The Qty column steps by 0.5 for every row; only these units may be sold in fractions.
+FRACTIONAL_UNITS = ["Liter", "Kg"]
+
+@st.fragment
+@profiler.traced("Cart")
+def sales_cart(products, customer_type, customer_id, customer_name, discount_type, discount_value, loyalty_points):
+    st.subheader(f"🛒 Cart for **{customer_name}**")
+
+    receipt = st.session_state.pop("last_receipt", None)
+    if receipt:
+        show_receipt(receipt)
+
+    grid = products[["id", "name", "unit", "current_stock", "srp"]].copy()
+    grid["unit_price"] = discounted_prices(grid["srp"], discount_type, discount_value)
+    grid["qty"] = 0.0
+
+    edited = st.data_editor(
+        grid,
+        key=f"cart_{st.session_state.get('cart_version', 0)}",
+        column_order=["name", "unit", "current_stock", "unit_price", "qty"],
+        column_config={
+            "name": st.column_config.TextColumn("Product"),
+            "unit": st.column_config.TextColumn("Unit"),
+            "current_stock": st.column_config.NumberColumn("Stock", format="%.2f"),
+            "unit_price": st.column_config.NumberColumn("Price ₱", format="%.2f"),
+            "qty": st.column_config.NumberColumn("Qty", min_value=0.0, step=0.5, format="%.1f"),
+        },
+        disabled=["name", "unit", "current_stock", "unit_price"],
+        hide_index=True,
+        width="stretch",
+    )
+
+    cart = edited[edited["qty"] > 0].copy()
+    over_stock = cart["qty"] > cart["current_stock"]
+    if over_stock.any():
+        st.warning("Quantity capped at available stock for: " + ", ".join(cart.loc[over_stock, "name"]))
+        cart["qty"] = cart["qty"].clip(upper=cart["current_stock"])
+    fractional = ~cart["unit"].isin(FRACTIONAL_UNITS) & (cart["qty"] % 1 != 0)
+    if fractional.any():
+        st.error("Whole units only for: " + ", ".join(cart.loc[fractional, "name"]))
+    cart["line_total"] = cart["qty"] * cart["unit_price"]
+    subtotal = float(cart["line_total"].sum())
+
+    if cart.empty:
+        st.info("👆 Add items by entering a quantity in the Qty column.")
+
+    st.divider()
+
+    # === PROMO ENGINE ===
+    # Rules come from the promotions table (managed under "Promotions" below the cart)
+    promo_engine = promotions.engine_for(get_pool(), date.today())
+    promo_discount, applied_promos = promo_engine.apply(cart["id"], cart["qty"], cart["unit_price"])
+    promo_messages = [f"🎁 {name} → -₱{amount:,.2f}" for name, amount in applied_promos]
+
+    # Loyalty Points Redemption
+    points_to_redeem = 0
+    points_discount = 0.0
+    if customer_type == "Registered Buyer" and loyalty_points >= 100:
+        max_redeemable = (loyalty_points // 100) * 100
+        points_to_redeem = st.slider("Redeem Loyalty Points (100 pts = ₱50)", 0, max_redeemable, 0, step=100, key="points_redeem")
+        points_discount = (points_to_redeem // 100) * 50
+
+    # Final Calculations
+    total_after_promo = subtotal - promo_discount
+    total_after_points = total_after_promo - points_discount
+    vat = total_after_points * 0.12
+    grand_total = round(total_after_points + vat, 2)
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Subtotal", f"₱{subtotal:,.2f}")
+    with col2:
+        st.metric("Promo Discounts", f"-₱{promo_discount:,.2f}")
+    with col3:
+        st.metric("Points Redeemed", f"-₱{points_discount:,.2f}")
+    with col4:
+        st.metric("VAT 12%", f"₱{vat:,.2f}")
+
+    st.metric("**GRAND TOTAL**", f"₱{grand_total:,.2f}", delta=None)
+
+    if promo_messages:
+        st.success("Applied Promos: " + " | ".join(promo_messages))
+
+    # Payment Section
+    payment_method = st.selectbox("Payment Method", ["Cash", "GCash", "Bank Transfer", "Credit (Utang)", "Partial Payment"])
+
+    amount_paid = grand_total
+    if payment_method in ["Partial Payment", "Credit (Utang)"]:
+        amount_paid = st.number_input("Amount Paid Today", min_value=0.0, max_value=grand_total, value=0.0 if payment_method == "Credit (Utang)" else grand_total)
+
+    remaining = grand_total - amount_paid
+
+    if st.button("🧾 Confirm Sale & Print Digital Receipt", type="primary", width="stretch"):
+        if cart.empty:
+            st.error("Cart is empty!")
+        elif fractional.any():
+            st.error("Fix the quantities marked above before confirming the sale.")
+        elif remaining < 0:
+            st.error("Amount paid cannot exceed total.")
+        else:
+            items = [{"pid": int(row.id), "qty": float(row.qty), "unit_price": float(row.unit_price)}
+                     for row in cart.itertuples()]
+            try:
+                sale_id = checkout(
+                    get_pool(), items,
+                    customer_type=customer_type,
+                    customer_id=customer_id,
+                    customer_name=customer_name,
+                    grand_total=grand_total,
+                    payment_type=payment_method,
+                    amount_paid=amount_paid,
+                    points_redeemed=points_to_redeem,
+                    recorded_by=st.session_state.username,
+                )
+            except CheckoutError as e:
+                # Nothing was written; the cart is left as it was so the clerk can adjust it
+                st.error(f"Sale not recorded. {e}")
+                return
+
+            get_dispatcher().wake()
+            # Fresh grid for the next customer; the receipt is shown after the full rerun
+            st.session_state.cart_version = st.session_state.get("cart_version", 0) + 1
+            st.session_state.last_receipt = {
+                "sale_id": sale_id,
+                "customer_name": customer_name,
+                "lines": cart[["name", "qty", "unit_price", "line_total"]].to_dict("records"),
+                "subtotal": subtotal,
+                "promo_discount": promo_discount,
+                "points_discount": points_discount,
+                "vat": vat,
+                "grand_total": grand_total,
+                "amount_paid": amount_paid,
+                "remaining": remaining,
+            }
+            # Stock and customer figures outside the fragment changed too
+            st.rerun(scope="app")
+
+
+def show_receipt(receipt):
+    st.success(f"Sale #{receipt['sale_id']} completed successfully!")
+    st.balloons()
+
+    # Digital Receipt
+    with st.expander("📄 View Digital Receipt", expanded=True):
+        st.markdown(f"**Mindoro Dairy** • Sale #{receipt['sale_id']} • {date.today().strftime('%b %d, %Y %H:%M')}")
+        st.markdown(f"**Customer:** {receipt['customer_name']}")
+        st.markdown("**Items:**")
+        receipt_df = pd.DataFrame([
+            {"Item": i["name"], "Qty": i["qty"], "Price": f"₱{i['unit_price']:,.2f}", "Total": f"₱{i['line_total']:,.2f}"}
+            for i in receipt["lines"]
+        ])
+        st.table(receipt_df)
+        st.markdown(f"**Subtotal:** ₱{receipt['subtotal']:,.2f}")
+        if receipt["promo_discount"] > 0:
+            st.markdown(f"**Promo Discount:** -₱{receipt['promo_discount']:,.2f}")
+        if receipt["points_discount"] > 0:
+            st.markdown(f"**Points Redeemed:** -₱{receipt['points_discount']:,.2f}")
+        st.markdown(f"**VAT (12%):** ₱{receipt['vat']:,.2f}")
+        st.markdown(f"**GRAND TOTAL:** ₱{receipt['grand_total']:,.2f}")
+        st.markdown(f"**Paid Today:** ₱{receipt['amount_paid']:,.2f}")
+        st.markdown(f"**Remaining Balance:** ₱{receipt['remaining']:,.2f}")
+        st.markdown("**Thank you for your purchase! 🥛**")
+
+# ========================
+# PAGE FRAGMENTS
+# ========================
+# Sections with their own inputs or history tables run as fragments: a widget inside one
+# reruns only that function. Arguments are the data each one needs from its page;
+# everything else it reads itself (served from the query cache when unchanged).
+# Writes that change what the rest of the page shows end with st.rerun(scope="app").
+
+# Milk Collection: grading inputs and the pricing preview rerun on their own.
+# Depends on the selected farmer; a recorded delivery reruns the page so its stats refresh.
+@st.fragment
+@profiler.traced("Collection form")
+def collection_form(farmer_id, farmer_name, current_tier, this_month):
+    # === QUALITY TESTING & COLLECTION INPUT ===
+    st.subheader(f"🧪 New Collection for **{farmer_name}**")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        total_litres = st.number_input("Total Liters Delivered", min_value=0.0, step=0.5, format="%.2f", key="litres_input")
+    with col2:
+        fat_percent = st.number_input("Fat %", min_value=0.0, max_value=10.0, step=0.1, value=3.8, key="fat_input")
+    with col3:
+        snf_percent = st.number_input("SNF %", min_value=0.0, max_value=12.0, step=0.1, value=8.5, key="snf_input")
+    with col4:
+        temperature = st.number_input("Temperature (°C)", min_value=0.0, max_value=50.0, step=0.5, value=4.0, key="temp_input")
+
+    # Quality Score Calculation (available in both accept & reject paths)
+    quality_score = float(pricing.quality_score(total_litres, fat_percent, snf_percent, temperature))
+
+    # Rejection Check
+    if pricing.is_rejected(fat_percent, snf_percent, temperature):
+        st.error("🚫 Milk does NOT meet minimum quality standards – WILL BE REJECTED")
+        st.info(f"Requirements: Fat ≥{pricing.MIN_FAT}% | SNF ≥{pricing.MIN_SNF}% | Temperature ≤{pricing.MAX_TEMPERATURE}°C")
+
+        reject_notes = st.text_area("Reason for rejection (required)", key="reject_notes")
+        if st.button("❌ Record Rejection", type="secondary", width="stretch"):
+            if not reject_notes.strip():
+                st.error("Please provide a reason for rejection.")
+            else:
+                with write_tx() as conn:
+                    conn.execute("""
+                        INSERT INTO milk_collections
+                        (farmer_id, class_a_litres, class_b_litres, total_payment, notes, recorded_by, 
+                         fat_percentage, snf_percentage, quality_score)
+                        VALUES (?, 0, 0, 0, ?, ?, ?, ?, ?)
+                    """, (farmer_id, f"REJECTED: {reject_notes}", st.session_state.username, 
+                          fat_percent, snf_percent, quality_score))
+                    add_notification("Farmer", farmer_id, f"Your delivery today was rejected: {reject_notes}", sms=True)
+                metrics.COLLECTIONS.inc(status="rejected")
+                st.error("Rejection recorded.")
+                st.rerun(scope="app")
+    else:
+        # === SMART PRICING ENGINE (ACCEPTED MILK) ===
+        # Consistency bonus: same one-query lookup the bulk route-sheet import uses
+        delivered_yesterday = farmer_id in {row["farmer_id"] for row in read_all(queries.FARMERS_DELIVERED_YESTERDAY)}
+        schedule = todays_price_schedule()
+        priced = schedule.price(total_litres, fat_percent, snf_percent, current_tier, delivered_yesterday)
+        quality_premium = float(priced["quality_premium"])
+        final_price_per_liter = float(priced["price_per_liter"])
+        total_bonus = float(priced["total_bonus"])
+        total_payment = float(priced["total_payment"])
+
+        # Live Pricing Display
+        col1, col2, col3, col4, col5 = st.columns(5)
+        with col1:
+            st.metric("Quality Score", f"{quality_score:.0f}/100", delta="Excellent" if quality_score >= 85 else "Good")
+        with col2:
+            st.metric("Price per Liter", f"₱{final_price_per_liter:.1f}")
+        with col3:
+            st.metric("Base + Premium", f"₱{schedule.base_price + quality_premium:.0f}")
+        with col4:
+            st.metric("Total Bonus", f"₱{total_bonus:.0f}")
+        with col5:
+            st.metric("**Final Payment**", f"₱{total_payment:,.2f}", delta=f"+₱{total_bonus:.0f} bonus")
+
+        notes = st.text_area("Additional Notes (optional)", key="collection_notes")
+
+        if st.button("✅ Record Collection & Update Raw Milk Stock", type="primary", width="stretch"):
+            if total_litres <= 0:
+                st.error("Please enter valid liters greater than 0.")
+            else:
+                with write_tx() as conn:
+                    # Record collection
+                    conn.execute("""
+                        INSERT INTO milk_collections
+                        (farmer_id, class_a_litres, class_b_litres, total_payment, notes, recorded_by,
+                         fat_percentage, snf_percentage, quality_score)
+                        VALUES (?, ?, 0, ?, ?, ?, ?, ?, ?)
+                    """, (farmer_id, total_litres, total_payment, notes or "None", st.session_state.username,
+                          fat_percent, snf_percent, quality_score))
+
+                    # Update Raw Milk stock
+                    conn.execute("UPDATE products SET current_stock = current_stock + ? WHERE name = 'Raw Milk'", (total_litres,))
+
+                    # Log transaction
+                    conn.execute("""
+                        INSERT INTO inventory_transactions
+                        (product_id, transaction_type, quantity, reason, recorded_by)
+                        VALUES ((SELECT id FROM products WHERE name = 'Raw Milk'), 'IN', ?, ?, ?)
+                    """, (total_litres, f"Collection from {farmer_name} | {total_litres:.1f}L | Bonus ₱{total_bonus:.0f}", st.session_state.username))
+
+                    # Auto tier upgrade (month total already includes this delivery via the rollup trigger)
+                    new_monthly_litres = conn.execute(queries.FARMER_MONTH_STATS, (farmer_id, this_month)).fetchone()["litres"]
+                    new_tier = pricing.tier_after(current_tier, new_monthly_litres)
+
+                    if new_tier != current_tier:
+                        conn.execute("UPDATE dairy_farmers SET loyalty_tier = ? WHERE id = ?", (new_tier, farmer_id))
+
+                    add_notification("Farmer", farmer_id, f"New collection: {total_litres:.1f}L → ₱{total_payment:,.2f}", sms=True)
+                metrics.COLLECTIONS.inc(status="accepted")
+                metrics.LITRES_IN.inc(total_litres)
+
+                if new_tier != current_tier:
+                    st.balloons()
+                    st.success(f"🎉 {farmer_name} upgraded to **{new_tier}** tier!")
+                st.success(f"Collection recorded for **{farmer_name}**!")
+                st.success(f"Payment: **₱{total_payment:,.2f}** (includes ₱{total_bonus:.0f} bonus)")
+                st.rerun(scope="app")
+
+
+# Milk Collection: bulk intake from a route sheet. Reads the farmer list itself.
+@st.fragment
+@profiler.traced("Bulk intake")
+def bulk_intake():
+    st.subheader("📋 Bulk Intake from Route Sheet")
+    st.caption("One row per delivery: **farmer** (name, username or id), **litres**, **fat**, **snf**, **temperature**, optional **notes**.")
+
+    summary = st.session_state.pop("last_intake", None)
+    if summary:
+        st.success(f"Imported **{summary['accepted']}** deliveries ({summary['litres']:,.1f} L • ₱{summary['payment']:,.2f})"
+                   + (f" and **{summary['rejected']}** rejections" if summary["rejected"] else ""))
+        for name, old_tier, new_tier in summary["upgrades"]:
+            st.success(f"🎉 {name} upgraded from {old_tier} to **{new_tier}** tier!")
+
+    st.download_button("⬇️ Download Route Sheet Template (CSV)", intake.TEMPLATE_CSV,
+                       file_name="route_sheet_template.csv", mime="text/csv")
+    uploaded = st.file_uploader("Upload Route Sheet", type=["csv", "xlsx", "xls"],
+                                key=f"route_sheet_{st.session_state.get('route_sheet_version', 0)}")
+    if uploaded is None:
+        return
+
+    try:
+        sheet = intake.read_route_sheet(uploaded)
+    except ValueError as e:
+        st.error(str(e))
+        return
+
+    farmers = read_df("SELECT id, name, username, loyalty_tier FROM dairy_farmers")
+    delivered_yesterday = {row["farmer_id"] for row in read_all(queries.FARMERS_DELIVERED_YESTERDAY)}
+    graded = intake.grade_route_sheet(sheet, farmers, delivered_yesterday, todays_price_schedule())
+
+    accepted = graded["status"] == "Accepted"
+    rejected = graded["status"] == "Rejected"
+    errors = ~(accepted | rejected)
+
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        st.metric("Accepted", int(accepted.sum()))
+    with col2:
+        st.metric("Rejected", int(rejected.sum()))
+    with col3:
+        st.metric("Errors", int(errors.sum()))
+    with col4:
+        st.metric("Accepted Liters", f"{graded.loc[accepted, 'litres'].sum():,.1f} L")
+    with col5:
+        st.metric("Total Payout", f"₱{graded['total_payment'].sum():,.2f}")
+
+    preview = graded.rename(columns={
+        "farmer": "Sheet Farmer", "farmer_name": "Farmer", "litres": "Liters", "fat": "Fat %", "snf": "SNF %",
+        "temperature": "Temp °C", "quality_score": "Score", "price_per_liter": "₱/L", "total_payment": "Payment ₱",
+        "status": "Status", "reason": "Reason",
+    })
+    st.dataframe(preview[["Status", "Sheet Farmer", "Farmer", "Liters", "Fat %", "SNF %", "Temp °C", "Score", "₱/L", "Payment ₱", "Reason"]]
+                 .style.format({"Liters": "{:.1f}", "Fat %": "{:.2f}", "SNF %": "{:.2f}", "Temp °C": "{:.1f}",
+                                "Score": "{:.0f}", "₱/L": "₱{:.1f}", "Payment ₱": "₱{:,.2f}"}, na_rep="—"),
+                 width="stretch", hide_index=True)
+
+    if errors.any():
+        st.warning(f"{int(errors.sum())} row(s) have errors and will be skipped. Fix them in the sheet and re-upload to include them.")
+
+    to_import = int((accepted | rejected).sum())
+    if st.button(f"✅ Import {to_import} Deliveries & Update Raw Milk Stock", type="primary",
+                 width="stretch", disabled=to_import == 0):
+        st.session_state.last_intake = intake.record_route_sheet(
+            get_pool(), graded, st.session_state.username, queries.month_key(date.today()))
+        get_dispatcher().wake()
+        # Fresh uploader for the next sheet
+        st.session_state.route_sheet_version = st.session_state.get("route_sheet_version", 0) + 1
+        st.rerun(scope="app")
+
+
+# Milk Collection: today's deliveries (no inputs from the page)
+@st.fragment
+@profiler.traced("Today's collections")
+def todays_collections():
+    # === TODAY'S COLLECTIONS SUMMARY ===
+    st.subheader("📊 Today's Collections Summary (All Farmers)")
+    df_today = read_df(queries.TODAYS_COLLECTIONS)
+
+    if not df_today.empty:
+        st.dataframe(df_today.style.format({
+            "Liters": "{:.1f}",
+            "Fat %": "{:.2f}",
+            "SNF %": "{:.2f}",
+            "Score": "{:.0f}",
+            "Payment ₱": "₱{:.0f}"
+        }), width="stretch")
+
+        if st.button("📥 Export Today's Collections to Excel", type="secondary"):
+            queue_export("Today's Collections", f"Milk_Collections_{date.today().isoformat()}.xlsx",
+                         [("Collections", queries.TODAYS_COLLECTIONS, ())])
+    else:
+        st.info("No collections recorded today yet.")
+
+    # === COLLECTION HISTORY EXPORT (any range, built in the background) ===
+    with st.expander("📥 Export Collection History"):
+        col1, col2, col3 = st.columns([2, 2, 1])
+        with col1:
+            export_from = st.date_input("From", value=date.today() - timedelta(days=365), key="export_from")
+        with col2:
+            export_to = st.date_input("To", value=date.today(), key="export_to")
+        with col3:
+            export_format = st.radio("Format", ["xlsx", "csv"], key="export_format")
+        if st.button("📥 Export Collections", key="export_collections", disabled=export_from > export_to):
+            queue_export(f"Collections {export_from} to {export_to}",
+                         f"Milk_Collections_{export_from}_to_{export_to}.{export_format}",
+                         [("Collections", queries.COLLECTIONS_BETWEEN, (export_from.isoformat(), export_to.isoformat()))])
+
+
+# Sales: promotion management. Saving a promo reruns the page so the cart picks it up.
+@st.fragment
+@profiler.traced("Promotions")
+def promotions_admin():
+    with st.expander("🎁 Promotions"):
+        df_promos = read_df("""
+            SELECT pr.id, pr.name AS Promo, pr.rule_type AS Type,
+                   COALESCE(group_concat(p.name, ', '), '') AS Products,
+                   COALESCE(pr.category, '') AS Category,
+                   pr.buy_qty AS "Buy / Min Qty", pr.free_qty AS Free, pr.min_lines AS "Min Items",
+                   pr.percent AS "%", pr.start_date AS Starts, COALESCE(pr.end_date, '—') AS Ends,
+                   CASE WHEN pr.is_active THEN 'Active' ELSE 'Paused' END AS Status
+            FROM promotions pr
+            LEFT JOIN promotion_targets pt ON pt.promotion_id = pr.id
+            LEFT JOIN products p ON p.id = pt.product_id
+            GROUP BY pr.id
+            ORDER BY pr.is_active DESC, pr.start_date DESC
+        """)
+        if df_promos.empty:
+            st.info("No promotions yet.")
+        else:
+            st.dataframe(df_promos.drop(columns="id"), width="stretch", hide_index=True)
+
+        st.markdown("**Add Promotion**")
+        all_products = read_all("SELECT id, name FROM products ORDER BY name")
+        product_names = {row["name"]: row["id"] for row in all_products}
+        with st.form("add_promo_form", clear_on_submit=True):
+            promo_name = st.text_input("Promo Name", placeholder="e.g. Weekend Yogurt Sale")
+            rule_type = st.selectbox("Type", promotions.RULE_TYPES,
+                                     help="Buy X Get Y: free units per X bought • Bundle: % off when enough different target products are bought • Percent Off: % off target lines")
+            target_names = st.multiselect("Target Products", list(product_names))
+            target_category = st.selectbox("...or whole Category", ["(none)", "Raw Milk", "Finished Goods", "By-Product"])
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                buy_qty = st.number_input("Buy X / Min Qty", min_value=0.0, value=10.0, step=1.0)
+            with col2:
+                free_qty = st.number_input("Get Y Free", min_value=0.0, value=1.0, step=1.0)
+            with col3:
+                min_lines = st.number_input("Bundle: Min Items", min_value=1, value=2, step=1)
+            with col4:
+                percent = st.number_input("Discount %", min_value=0.0, max_value=100.0, value=10.0, step=1.0)
+            col1, col2 = st.columns(2)
+            with col1:
+                start_date = st.date_input("Starts", value=date.today())
+            with col2:
+                end_date = st.date_input("Ends (leave empty for no end)", value=None)
+
+            if st.form_submit_button("Save Promotion", type="primary"):
+                category_value = None if target_category == "(none)" else target_category
+                if not promo_name.strip():
+                    st.error("Promo name is required.")
+                elif not target_names and not category_value:
+                    st.error("Choose target products or a category.")
+                elif end_date and end_date < start_date:
+                    st.error("End date is before the start date.")
+                elif rule_type == "Buy X Get Y" and buy_qty < 1:
+                    st.error("Buy X Get Y needs a Buy X quantity of at least 1.")
+                else:
+                    # Only the parameters the rule type uses are stored
+                    with write_tx() as conn:
+                        promo_id = conn.execute("""
+                            INSERT INTO promotions (name, rule_type, category, buy_qty, free_qty, min_lines, percent,
+                                                    start_date, end_date, created_by)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """, (promo_name.strip(), rule_type, category_value,
+                              buy_qty if rule_type in ["Buy X Get Y", "Percent Off"] else None,
+                              free_qty if rule_type == "Buy X Get Y" else None,
+                              min_lines if rule_type == "Bundle" else None,
+                              percent if rule_type in ["Bundle", "Percent Off"] else None,
+                              start_date.isoformat(), end_date.isoformat() if end_date else None,
+                              st.session_state.username)).lastrowid
+                        conn.executemany("INSERT INTO promotion_targets (promotion_id, product_id) VALUES (?, ?)",
+                                         [(promo_id, product_names[name]) for name in target_names])
+                    st.success(f"Promotion '{promo_name}' saved!")
+                    st.rerun(scope="app")
+
+        if not df_promos.empty:
+            st.markdown("**Pause / Resume / Delete**")
+            promo_labels = {f"{row.Promo} ({row.Status})": row.id for row in df_promos.itertuples()}
+            chosen = st.selectbox("Promotion", list(promo_labels), key="promo_manage_select")
+            promo_id = int(promo_labels[chosen])
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("⏯️ Pause / Resume", width="stretch"):
+                    with write_tx() as conn:
+                        conn.execute("UPDATE promotions SET is_active = 1 - is_active WHERE id = ?", (promo_id,))
+                    st.rerun(scope="app")
+            with col2:
+                if st.button("🗑️ Delete Promotion", width="stretch"):
+                    with write_tx() as conn:
+                        conn.execute("DELETE FROM promotion_targets WHERE promotion_id = ?", (promo_id,))
+                        conn.execute("DELETE FROM promotions WHERE id = ?", (promo_id,))
+                    st.rerun(scope="app")
+
+
+# Inventory: add / edit / delete / adjust forms. Depends on the product table read by the page.
+@st.fragment
+@profiler.traced("Inventory actions")
+def inventory_actions(df):
+    # Action selector
+    action = st.radio("Choose action:", 
+                      ["Add Product", "Edit Product", "Delete Product", "Adjust Stock"], 
+                      horizontal=True)
+
+    # === ADD PRODUCT ===
+    if action == "Add Product":
+        if st.session_state.role not in ["Admin", "Manager"]:
+            st.info("Only Admin/Manager can add products.")
+        else:
+            st.subheader("Add New Product")
+            with st.form("add_form", clear_on_submit=True):
+                name = st.text_input("Product Name")
+                category = st.selectbox("Category", ["Raw Milk", "Finished Goods", "By-Product"])
+                unit = st.selectbox("Unit", ["Liter", "Bottle", "Pack", "Kg", "Piece"])
+                srp = st.number_input("SRP (₱)", min_value=0.0, step=0.5)
+                stock = st.number_input("Initial Stock", min_value=0.0, step=0.1)
+                threshold = st.number_input("Low Stock Alert", min_value=1.0, value=10.0)
+                expiry = st.date_input("Initial Stock Expiry (leave empty if it doesn't expire)", value=None)
+
+                if st.form_submit_button("Save Product", type="primary"):
+                    if not name.strip():
+                        st.error("Product name is required!")
+                    else:
+                        try:
+                            with write_tx() as conn:
+                                pid = conn.execute("""
+                                    INSERT INTO products (name, category, unit, srp, current_stock, low_stock_threshold)
+                                    VALUES (?, ?, ?, ?, ?, ?)
+                                """, (name.strip(), category, unit, srp, stock, threshold)).lastrowid
+                                if stock > 0:
+                                    conn.execute("INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, recorded_by) VALUES (?, 'IN', ?, 'Initial stock', ?)",
+                                                 (pid, stock, st.session_state.username))
+                                if stock > 0 and inventory.is_lot_tracked(category):
+                                    inventory.receive_lot(conn, pid, stock, expiry.isoformat() if expiry else None)
+                            st.success(f"**{name}** added!")
+                            st.rerun(scope="app")
+                        except sqlite3.IntegrityError:
+                            st.error("Product name already exists!")
+
+    # === EDIT PRODUCT ===
+    elif action == "Edit Product":
+        if st.session_state.role not in ["Admin", "Manager"]:
+            st.info("Only Admin/Manager can edit.")
+        elif df.empty:
+            st.info("No products to edit.")
+        else:
+            st.subheader("Edit Product")
+            product_names = df["Product"].tolist()
+            selected_name = st.selectbox("Select product", product_names, key="edit_select_final")
+
+            pid = int(df[df["Product"] == selected_name]["id"].iloc[0])
+            current = read_one("SELECT * FROM products WHERE id = ?", (pid,))
+
+            if current:
+                with st.form("edit_form", clear_on_submit=True):
+                    e_name = st.text_input("Product Name", value=current["name"])
+                    e_category = st.selectbox("Category", ["Raw Milk", "Finished Goods", "By-Product"],
+                                              index=["Raw Milk", "Finished Goods", "By-Product"].index(current["category"]))
+                    e_unit = st.selectbox("Unit", ["Liter", "Bottle", "Pack", "Kg", "Piece"],
+                                          index=["Liter", "Bottle", "Pack", "Kg", "Piece"].index(current["unit"]))
+                    e_srp = st.number_input("SRP (₱)", min_value=0.0, value=float(current["srp"]))
+                    e_threshold = st.number_input("Low Stock Alert", min_value=1.0, value=float(current["low_stock_threshold"]))
+
+                    if st.form_submit_button("Update Product", type="primary"):
+                        try:
+                            with write_tx() as conn:
+                                conn.execute("""
+                                    UPDATE products SET name = ?, category = ?, unit = ?, srp = ?, low_stock_threshold = ?
+                                    WHERE id = ?
+                                """, (e_name.strip(), e_category, e_unit, e_srp, e_threshold, pid))
+                            st.success(f"**{e_name}** updated!")
+                            st.rerun(scope="app")
+                        except sqlite3.IntegrityError:
+                            st.error("Product name already exists!")
+            else:
+                st.error("Product not found.")
+
+    # === DELETE PRODUCT ===
+    elif action == "Delete Product":
+        if st.session_state.role != "Admin":
+            st.info("Only Admin can delete.")
+        elif df.empty:
+            st.info("No products to delete.")
+        else:
+            st.subheader("Delete Product")
+            product_names = df["Product"].tolist()
+            selected_name = st.selectbox("Select product", product_names, key="delete_select_final")
+            pid = int(df[df["Product"] == selected_name]["id"].iloc[0])
+
+            st.warning("This is permanent!")
+            if st.button("Yes, Delete Permanently", type="secondary"):
+                try:
+                    with write_tx() as conn:
+                        conn.execute("DELETE FROM products WHERE id = ?", (pid,))
+                    st.error(f"**{selected_name}** deleted!")
+                    st.rerun(scope="app")
+                except sqlite3.IntegrityError:
+                    st.error("This product has sales or stock history and cannot be deleted.")
+
+    # === ADJUST STOCK (NOW FULLY WORKING) ===
+    elif action == "Adjust Stock":
+        if st.session_state.role not in ["Admin", "Manager"]:
+            st.info("Only Admin/Manager can adjust stock.")
+        elif df.empty:
+            st.info("No products to adjust.")
+        else:
+            st.subheader("Adjust Stock")
+            product_names = df["Product"].tolist()
+            selected_name = st.selectbox("Select product", product_names, key="adjust_select_final")
+            pid = int(df[df["Product"] == selected_name]["id"].iloc[0])
+            lot_tracked = inventory.is_lot_tracked(df[df["Product"] == selected_name]["Category"].iloc[0])
+
+            with st.form("adjust_form", clear_on_submit=True):
+                adj_type = st.radio("Action", ["Add Stock", "Remove Stock"], horizontal=True)
+                qty = st.number_input("Quantity", min_value=0.01, step=0.1)
+                reason = st.text_input("Reason (optional)")
+                expiry = None
+                if lot_tracked:
+                    expiry = st.date_input("Expiry of Added Stock (leave empty if it doesn't expire)", value=None,
+                                           help="Removed stock is taken from the soonest-expiring lots first")
+
+                if st.form_submit_button("Apply Adjustment", type="primary"):
+                    if qty <= 0:
+                        st.error("Quantity must be greater than 0")
+                    else:
+                        trans = "IN" if adj_type == "Add Stock" else "OUT"
+                        try:
+                            with write_tx() as conn:
+                                conn.execute("INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, recorded_by) VALUES (?, ?, ?, ?, ?)",
+                                             (pid, trans, qty, reason.strip() or "Manual adjustment", st.session_state.username))
+                                if trans == "IN":
+                                    conn.execute("UPDATE products SET current_stock = current_stock + ? WHERE id = ?", (qty, pid))
+                                else:
+                                    # Guarded like checkout: another session may have sold the stock meanwhile
+                                    inventory.take_stock(conn, pid, qty)
+                                if lot_tracked and trans == "IN":
+                                    inventory.receive_lot(conn, pid, qty, expiry.isoformat() if expiry else None)
+                                elif lot_tracked:
+                                    inventory.allocate_fefo(conn, pid, qty)
+                        except inventory.StockShortage as e:
+                            st.error(f"Stock not adjusted for **{selected_name}**: {e}.")
+                        else:
+                            st.success(f"Stock adjusted for **{selected_name}**!")
+                            st.rerun(scope="app")  # Real-time update
+
+
+# Inventory: stock on any past date (from ledger checkpoints) and counter-vs-ledger reconciliation
+@st.fragment
+@profiler.traced("Stock ledger")
+def stock_ledger():
+    with st.expander("🧾 Stock Ledger: As-of Valuation & Reconciliation"):
+        as_of = st.date_input("Stock as of (end of day)", value=date.today().replace(day=1) - timedelta(days=1),
+                              max_value=date.today(), key="stock_as_of_date")
+        df_as_of = read_df(inventory.STOCK_AS_OF, {"day": as_of.isoformat()})
+        df_as_of["Value (₱)"] = (df_as_of["quantity"] * df_as_of["srp"]).round(0)
+        st.metric(f"Inventory Value on {as_of:%B %d, %Y}", f"₱{df_as_of['Value (₱)'].sum():,.0f}")
+        st.dataframe(df_as_of.rename(columns={"name": "Product", "category": "Category", "quantity": "Stock", "unit": "Unit", "srp": "SRP (₱)"})
+                     [["Product", "Category", "Stock", "Unit", "SRP (₱)", "Value (₱)"]],
+                     width="stretch", hide_index=True)
+
+        if st.session_state.role in ["Admin", "Manager"]:
+            st.caption("Reconciliation checks each product's stock counter against the ledger since its last checkpoint.")
+            if st.button("🔍 Reconcile Stock Counters", key="reconcile_stock"):
+                with write_tx() as conn:
+                    report = pd.DataFrame(inventory.reconcile(conn, date.today()))
+                drifted = report[report["drift"] != 0]
+                if drifted.empty:
+                    st.success(f"All {len(report)} products match the ledger.")
+                else:
+                    st.error(f"{len(drifted)} product(s) drifted from the ledger")
+                    st.dataframe(drifted.rename(columns={"name": "Product", "counter": "Counter", "ledger": "Ledger", "drift": "Drift"})
+                                 [["Product", "Counter", "Ledger", "Drift"]], width="stretch", hide_index=True)
+
+
+# Production: batch form. Depends on the raw milk on hand; a completed batch reruns the page.
+@st.fragment
+@profiler.traced("Production form")
+def production_batch_form(raw_available):
+    # === NEW PRODUCTION BATCH ===
+    st.subheader("🛠️ Start New Production Batch")
+
+    # Load Finished Goods
+    finished_products = read_all("SELECT id, name, unit FROM products WHERE category = 'Finished Goods' AND srp > 0 ORDER BY name")
+
+    if not finished_products:
+        st.error("No finished goods defined. Please add them in Inventory first.")
+        return
+
+    product_options = [f"{p['name']} ({p['unit']})" for p in finished_products]
+    selected_display = st.selectbox("Select Product to Produce", product_options, key="prod_product_select")
+    selected_product = finished_products[product_options.index(selected_display)]
+    prod_id = selected_product["id"]
+    prod_name = selected_product["name"]
+    prod_unit = selected_product["unit"]
+
+    # Conversion Ratios (Customizable per product)
+    conversion_ratios = {
+        "Fresh Milk 1L": 1.00,   # 1L raw → 1 bottle (minimal loss)
+        "Yogurt 500g": 1.05,     # Slight loss in processing
+        "Cheese 200g": 10.0,     # Approx 10L raw → 1kg cheese (adjust based on your actual yield)
+        # Add more products here as needed
+    }
+    liters_per_unit = conversion_ratios.get(prod_name, 1.0)
+
+    st.info(f"**Conversion Rate:** {liters_per_unit:.2f} Liters Raw Milk → 1 {prod_unit} of **{prod_name}**")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        units_to_produce = st.number_input(f"Quantity to Produce ({prod_unit})", min_value=1, step=1, value=10, key="units_input")
+    with col2:
+        raw_required = round(units_to_produce * liters_per_unit, 2)
+        st.metric("Raw Milk Required", f"{raw_required:.2f} L",
+                  delta=f"{raw_required - raw_available:.2f} L shortfall" if raw_required > raw_available else "Sufficient")
+
+    if raw_required > raw_available:
+        st.error("🚫 Not enough Raw Milk available. Reduce quantity or wait for more collections.")
+        return
+
+    waste_litres = st.number_input("Waste / Spoilage (Liters)", min_value=0.0, max_value=raw_required, step=0.1, value=0.0,
+                                   help="e.g. evaporation, testing, spillage")
+
+    total_raw_used = raw_required + waste_litres
+    if total_raw_used > raw_available:
+        st.error("Total raw milk used (including waste) exceeds available stock!")
+        return
+
+    batch_expiry = st.date_input("Batch Expiry Date", value=date.today() + timedelta(days=30),
+                                 min_value=date.today() + timedelta(days=7))
+
+    batch_notes = st.text_area("Batch Notes (optional)", placeholder="e.g. Batch #2025-001, pasteurized at 72°C for 15s, starter culture used")
+
+    if st.button("✅ Start Production Batch", type="primary", width="stretch"):
+        yield_percent = round((raw_required / total_raw_used) * 100, 1) if total_raw_used > 0 else 100
+
+        try:
+            with write_tx() as conn:
+                raw_pid = conn.execute("SELECT id FROM products WHERE name = 'Raw Milk'").fetchone()["id"]
+                batch_id = conn.execute("""
+                    INSERT INTO production_batches (product_id, units, raw_litres, waste_litres, yield_percent,
+                                                    expiry_date, operator, notes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (prod_id, units_to_produce, total_raw_used, waste_litres, yield_percent,
+                      batch_expiry.isoformat(), st.session_state.username, batch_notes.strip() or None)).lastrowid
+                reason = f"Production batch #{batch_id} → {units_to_produce} {prod_name}"
+
+                # 1. Deduct Raw Milk (guarded: another session's batch may have used it since the check above)
+                inventory.take_stock(conn, raw_pid, total_raw_used)
+                conn.execute("""
+                    INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, recorded_by, batch_id)
+                    VALUES (?, 'OUT', ?, ?, ?, ?)
+                """, (raw_pid, total_raw_used, reason, st.session_state.username, batch_id))
+
+                # 2. Add Finished Goods
+                conn.execute("UPDATE products SET current_stock = current_stock + ? WHERE id = ?", (units_to_produce, prod_id))
+                conn.execute("""
+                    INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, recorded_by, batch_id)
+                    VALUES (?, 'IN', ?, ?, ?, ?)
+                """, (prod_id, units_to_produce, reason, st.session_state.username, batch_id))
+                inventory.receive_lot(conn, prod_id, units_to_produce, batch_expiry.isoformat(), batch_id)
+
+                add_notification("Internal", None, f"New production: {units_to_produce} {prod_name} by {st.session_state.username}")
+        except inventory.StockShortage as e:
+            st.error(f"🚫 Production not recorded: not enough Raw Milk ({e}).")
+            return
+
+        st.success("Production batch completed successfully!")
+        st.success(f"**+{units_to_produce} {prod_name}** added to inventory")
+        st.info(f"Yield Efficiency: **{yield_percent}%**")
+        if waste_litres > 0:
+            st.warning(f"Recorded {waste_litres:.2f}L waste/spoilage")
+        st.balloons()
+
+        st.rerun(scope="app")
+
+
+# Production: last 30 days of batches
+@st.fragment
+@profiler.traced("Production history")
+def production_history():
+    # === PRODUCTION HISTORY ===
+    st.subheader("📋 Production History (Last 30 Days)")
+
+    since = (date.today() - timedelta(days=30)).isoformat()
+    df_prod_history = read_df(queries.PRODUCTION_HISTORY_SINCE, (since,))
+
+    if not df_prod_history.empty:
+        st.dataframe(df_prod_history, width="stretch", hide_index=True)
+
+        st.markdown("**Yield by Product**")
+        st.dataframe(read_df(queries.PRODUCTION_YIELD_SINCE, (since,)), width="stretch", hide_index=True)
+
+        if st.button("📥 Export Production Report", type="secondary"):
+            queue_export("Production Report (30 days)", f"Production_Report_{date.today().isoformat()}.xlsx", [
+                ("Batches", queries.PRODUCTION_HISTORY_SINCE, (since,)),
+                ("Yield_by_Product", queries.PRODUCTION_YIELD_SINCE, (since,)),
+            ])
+    else:
+        st.info("No production recorded in the last 30 days.")
+
+
+# Manage Farmers: per-farmer drill-down. Depends on the farmer list read by the page.
+@st.fragment
+@profiler.traced("Farmer deep dive")
+def farmer_deep_dive(df_farmers):
+    # === INDIVIDUAL FARMER DEEP DIVE ===
+    st.subheader("🔍 Farmer Performance Deep Dive")
+
+    # Always use fresh names from latest query
+    farmer_names = df_farmers["name"].tolist()
+    selected_farmer_name = st.selectbox("Select Farmer for Detailed View", farmer_names, key="deep_dive_select")
+
+    # Get fresh row & ID
+    farmer_row = df_farmers[df_farmers["name"] == selected_farmer_name].iloc[0]
+    farmer_id = int(farmer_row["id"])
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Current Tier", farmer_row["loyalty_tier"])
+    with col2:
+        st.metric("Lifetime Liters", f"{farmer_row['total_litres']:.1f} L")
+    with col3:
+        st.metric("Lifetime Earnings", f"₱{farmer_row['total_earnings']:,.0f}")
+    with col4:
+        st.metric("Total Deliveries", farmer_row["total_deliveries"])
+
+    # Monthly Trend Chart (same as before)
+    df_monthly = read_df(queries.FARMER_MONTHLY_TREND, (farmer_id,))
+
+    if not df_monthly.empty:
+        fig = go.Figure()
+        fig.add_trace(go.Bar(x=df_monthly['month'], y=df_monthly['liters'], name="Liters", marker_color="#2E8B57"))
+        fig.add_trace(go.Scatter(x=df_monthly['month'], y=df_monthly['earnings'], name="Earnings ₱", yaxis='y2', line=dict(color="#FFD700", width=3)))
+        fig.update_layout(
+            title=f"Monthly Performance - {selected_farmer_name}",
+            yaxis=dict(title="Liters"),
+            yaxis2=dict(title="Earnings ₱", overlaying="y", side="right"),
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+        )
+        st.plotly_chart(fig, width="stretch")
+    else:
+        st.info("No collection history yet for this farmer.")
+
+    # Recent Collections Table (same)
+    st.subheader("Recent Collections")
+    df_recent = read_df("""
+        SELECT 
+            collection_date AS Date,
+            ROUND(class_a_litres + class_b_litres, 1) AS Liters,
+            fat_percentage AS "Fat %",
+            snf_percentage AS "SNF %",
+            quality_score AS Score,
+            total_payment AS "Payment ₱",
+            notes
+        FROM milk_collections
+        WHERE farmer_id = ?
+        ORDER BY collection_date DESC
+        LIMIT 20
+    """, (farmer_id,))
+
+    if not df_recent.empty:
+        st.dataframe(df_recent.style.format({
+            "Liters": "{:.1f}",
+            "Fat %": "{:.2f}",
+            "SNF %": "{:.2f}",
+            "Score": "{:.0f}",
+            "Payment ₱": "₱{:.0f}"
+        }), width="stretch", hide_index=True)
+    else:
+        st.info("No collections recorded yet.")
+
+    # Edit Farmer Details (SAFE)
+    with st.expander("✏️ Edit Farmer Details", expanded=False):
+        current = read_one("SELECT name, contact, address, loyalty_tier FROM dairy_farmers WHERE id = ?", (farmer_id,))
+
+        if current is None:
+            st.error("Farmer data not loaded properly. Try refreshing or re-selecting the farmer.")
+        else:
+            with st.form("edit_farmer_form"):
+                edit_name = st.text_input("Name", value=current["name"])
+                edit_contact = st.text_input("Contact", value=current["contact"] or "")
+                edit_address = st.text_input("Address", value=current["address"] or "")
+                edit_tier = st.selectbox("Loyalty Tier", ["Bronze", "Silver", "Gold", "Platinum"], 
+                                         index=["Bronze", "Silver", "Gold", "Platinum"].index(current["loyalty_tier"]))
+                edit_submitted = st.form_submit_button("Update Farmer", type="primary")
+                if edit_submitted:
+                    with write_tx() as conn:
+                        conn.execute("""
+                            UPDATE dairy_farmers
+                            SET name = ?, contact = ?, address = ?, loyalty_tier = ?
+                            WHERE id = ?
+                        """, (edit_name.strip(), edit_contact or None, edit_address or None, edit_tier, farmer_id))
+                    st.success("Farmer details updated successfully!")
+                    st.rerun(scope="app")
+
+
+# Manage Customers: per-customer actions. Depends on the customer list read by the page.
+@st.fragment
+@profiler.traced("Manage customer")
+def manage_customer(df_customers):
+    if df_customers.empty:
+        st.info("No customers to manage.")
+    else:
+        st.subheader("Manage Customer")
+        customer_names = df_customers["name"].tolist()
+        selected_name = st.selectbox("Select customer", customer_names, key="manage_customer_select_final")
+
+        # Fresh query for selected customer (this is the key fix!)
+        selected_data = read_one("""
+            SELECT
+                c.id,
+                c.name,
+                c.type,
+                c.contact,
+                c.discount_type || ' ' || c.discount_value ||
+                    CASE WHEN c.discount_type = 'Percentage' THEN '%' ELSE ' ₱' END AS discount,
+                c.loyalty_points,
+                c.current_balance
+            FROM customers c
+            WHERE c.name = ?
+        """, (selected_name,))
+
+        if selected_data:
+            cid = selected_data["id"]
+
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Type", selected_data["type"])
+            with col2:
+                st.metric("Discount", selected_data["discount"])
+            with col3:
+                st.metric("Points", f"{selected_data['loyalty_points']:,}")
+            with col4:
+                balance = selected_data["current_balance"]
+                st.metric("Balance", f"₱{balance:,.2f}" if balance > 0 else "Clear")
+
+            subtab_edit, subtab_balance, subtab_pass, subtab_del = st.tabs(["Edit Details", "Balance", "Password", "Delete"])
+
+            with subtab_edit:
+                current = read_one("SELECT * FROM customers WHERE id = ?", (cid,))
+                if current:
+                    with st.form("edit_customer_form_final"):
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            e_name = st.text_input("Name", value=current["name"])
+                            e_type = st.selectbox("Type", ["Reseller", "Distributor", "Institutional Buyer"],
+                                                  index=["Reseller", "Distributor", "Institutional Buyer"].index(current["type"]))
+                            e_contact = st.text_input("Contact", value=current["contact"] or "")
+                        with col2:
+                            e_discount_type = st.selectbox("Discount Type", ["Percentage", "Fixed"],
+                                                           index=["Percentage", "Fixed"].index(current["discount_type"]))
+                            e_discount_value = st.number_input("Discount Value", min_value=0.0, value=float(current["discount_value"]))
+                            e_points = st.number_input("Points", min_value=0, value=current["loyalty_points"])
+
+                        if st.form_submit_button("Update Details", type="primary"):
+                            try:
+                                with write_tx() as conn:
+                                    conn.execute("""
+                                        UPDATE customers SET name = ?, type = ?, contact = ?, discount_type = ?, discount_value = ?, loyalty_points = ?
+                                        WHERE id = ?
+                                    """, (e_name.strip(), e_type, e_contact or None, e_discount_type, e_discount_value, e_points, cid))
+                                st.success(f"**{e_name}** details updated successfully!")
+                                st.rerun(scope="app")
+                            except sqlite3.IntegrityError:
+                                st.error("Name already exists!")
+
+            with subtab_balance:
+                st.subheader("Balance Adjustment")
+                with st.form("balance_form_final"):
+                    action = st.radio("Action", ["Record Payment (reduce)", "Add Credit (increase)"])
+                    amount = st.number_input("Amount ₱", min_value=0.01)
+                    note = st.text_input("Note (optional)")
+
+                    if st.form_submit_button("Apply", type="primary"):
+                        op = -1 if "Payment" in action else 1
+                        new_balance = selected_data["current_balance"] + (amount * op)
+                        with write_tx() as conn:
+                            conn.execute("UPDATE customers SET current_balance = ? WHERE id = ?", (new_balance, cid))
+                        st.success(f"Balance updated successfully! New balance: ₱{new_balance:,.2f}")
+                        st.rerun(scope="app")
+
+            with subtab_pass:
+                st.subheader("Reset Password")
+                new_p = st.text_input("New Password", type="password")
+                confirm_p = st.text_input("Confirm Password", type="password")
+                if st.button("Reset Password", type="secondary"):
+                    if new_p == confirm_p and new_p.strip():
+                        with write_tx() as conn:
+                            conn.execute("UPDATE customers SET password = ? WHERE id = ?", (new_p, cid))
+                        st.success("Password reset successfully!")
+                        st.rerun(scope="app")
+                    else:
+                        st.error("Passwords don't match or empty.")
+
+            with subtab_del:
+                if st.session_state.role == "Admin":
+                    st.warning("Permanent action!")
+                    if st.button("Delete Customer Permanently", type="secondary"):
+                        try:
+                            with write_tx() as conn:
+                                conn.execute("DELETE FROM customers WHERE id = ?", (cid,))
+                            st.error(f"Customer **{selected_name}** deleted successfully!")
+                            st.rerun(scope="app")
+                        except sqlite3.IntegrityError:
+                            st.error("This customer has purchase history and cannot be deleted.")
+                else:
+                    st.info("Only Admin can delete.")
+        else:
+            st.error("Customer not found.")
+
+
+# Announcements: history list; deleting one only redraws this list
+@st.fragment
+@profiler.traced("Announcement history")
+def announcement_history():
+    # === ANNOUNCEMENT HISTORY ===
+    st.subheader("📜 Announcement History")
+
+    df_ann = read_df("""
+        SELECT id, title, content, target_type, created_date
+        FROM announcements
+        ORDER BY created_date DESC
+    """)
+
+    if df_ann.empty:
+        st.info("No announcements yet.")
+    else:
+        files = attachments.for_announcements(read_all, df_ann["id"].tolist())
+        for _, row in df_ann.iterrows():
+            priority_badge = "🔴 **HIGH PRIORITY**" if "🔴" in row["title"] else ""
+            clean_title = row["title"].replace("🔴 URGENT: ", "").replace("🔴 ", "")
+
+            with st.expander(f"{priority_badge} **{clean_title}** • To: {row['target_type']} • {row['created_date']}", expanded=False):
+                st.markdown(row["content"], unsafe_allow_html=True)
+                show_attachments(row["id"], files.get(row["id"], []))
+
+                if st.button("Delete Announcement", key=f"del_ann_{row['id']}", type="secondary"):
+                    if st.session_state.role == "Admin":
+                        with write_tx() as conn:
+                            conn.execute("DELETE FROM announcement_attachments WHERE announcement_id = ?", (row["id"],))
+                            conn.execute("DELETE FROM announcements WHERE id = ?", (row["id"],))
+                            unused = attachments.prune(conn)
+                        with write_tx() as conn:
+                            attachments.remove_files(conn, unused)
+                        st.error("Announcement deleted!")
+                        st.rerun(scope="fragment")
+                    else:
+                        st.error("Only Admin can delete.")
+
+
+# Announcements: thumbnails inline; the full image is only sent when asked for,
+# and a file is only read from disk when its download button is clicked
+def show_attachments(announcement_id, files):
+    for f in files:
+        size_kb = f["bytes"] / 1024
+        if f["kind"] == "image":
+            if st.toggle(f"🔍 Full size ({size_kb:,.0f} KB)", key=f"full_image_{announcement_id}_{f['id']}"):
+                st.image(f["path"], caption=f"{f['width']}×{f['height']}")
+            else:
+                st.image(f["thumb_path"])
+        else:
+            st.download_button(f"📎 {f['original_name']} ({size_kb:,.0f} KB)", partial(attachments.read_file, f["path"]),
+                               file_name=f["original_name"], mime=f["mime"], key=f"attachment_{announcement_id}_{f['id']}")
+
+
+# Portals: newest announcements first, a page at a time
+@st.fragment
+@profiler.traced("Announcements")
+def portal_announcements(sql, params):
+    shown = st.session_state.setdefault("announcements_shown", queries.ANNOUNCEMENTS_PAGE)
+    df_ann = read_df(sql, params + (shown + 1,))
+
+    if df_ann.empty:
+        st.info("No announcements at this time.")
+        return
+    files = attachments.for_announcements(read_all, df_ann["id"].head(shown).tolist())
+    for _, ann in df_ann.head(shown).iterrows():
+        priority = "🔴 **URGENT**" if "🔴" in ann["title"] else ""
+        clean_title = ann["title"].replace("🔴 URGENT: ", "").replace("🔴 ", "")
+        with st.expander(f"{priority} **{clean_title}** • {ann['created_date']}"):
+            st.markdown(ann["content"], unsafe_allow_html=True)
+            show_attachments(ann["id"], files.get(ann["id"], []))
+    if len(df_ann) > shown:
+        st.button("Show older announcements", key="announcements_more", on_click=show_more_announcements)
+
+
+def show_more_announcements():
+    st.session_state.announcements_shown += queries.ANNOUNCEMENTS_PAGE
+
+
+# Messages: threaded inbox. Threads come a page at a time from message_threads;
+# only the open thread's messages are read and only it gets a reply form.
+@st.fragment
+@profiler.traced("Message inbox")
+def message_inbox():
+    st.subheader("Incoming Messages from Farmers & Customers")
+
+    summary = read_one(messaging.UNREAD_SUMMARY)
+    if summary["threads"]:
+        st.success(f"**{summary['messages']}** unread message(s) in **{summary['threads']}** conversation(s)")
+
+    unread_only = st.toggle("Unread only", key="inbox_unread_only")
+    # Start cursor of every page visited so far; the last one is the page shown
+    if st.session_state.get("inbox_filter") != unread_only:
+        st.session_state.inbox_filter = unread_only
+        st.session_state.inbox_cursors = [messaging.FIRST_PAGE]
+    cursors = st.session_state.inbox_cursors
+
+    threads, next_cursor = messaging.thread_page(read_all, cursors[-1], unread_only)
+    if not threads:
+        if unread_only:
+            st.info("No unread conversations. 🎉")
+        else:
+            st.info("No incoming messages yet. When farmers or customers send messages from their portal, they will appear here.")
+        return
+
+    open_thread = st.session_state.get("inbox_open_thread")
+    for thread in threads:
+        icon = "🐄" if thread["party_type"] == "Farmer" else "🏪"
+        badge = f" • 🟡 **{thread['unread_count']} new**" if thread["unread_count"] else ""
+        col1, col2 = st.columns([6, 1])
+        with col1:
+            st.markdown(f"{icon} **{thread['party_name']}** • {thread['last_message_at']}{badge}")
+            st.caption(thread["last_preview"] or "")
+        with col2:
+            is_open = thread["id"] == open_thread
+            st.button("Close" if is_open else "Open", key=f"open_thread_{thread['id']}", width="stretch",
+                      on_click=toggle_thread, args=(thread["id"], thread["unread_count"]))
+        if thread["id"] == open_thread:
+            with st.container(border=True):
+                show_thread(thread)
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        st.button("← Newer", disabled=len(cursors) == 1, width="stretch", key="inbox_newer",
+                  on_click=cursors.pop)
+    with col2:
+        st.caption(f"Page {len(cursors)}")
+    with col3:
+        st.button("Older →", disabled=next_cursor is None, width="stretch", key="inbox_older",
+                  on_click=cursors.append, args=(next_cursor,))
+
+
+def toggle_thread(thread_id, unread_count):
+    # Button callback: runs before the fragment reruns
+    is_open = st.session_state.get("inbox_open_thread") == thread_id
+    st.session_state.inbox_open_thread = None if is_open else thread_id
+    if not is_open and unread_count:
+        with write_tx() as conn:
+            messaging.mark_read(conn, thread_id)
+
+
+def show_thread(thread):
+    messages = messaging.thread_messages(read_all, thread["id"])
+    if thread["message_count"] > len(messages):
+        st.caption(f"Showing the latest {len(messages)} of {thread['message_count']} messages")
+    for msg in messages:
+        from_staff = msg["sender_type"] == "Internal"
+        with st.chat_message("assistant" if from_staff else "user"):
+            st.caption(f"{msg['sender_name']} • {msg['timestamp']}")
+            st.write(msg["message"])
+
+    with st.form(f"reply_form_{thread['id']}", clear_on_submit=True):
+        reply_text = st.text_area("Your reply", height=100, key=f"reply_text_{thread['id']}")
+        if st.form_submit_button("Send Reply", type="primary"):
+            if reply_text.strip():
+                with write_tx() as conn:
+                    messaging.post_message(conn, thread["party_type"], thread["party_id"], thread["party_name"],
+                                           "Internal", st.session_state.user_id, st.session_state.username, reply_text.strip())
+                    add_notification(thread["party_type"], thread["party_id"], "New reply from Mindoro Dairy management")
+                st.success("Reply sent successfully!")
+                st.rerun(scope="fragment")
+            else:
+                st.error("Cannot send empty reply.")
+
+
+# Portals: the party's own conversation with management, newest messages last
+def party_conversation(party_type, party_id):
+    thread = read_one(messaging.PARTY_THREAD, (party_type, party_id))
+    if thread is None:
+        return
+    for msg in messaging.thread_messages(read_all, thread["id"], limit=20):
+        from_staff = msg["sender_type"] == "Internal"
+        with st.chat_message("assistant" if from_staff else "user"):
+            st.caption(f"{'Mindoro Dairy' if from_staff else 'You'} • {msg['timestamp']}")
+            st.write(msg["message"])
+
+
+# Notifications: one recipient's feed, a page at a time, newest first.
+# Staff, farmers and customers each see only their own deliveries and read state.
+@st.fragment
+@profiler.traced("Notification feed")
+def notification_feed(recipient_type, recipient_id):
+    unread_count, read_through = notifications.inbox(read_one, recipient_type, recipient_id)
+    if unread_count > 0:
+        st.success(f"You have **{unread_count}** unread notification(s)")
+        # Watermark at the newest delivery now; anything arriving after this render stays unread
+        latest = read_one(notifications.LATEST_DELIVERY, (recipient_type, recipient_id))[0]
+        st.button("Mark All as Read", type="secondary", key="notifications_mark_read",
+                  on_click=mark_notifications_read, args=(recipient_type, recipient_id, latest))
+
+    # Start cursor of every page visited so far; the last one is the page shown
+    cursors = st.session_state.setdefault("notification_cursors", [notifications.FIRST_PAGE])
+    rows, next_cursor = notifications.feed_page(read_all, recipient_type, recipient_id, cursors[-1])
+    if not rows:
+        st.info("No notifications yet.")
+        return
+
+    for notif in rows:
+        badge = "🟡 New" if notif["id"] > read_through else "✅ Read"
+        with st.chat_message("assistant"):
+            st.caption(f"{badge} • {notif['created_date']}")
+            st.write(notif["message"])
+
+    if len(cursors) > 1 or next_cursor is not None:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            st.button("← Newer", disabled=len(cursors) == 1, width="stretch", key="notifications_newer",
+                      on_click=cursors.pop)
+        with col2:
+            st.caption(f"Page {len(cursors)}")
+        with col3:
+            st.button("Older →", disabled=next_cursor is None, width="stretch", key="notifications_older",
+                      on_click=cursors.append, args=(next_cursor,))
+
+
+def mark_notifications_read(recipient_type, recipient_id, latest):
+    # Button callback: runs before the fragment reruns
+    with write_tx() as conn:
+        notifications.mark_read_through(conn, recipient_type, recipient_id, latest)
+
+
+# Pricing: reprice the last year of deliveries under a proposed schedule, then publish it
+@st.fragment
+@profiler.traced("Schedule planner")
+def price_schedule_planner(current):
+    st.subheader("🧮 What-If: Proposed Schedule")
+    st.caption(f"Starts from the schedule in force today ({current.name}). Edit the rates and steps, compare, then publish.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        base_price = st.number_input("Base Price ₱/L", min_value=0.0, value=current.base_price, step=0.5, key="plan_base")
+    with col2:
+        consistency = st.number_input("Consistency Bonus ₱/L (delivered yesterday)", min_value=0.0,
+                                      value=current.consistency_bonus, step=0.5, key="plan_consistency")
+    loyalty = {}
+    for col, tier in zip(st.columns(len(pricing.TIERS)), pricing.TIERS):
+        with col:
+            loyalty[tier] = st.number_input(f"{tier} ₱/L", min_value=0.0, value=current.loyalty[tier], step=0.5, key=f"plan_loyalty_{tier}")
+
+    st.markdown("**Bonus Steps** — fat/SNF in %, volume in liters per delivery; each delivery earns the bonus of the highest step it reaches")
+    steps = st.data_editor(
+        current.steps_frame(), num_rows="dynamic", hide_index=True, width="stretch", key="plan_steps",
+        column_config={
+            "component": st.column_config.SelectboxColumn("Component", options=pricing.COMPONENTS, required=True),
+            "threshold": st.column_config.NumberColumn("Threshold", min_value=0.0, required=True),
+            "bonus": st.column_config.NumberColumn("Bonus ₱/L", min_value=0.0, required=True),
+        },
+    )
+    steps = steps.dropna().drop_duplicates(["component", "threshold"], keep="last")
+    step_lists = {c: list(zip(g["threshold"], g["bonus"])) for c, g in steps.groupby("component")}
+    proposed = pricing.PriceSchedule({
+        "id": None, "name": "Proposed", "effective_date": None, "base_price": base_price, "consistency_bonus": consistency,
+        **{f"loyalty_{tier.lower()}": value for tier, value in loyalty.items()},
+    }, step_lists)
+
+    since = date.today() - timedelta(days=365)
+    history = read_df(queries.COLLECTIONS_FOR_REPRICING, (since.isoformat(),))
+    if history.empty:
+        st.info("No deliveries in the last 12 months to compare against.")
+    else:
+        repriced = pricing.reprice(history, proposed)
+        actual, new_total = repriced["total_payment"].sum(), repriced["proposed_payment"].sum()
+        change = new_total - actual
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Deliveries Repriced", f"{len(repriced):,}")
+        with col2:
+            st.metric("Actually Paid (12 mo)", f"₱{actual:,.0f}")
+        with col3:
+            st.metric("Under Proposal", f"₱{new_total:,.0f}", delta=f"₱{change:+,.0f}", delta_color="inverse")
+        with col4:
+            st.metric("Change", f"{change / actual:+.1%}" if actual else "—")
+
+        repriced["month"] = repriced["collection_date"].str[:7]
+        df_month = repriced.groupby("month")[["total_payment", "proposed_payment"]].sum().reset_index()
+        df_month = df_month.rename(columns={"total_payment": "Actual", "proposed_payment": "Proposed"})
+        fig = px.bar(df_month, x="month", y=["Actual", "Proposed"], barmode="group",
+                     title="Monthly Farmer Payments: Actual vs Proposed",
+                     color_discrete_sequence=["#2E8B57", "#FFD700"])
+        st.plotly_chart(fig, width="stretch")
+
+        df_farmers = repriced.groupby("farmer")[["litres", "total_payment", "proposed_payment", "difference"]].sum()
+        df_farmers = df_farmers.reindex(df_farmers["difference"].abs().sort_values(ascending=False).index).head(15)
+        st.markdown("**Farmers Most Affected**")
+        st.dataframe(df_farmers.reset_index().rename(columns={
+            "farmer": "Farmer", "litres": "Liters", "total_payment": "Actual ₱",
+            "proposed_payment": "Proposed ₱", "difference": "Difference ₱",
+        }).style.format({"Liters": "{:,.1f}", "Actual ₱": "₱{:,.2f}", "Proposed ₱": "₱{:,.2f}", "Difference ₱": "₱{:+,.2f}"}),
+            width="stretch", hide_index=True)
+
+    with st.form("publish_schedule_form"):
+        st.markdown("**Publish as New Schedule**")
+        col1, col2 = st.columns(2)
+        with col1:
+            name = st.text_input("Schedule Name", placeholder="e.g. Rainy season rates")
+        with col2:
+            effective_date = st.date_input("Effective From", value=date.today() + timedelta(days=1), min_value=date.today())
+        notes = st.text_area("Notes (optional)")
+        if st.form_submit_button("📢 Publish Schedule", type="primary"):
+            if not name.strip():
+                st.error("Schedule name is required.")
+            else:
+                try:
+                    with write_tx() as conn:
+                        pricing.save_schedule(conn, name.strip(), effective_date.isoformat(), base_price, consistency, loyalty,
+                                              steps[["component", "threshold", "bonus"]].itertuples(index=False),
+                                              notes.strip(), st.session_state.username)
+                    st.success(f"Schedule '{name}' takes effect on {effective_date:%B %d, %Y}.")
+                    st.rerun(scope="app")
+                except sqlite3.IntegrityError:
+                    st.error("A schedule already starts on that date.")
+
+# Performance: where query time goes, per page, since the server started or the last reset.
+# Everything here comes from the tracer's memory; the page itself runs no queries.
+@st.fragment
+@profiler.traced("Performance report")
+def performance_report():
+    pool = get_pool()
+    tracer = pool.tracer
+    stats = pd.DataFrame(tracer.stats())
+    lookups = pool.cache.hits + pool.cache.misses
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Queries Run", f"{int(stats['calls'].sum()) if not stats.empty else 0:,}")
+    with col2:
+        st.metric("Query Time", f"{stats['total_ms'].sum() / 1000 if not stats.empty else 0:,.2f} s")
+    with col3:
+        st.metric("Cache Hit Rate", f"{pool.cache.hits / lookups:.0%}" if lookups else "—")
+    with col4:
+        st.metric("Slow Queries", len(tracer.slow))
+    st.caption(f"Since {datetime.fromtimestamp(tracer.started):%Y-%m-%d %H:%M} • "
+               f"slow = over {tracer.slow_seconds * 1000:.0f} ms • labels in [brackets] are background threads")
+
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        st.button("🔄 Refresh", key="perf_refresh", width="stretch")
+    with col2:
+        st.button("🗑️ Reset Statistics", key="perf_reset", width="stretch", on_click=tracer.reset)
+
+    if stats.empty:
+        st.info("No queries traced yet. Open a few pages and come back.")
+        return
+
+    st.subheader("📄 Query Time by Page")
+    st.caption(f"Over the last {len(tracer.samples):,} statements")
+    st.dataframe(pd.DataFrame(tracer.page_stats()).style.format({"total_ms": "{:,.1f}", "p95_ms": "{:,.2f}", "max_ms": "{:,.2f}"}),
+                 width="stretch", hide_index=True)
+
+    st.subheader("🐢 Top Queries by Total Time")
+    page_filter = st.selectbox("Page", ["All pages"] + sorted(stats["page"].unique()), key="perf_page")
+    shown = stats if page_filter == "All pages" else stats[stats["page"] == page_filter]
+    st.dataframe(shown.head(50).style.format({"total_ms": "{:,.1f}", "mean_ms": "{:,.2f}", "p95_ms": "{:,.2f}", "max_ms": "{:,.2f}"}),
+                 width="stretch", hide_index=True,
+                 column_config={"query": st.column_config.TextColumn("query", width="large")})
+
+    st.subheader("🔍 Slow Query Log")
+    if not tracer.slow:
+        st.success(f"No query has taken over {tracer.slow_seconds * 1000:.0f} ms.")
+    for entry in list(tracer.slow)[:20]:
+        with st.expander(f"{entry['ms']:,.0f} ms • {entry['page']} • {entry['kind']} • {entry['recorded_at']}"):
+            st.code(entry["query"], language="sql")
+            st.caption(f"Parameters: {entry['params']} • {entry['rows']:,} row(s)")
+            st.code(entry["plan"] or "(no plan)", language="text")
+
+# Rerun profiles: where this session's recent reruns spent their time, step by step
+def span_tree(run):
+    return "\n".join(f"{'  ' * depth}{span.name:<{40 - 2 * depth}} {span.seconds * 1000:>9.1f} ms" for depth, span in run.walk())
+
+@st.fragment
+def rerun_profiles():
+    st.subheader("🧵 Rerun Profiles (This Session)")
+    if not profiler.enabled:
+        st.info("Profiling is off. Start the app with DAIRY_PROFILE=1 to record every rerun, "
+                "or DAIRY_PROFILE=cprofile to add a cProfile report to each one.")
+        return
+    runs = [run for run in reversed(profiler.runs()) if run.end is not None]
+    if not runs:
+        st.info("No finished reruns yet. Open a few pages and come back.")
+        return
+
+    st.dataframe(pd.DataFrame([{
+        "started": datetime.fromtimestamp(run.started_at).strftime("%H:%M:%S"), "rerun": run.label, "total_ms": run.seconds * 1000,
+        "slowest step": max(run.children, key=lambda span: span.seconds).name if run.children else "",
+    } for run in runs]).style.format({"total_ms": "{:,.1f}"}), width="stretch", hide_index=True)
+    st.download_button("⬇️ Download Chrome Trace (JSON)", partial(profiling.chrome_trace_json, list(reversed(runs))),
+                       file_name=f"reruns_{datetime.now():%Y%m%d_%H%M%S}.json", mime="application/json",
+                       help="Open in chrome://tracing or ui.perfetto.dev")
+
+    # By index: widget options are deep-copied, and a run holds its cProfile state
+    run = runs[st.selectbox("Rerun", range(len(runs)), key="profile_run", format_func=lambda i: (
+        f"{datetime.fromtimestamp(runs[i].started_at):%H:%M:%S} • {runs[i].label} • {runs[i].seconds * 1000:,.0f} ms"))]
+    st.code(span_tree(run), language="text")
+    hotspots = run.hotspots()
+    if hotspots:
+        with st.expander("cProfile (by cumulative time)"):
+            st.code(hotspots, language="text")
+
+
 # ========================
 # MAIN APP (INTERNAL ONLY - SIMPLIFIED FOR SPACE)
 # ========================
@@ -383,37 +1792,36 @@ if st.session_state.user_type == "Internal":
     st.title("🏢 Mindoro Dairy Management System")
 
     menu = {
-        "Admin": ["Dashboard", "Milk Collection", "Sales", "Inventory", "Production", "Manage Farmers", "Manage Customers", "Announcements", "Messages & Notifications"],
-        "Manager": ["Dashboard", "Milk Collection", "Sales", "Inventory", "Production", "Manage Customers", "Announcements", "Messages & Notifications"],
+        "Admin": ["Dashboard", "Milk Collection", "Sales", "Inventory", "Production", "Manage Farmers", "Manage Customers", "Pricing", "Announcements", "Messages & Notifications", "Performance"],
+        "Manager": ["Dashboard", "Milk Collection", "Sales", "Inventory", "Production", "Manage Customers", "Pricing", "Announcements", "Messages & Notifications"],
         "Sales Clerk": ["Dashboard", "Sales", "Messages & Notifications"],
         "Field Staff": ["Dashboard", "Milk Collection", "Messages & Notifications"]
     }
     pages = menu.get(st.session_state.role, ["Dashboard"])
     selection = st.sidebar.radio("Navigation", pages)
-
-    conn = get_conn()
+    set_current_page(selection)
 
     if selection == "Dashboard":
         st.header("🚀 Command Center - Super Advanced Analytics Dashboard")
         st.markdown(f"**Maligayang pagbati, {st.session_state.username.title()} ({st.session_state.role})!** | **{date.today().strftime('%A, %B %d, %Y')}**")
 
         # === KEY METRICS ===
+        profiler.section("KPI cards")
         today_str = date.today().isoformat()
         yesterday_str = (date.today() - timedelta(days=1)).isoformat()
-        this_month = date.today().strftime('%Y-%m')
-
-        # Sales & Milk Today/Yesterday
-        sales_today = pd.read_sql_query(f"SELECT COALESCE(SUM(total_amount), 0) AS total FROM sales WHERE sale_date = '{today_str}'", conn).iloc[0]['total']
-        sales_yest = pd.read_sql_query(f"SELECT COALESCE(SUM(total_amount), 0) AS total FROM sales WHERE sale_date = '{yesterday_str}'", conn).iloc[0]['total']
+        this_month = queries.month_key(date.today())
 
-        milk_today = pd.read_sql_query(f"SELECT COALESCE(SUM(class_a_litres + class_b_litres), 0) AS total FROM milk_collections WHERE collection_date = '{today_str}'", conn).iloc[0]['total']
-        milk_yest = pd.read_sql_query(f"SELECT COALESCE(SUM(class_a_litres + class_b_litres), 0) AS total FROM milk_collections WHERE collection_date = '{yesterday_str}'", conn).iloc[0]['total']
+        # Sales & Milk Today/Yesterday (today first, then yesterday, from the daily_summary rollup)
+        df_days = read_df(queries.DAILY_SUMMARY_FOR_DATES, (today_str, yesterday_str))
+        sales_today, sales_yest = df_days["revenue"]
+        milk_today, milk_yest = df_days["litres"]
+        active_farmers_today = df_days["distinct_farmers"].iloc[0]
 
         # Additional KPIs
-        inv_value = pd.read_sql_query("SELECT COALESCE(SUM(current_stock * srp), 0) FROM products WHERE srp > 0", conn).iloc[0,0]
-        low_stock_count = pd.read_sql_query("SELECT COUNT(*) FROM products WHERE current_stock <= low_stock_threshold AND current_stock > 0 AND category != 'Raw Milk'", conn).iloc[0,0]
-        active_farmers_today = pd.read_sql_query(f"SELECT COUNT(DISTINCT farmer_id) FROM milk_collections WHERE collection_date = '{today_str}'", conn).iloc[0,0]
-        total_farmers = pd.read_sql_query("SELECT COUNT(*) FROM dairy_farmers", conn).iloc[0,0]
+        stock_kpis = read_one(queries.DASHBOARD_STOCK_KPIS)
+        inv_value = stock_kpis["inv_value"]
+        low_stock_count = stock_kpis["low_stock_count"]
+        total_farmers = stock_kpis["total_farmers"]
 
         revenue_per_liter = round(sales_today / milk_today, 1) if milk_today > 0 else 0
         estimated_cost_per_liter = 85  # Adjustable
@@ -440,26 +1848,9 @@ if st.session_state.user_type == "Internal":
         col_left, col_right = st.columns(2)
 
         with col_left:
+            profiler.section("Trend chart")
             st.subheader("📈 Milk Collection vs Revenue Trend (Last 30 Days)")
-            df_trend = pd.read_sql_query(f"""
-                SELECT 
-                    date,
-                    COALESCE(milk_litres, 0) AS milk_litres,
-                    COALESCE(revenue, 0) AS revenue
-                FROM (
-                    SELECT collection_date AS date, SUM(class_a_litres + class_b_litres) AS milk_litres, 0 AS revenue
-                    FROM milk_collections 
-                    WHERE collection_date >= date('now', '-30 days')
-                    GROUP BY date
-                    UNION ALL
-                    SELECT sale_date AS date, 0 AS milk_litres, SUM(total_amount) AS revenue
-                    FROM sales 
-                    WHERE sale_date >= date('now', '-30 days')
-                    GROUP BY date
-                ) 
-                GROUP BY date 
-                ORDER BY date
-            """, conn)
+            df_trend = read_df(queries.DASHBOARD_TREND_30D)
 
             if not df_trend.empty:
                 fig = go.Figure()
@@ -472,24 +1863,14 @@ if st.session_state.user_type == "Internal":
                     legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
                     hovermode="x unified"
                 )
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(fig, width="stretch")
             else:
                 st.info("No data in the last 30 days yet.")
 
         with col_right:
+            profiler.section("Top farmers")
             st.subheader("🥇 Top Performing Farmers (This Month)")
-            df_top_farmers = pd.read_sql_query(f"""
-                SELECT 
-                    df.name AS Farmer,
-                    ROUND(SUM(mc.class_a_litres + mc.class_b_litres), 1) AS Liters,
-                    SUM(mc.total_payment) AS Earnings
-                FROM milk_collections mc
-                JOIN dairy_farmers df ON mc.farmer_id = df.id
-                WHERE strftime('%Y-%m', mc.collection_date) = '{this_month}'
-                GROUP BY df.name
-                ORDER BY Liters DESC
-                LIMIT 10
-            """, conn)
+            df_top_farmers = read_df(queries.TOP_FARMERS_FOR_MONTH, (this_month,))
 
             if not df_top_farmers.empty:
                 fig = px.bar(df_top_farmers, x='Farmer', y='Liters', color='Earnings',
@@ -498,7 +1879,7 @@ if st.session_state.user_type == "Internal":
                              text='Liters')
                 fig.update_traces(textposition='outside')
                 fig.update_layout(showlegend=False, xaxis_tickangle=-45)
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(fig, width="stretch")
 
                 df_top_farmers['Earnings'] = df_top_farmers['Earnings'].apply(lambda x: f"₱{x:,.0f}")
                 st.dataframe(df_top_farmers.style.format({"Liters": "{:.1f}"}), hide_index=True)
@@ -508,6 +1889,7 @@ if st.session_state.user_type == "Internal":
         st.divider()
 
         # === PREDICTIVE ALERTS & INSIGHTS ===
+        profiler.section("Alerts")
         st.subheader("🔮 Smart Alerts & Insights")
         alerts = []
 
@@ -529,45 +1911,28 @@ if st.session_state.user_type == "Internal":
         st.divider()
 
         # === RECENT ACTIVITY FEED ===
+        profiler.section("Activity feed")
         st.subheader("🕒 Recent Activity (Last 20 Events)")
-        df_recent = pd.read_sql_query("""
-            SELECT 'Milk Collection' AS type, collection_date AS date,
-                   df.name || ' delivered ' || ROUND(mc.class_a_litres + mc.class_b_litres, 1) || 'L → ₱' || COALESCE(mc.total_payment, 0) AS activity
-            FROM milk_collections mc
-            JOIN dairy_farmers df ON mc.farmer_id = df.id
-            UNION ALL
-            SELECT 'Sale' AS type, sale_date AS date,
-                   'Sale #' || s.id || ' → ₱' || s.total_amount || ' (' || s.payment_type || ')' AS activity
-            FROM sales s
-            ORDER BY date DESC, activity DESC
-            LIMIT 20
-        """, conn)
+        df_recent = read_df(queries.RECENT_ACTIVITY)
 
         if not df_recent.empty:
             df_recent = df_recent.rename(columns={"type": "Type", "date": "Date", "activity": "Activity"})
-            st.dataframe(df_recent, use_container_width=True, hide_index=True)
+            st.dataframe(df_recent, width="stretch", hide_index=True)
         else:
             st.info("No recent activity yet.")
 
         st.divider()
 
         # === EXPORT DASHBOARD DATA ===
-        if st.button("📊 Export Full Dashboard Report to Excel", type="primary", use_container_width=True):
-            output_file = "Mindoro_Dairy_Dashboard_Report.xlsx"
-            with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-                if not df_trend.empty:
-                    df_trend.to_excel(writer, sheet_name="Trend_30Days", index=False)
-                if not df_top_farmers.empty:
-                    df_top_farmers.to_excel(writer, sheet_name="Top_Farmers", index=False)
-                if not df_recent.empty:
-                    df_recent.to_excel(writer, sheet_name="Recent_Activity", index=False)
-
-            st.success(f"Dashboard report exported: **{output_file}**")
-            st.balloons()
+        if st.button("📊 Export Full Dashboard Report to Excel", type="primary", width="stretch"):
+            queue_export("Dashboard Report", f"Mindoro_Dairy_Dashboard_{today_str}.xlsx", [
+                ("Trend_30Days", queries.DASHBOARD_TREND_30D, ()),
+                ("Top_Farmers", queries.TOP_FARMERS_FOR_MONTH, (this_month,)),
+                ("Recent_Activity", queries.RECENT_ACTIVITY, ()),
+            ])
 
     # Add other pages here (Milk Collection, Sales, etc.) as in your original code
 
-        conn.close()
     elif selection == "Milk Collection":
         # ========================
         # ADVANCE MILK COLLECTION
@@ -575,222 +1940,52 @@ if st.session_state.user_type == "Internal":
         st.header("🥛 Advanced Milk Reception & Quality Grading")
         st.markdown("**Precision collection • Real-time quality testing • Smart pricing engine • Bonus & loyalty system • Auto stock update**")
 
-        conn = get_conn()
-        c = conn.cursor()
-
         # Load farmers
-        c.execute("SELECT id, name, loyalty_tier FROM dairy_farmers ORDER BY name")
-        farmers = c.fetchall()
+        farmers = read_all("SELECT id, name, loyalty_tier FROM dairy_farmers ORDER BY name")
 
         if not farmers:
             st.warning("No dairy farmers registered yet. Please add via Manage Farmers.")
-            conn.close()
             st.stop()
 
-        # Farmer Selection
-        farmer_options = [f"{f['name']} ({f['loyalty_tier']})" for f in farmers]
-        selected_display = st.selectbox("🔍 Select Dairy Farmer", farmer_options, key="milk_farmer_select")
-        farmer_id = farmers[farmer_options.index(selected_display)]['id']
-        farmer_name = selected_display.split(" (")[0]
-        current_tier = selected_display.split("(")[1].replace(")", "")
-
-        # Monthly Stats for selected farmer
-        this_month = date.today().strftime('%Y-%m')
-        monthly_stats = pd.read_sql_query(f"""
-            SELECT
-                COALESCE(SUM(class_a_litres + class_b_litres), 0) AS litres,
-                COALESCE(SUM(total_payment), 0) AS payment,
-                COUNT(*) AS deliveries
-            FROM milk_collections
-            WHERE farmer_id = {farmer_id}
-              AND strftime('%Y-%m', collection_date) = '{this_month}'
-        """, conn).iloc[0]
-
-        col1, col2, col3, col4, col5 = st.columns(5)
-        with col1:
-            st.metric("Loyalty Tier", current_tier)
-        with col2:
-            st.metric("This Month Liters", f"{monthly_stats['litres']:.1f} L")
-        with col3:
-            st.metric("This Month Earnings", f"₱{monthly_stats['payment']:,.0f}")
-        with col4:
-            st.metric("Deliveries This Month", monthly_stats['deliveries'])
-        with col5:
-            target = 1500 if current_tier == "Bronze" else 3000 if current_tier == "Silver" else 5000
-            next_tier = "Silver" if current_tier == "Bronze" else "Gold" if current_tier == "Silver" else "Platinum"
-            progress = min(monthly_stats['litres'] / target, 1.0)
-            st.progress(progress)
-            st.caption(f"→ Next tier: **{next_tier}** at {target}L")
+        entry_mode = st.radio("Entry Mode", ["Single Delivery", "Bulk Route Sheet"], horizontal=True, key="collection_entry_mode")
 
-        st.divider()
+        if entry_mode == "Bulk Route Sheet":
+            bulk_intake()
+        else:
+            # Farmer Selection
+            farmer_options = [f"{f['name']} ({f['loyalty_tier']})" for f in farmers]
+            selected_display = st.selectbox("🔍 Select Dairy Farmer", farmer_options, key="milk_farmer_select")
+            farmer_id = farmers[farmer_options.index(selected_display)]['id']
+            farmer_name = selected_display.split(" (")[0]
+            current_tier = selected_display.split("(")[1].replace(")", "")
 
-        # === QUALITY TESTING & COLLECTION INPUT ===
-        st.subheader(f"🧪 New Collection for **{farmer_name}**")
+            # Monthly Stats for selected farmer (single-row lookup in the farmer_monthly_stats rollup)
+            this_month = queries.month_key(date.today())
+            monthly_stats = read_one(queries.FARMER_MONTH_STATS, (farmer_id, this_month))
 
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            total_litres = st.number_input("Total Liters Delivered", min_value=0.0, step=0.5, format="%.2f", key="litres_input")
-        with col2:
-            fat_percent = st.number_input("Fat %", min_value=0.0, max_value=10.0, step=0.1, value=3.8, key="fat_input")
-        with col3:
-            snf_percent = st.number_input("SNF %", min_value=0.0, max_value=12.0, step=0.1, value=8.5, key="snf_input")
-        with col4:
-            temperature = st.number_input("Temperature (°C)", min_value=0.0, max_value=50.0, step=0.5, value=4.0, key="temp_input")
-
-        # Quality Score Calculation (available in both accept & reject paths)
-        quality_score = 0
-        if total_litres > 0:
-            quality_score += min(fat_percent / 4.0 * 40, 40)      # Fat max 40 points
-            quality_score += min(snf_percent / 9.0 * 30, 30)      # SNF max 30 points
-            quality_score += 20 if temperature <= 6 else 10 if temperature <= 10 else 0
-            quality_score += 10 if total_litres >= 50 else 5
-
-        # Rejection Check
-        if fat_percent < 3.0 or snf_percent < 7.5 or temperature > 15:
-            st.error("🚫 Milk does NOT meet minimum quality standards – WILL BE REJECTED")
-            st.info("Requirements: Fat ≥3.0% | SNF ≥7.5% | Temperature ≤15°C")
-
-            reject_notes = st.text_area("Reason for rejection (required)", key="reject_notes")
-            if st.button("❌ Record Rejection", type="secondary", use_container_width=True):
-                if not reject_notes.strip():
-                    st.error("Please provide a reason for rejection.")
-                else:
-                    c.execute("""
-                        INSERT INTO milk_collections
-                        (farmer_id, class_a_litres, class_b_litres, total_payment, notes, recorded_by, 
-                         fat_percentage, snf_percentage, quality_score)
-                        VALUES (?, 0, 0, 0, ?, ?, ?, ?, ?)
-                    """, (farmer_id, f"REJECTED: {reject_notes}", st.session_state.username, 
-                          fat_percent, snf_percent, quality_score))
-                    conn.commit()
-                    add_notification("Farmer", farmer_id, f"Your delivery today was rejected: {reject_notes}")
-                    st.error("Rejection recorded.")
-                    st.rerun()
-        else:
-            # === SMART PRICING ENGINE (ACCEPTED MILK) ===
-            base_price = 80
-            quality_premium = 0
-            if fat_percent >= 4.2: quality_premium += 8
-            elif fat_percent >= 4.0: quality_premium += 5
-            elif fat_percent >= 3.8: quality_premium += 3
-            if snf_percent >= 9.0: quality_premium += 5
-            elif snf_percent >= 8.8: quality_premium += 3
-
-            volume_bonus = 0
-            if total_litres >= 200: volume_bonus = 5
-            elif total_litres >= 100: volume_bonus = 3
-            elif total_litres >= 50: volume_bonus = 2
-
-            loyalty_bonus = 0
-            if current_tier == "Silver": loyalty_bonus = 2
-            elif current_tier == "Gold": loyalty_bonus = 5
-            elif current_tier == "Platinum": loyalty_bonus = 8
-
-            # Consistency bonus
-            has_yesterday = pd.read_sql_query(f"""
-                SELECT COUNT(*) FROM milk_collections
-                WHERE farmer_id = {farmer_id} AND collection_date = date('now', '-1 day')
-            """, conn).iloc[0,0] > 0
-            consistency_bonus = 2 if has_yesterday else 0
-
-            final_price_per_liter = base_price + quality_premium + volume_bonus + loyalty_bonus + consistency_bonus
-            total_bonus = total_litres * (quality_premium + volume_bonus + loyalty_bonus + consistency_bonus)
-            total_payment = round(total_litres * final_price_per_liter, 2)
-
-            # Live Pricing Display
             col1, col2, col3, col4, col5 = st.columns(5)
             with col1:
-                st.metric("Quality Score", f"{quality_score:.0f}/100", delta="Excellent" if quality_score >= 85 else "Good")
+                st.metric("Loyalty Tier", current_tier)
             with col2:
-                st.metric("Price per Liter", f"₱{final_price_per_liter:.1f}")
+                st.metric("This Month Liters", f"{monthly_stats['litres']:.1f} L")
             with col3:
-                st.metric("Base + Premium", f"₱{base_price + quality_premium:.0f}")
+                st.metric("This Month Earnings", f"₱{monthly_stats['payment']:,.0f}")
             with col4:
-                st.metric("Total Bonus", f"₱{total_bonus:.0f}")
+                st.metric("Deliveries This Month", monthly_stats['deliveries'])
             with col5:
-                st.metric("**Final Payment**", f"₱{total_payment:,.2f}", delta=f"+₱{total_bonus:.0f} bonus")
-
-            notes = st.text_area("Additional Notes (optional)", key="collection_notes")
-
-            if st.button("✅ Record Collection & Update Raw Milk Stock", type="primary", use_container_width=True):
-                if total_litres <= 0:
-                    st.error("Please enter valid liters greater than 0.")
-                else:
-                    # Record collection
-                    c.execute("""
-                        INSERT INTO milk_collections
-                        (farmer_id, class_a_litres, class_b_litres, total_payment, notes, recorded_by,
-                         fat_percentage, snf_percentage, quality_score)
-                        VALUES (?, ?, 0, ?, ?, ?, ?, ?, ?)
-                    """, (farmer_id, total_litres, total_payment, notes or "None", st.session_state.username,
-                          fat_percent, snf_percent, quality_score))
+                next_tier, target = pricing.next_tier_target(current_tier)
+                progress = min(monthly_stats['litres'] / target, 1.0)
+                st.progress(progress)
+                st.caption(f"→ Next tier: **{next_tier}** at {target}L")
 
-                    # Update Raw Milk stock
-                    conn.execute("UPDATE products SET current_stock = current_stock + ? WHERE name = 'Raw Milk'", (total_litres,))
-
-                    # Log transaction
-                    conn.execute("""
-                        INSERT INTO inventory_transactions
-                        (product_id, transaction_type, quantity, reason, recorded_by)
-                        VALUES ((SELECT id FROM products WHERE name = 'Raw Milk'), 'IN', ?, ?, ?)
-                    """, (total_litres, f"Collection from {farmer_name} | {total_litres:.1f}L | Bonus ₱{total_bonus:.0f}", st.session_state.username))
-
-                    # Auto tier upgrade
-                    new_monthly_litres = monthly_stats['litres'] + total_litres
-                    new_tier = current_tier
-                    if new_monthly_litres >= 5000 and current_tier == "Gold":
-                        new_tier = "Platinum"
-                    elif new_monthly_litres >= 3000 and current_tier == "Silver":
-                        new_tier = "Gold"
-                    elif new_monthly_litres >= 1500 and current_tier == "Bronze":
-                        new_tier = "Silver"
-
-                    if new_tier != current_tier:
-                        conn.execute("UPDATE dairy_farmers SET loyalty_tier = ? WHERE id = ?", (new_tier, farmer_id))
-                        st.balloons()
-                        st.success(f"🎉 {farmer_name} upgraded to **{new_tier}** tier!")
+            st.divider()
 
-                    conn.commit()
-                    st.success(f"Collection recorded for **{farmer_name}**!")
-                    st.success(f"Payment: **₱{total_payment:,.2f}** (includes ₱{total_bonus:.0f} bonus)")
-                    add_notification("Farmer", farmer_id, f"New collection: {total_litres:.1f}L → ₱{total_payment:,.2f}")
-                    st.rerun()
+            collection_form(farmer_id, farmer_name, current_tier, this_month)
 
         st.divider()
 
-        # === TODAY'S COLLECTIONS SUMMARY ===
-        st.subheader("📊 Today's Collections Summary (All Farmers)")
-        df_today = pd.read_sql_query("""
-            SELECT
-                df.name AS Farmer,
-                ROUND(mc.class_a_litres + mc.class_b_litres, 1) AS Liters,
-                mc.fat_percentage AS "Fat %",
-                mc.snf_percentage AS "SNF %",
-                mc.quality_score AS Score,
-                mc.total_payment AS "Payment ₱"
-            FROM milk_collections mc
-            JOIN dairy_farmers df ON mc.farmer_id = df.id
-            WHERE mc.collection_date = date('now')
-            ORDER BY Liters DESC
-        """, conn)
-
-        if not df_today.empty:
-            st.dataframe(df_today.style.format({
-                "Liters": "{:.1f}",
-                "Fat %": "{:.2f}",
-                "SNF %": "{:.2f}",
-                "Score": "{:.0f}",
-                "Payment ₱": "₱{:.0f}"
-            }), use_container_width=True)
-
-            if st.button("📥 Export Today's Collections to Excel", type="secondary"):
-                df_today.to_excel("Todays_Milk_Collections.xlsx", index=False)
-                st.success("Exported!")
-                st.balloons()
-        else:
-            st.info("No collections recorded today yet.")
+        todays_collections()
 
-        conn.close()
     elif selection == "Sales":
         # ========================
         # ADVANCE SALES POS
@@ -798,21 +1993,16 @@ if st.session_state.user_type == "Internal":
         st.header("💰 Super Advanced Sales POS System")
         st.markdown("**Full retail experience • Smart cart • Real-time discounts • Promo engine • Loyalty points • Credit/utang tracking • Partial payment • Digital receipt**")
 
-        conn = get_conn()
-        c = conn.cursor()
-
-        # Load available products (with stock > 0 and SRP > 0)
-        c.execute("""
+        # Load available products (with stock > 0 and SRP > 0); cached until products change
+        products = read_df("""
             SELECT id, name, srp, current_stock, unit
             FROM products
             WHERE current_stock > 0 AND srp > 0
             ORDER BY name
         """)
-        products = c.fetchall()
 
-        if not products:
+        if products.empty:
             st.warning("No products available for sale. Please check inventory.")
-            conn.close()
             st.stop()
 
         # Customer Type Selection
@@ -826,8 +2016,7 @@ if st.session_state.user_type == "Internal":
         current_balance = 0.0
 
         if customer_type == "Registered Buyer":
-            c.execute("SELECT id, name, discount_type, discount_value, loyalty_points, current_balance FROM customers ORDER BY name")
-            customers = c.fetchall()
+            customers = read_all("SELECT id, name, discount_type, discount_value, loyalty_points, current_balance FROM customers ORDER BY name")
             if not customers:
                 st.info("No registered customers yet.")
             else:
@@ -856,180 +2045,14 @@ if st.session_state.user_type == "Internal":
 
         st.divider()
 
-        # === SMART CART WITH SEARCH ===
-        st.subheader(f"🛒 Cart for **{customer_name}**")
-
-        search_term = st.text_input("🔍 Search Product", placeholder="Type to filter products...", key="product_search")
-
-        filtered_products = [p for p in products if search_term.lower() in p['name'].lower()] if search_term else products
-
-        if not filtered_products and search_term:
-            st.info(f"No products found for '{search_term}'. Showing all.")
-            filtered_products = products
-
-        cart = []
-        subtotal = 0.0
-
-        for product in filtered_products:
-            qty_key = f"qty_{product['id']}_{st.session_state.get('sales_rerun', 0)}"
-            col1, col2, col3, col4, col5 = st.columns([4, 2, 2, 2, 2])
-
-            with col1:
-                st.write(f"**{product['name']}** • {product['unit']} • Stock: {product['current_stock']:.2f}")
-
-            with col2:
-                qty = st.number_input("Qty", min_value=0.0, max_value=product['current_stock'],
-                                      step=0.5 if product['unit'] in ["Liter", "Kg"] else 1.0,
-                                      key=qty_key, label_visibility="collapsed")
-
-            with col3:
-                unit_price = apply_discount(product['srp'], discount_type, discount_value)
-                st.write(f"₱{unit_price:,.2f}")
-
-            with col4:
-                line_total = qty * unit_price
-                if qty > 0:
-                    subtotal += line_total
-                    cart.append({
-                        "pid": product["id"],
-                        "name": product["name"],
-                        "qty": qty,
-                        "unit_price": unit_price,
-                        "line_total": line_total
-                    })
-                    st.success(f"₱{line_total:,.2f}")
-                else:
-                    st.write("")
-
-            with col5:
-                if qty > 0:
-                    st.caption(f"{qty} × ₱{unit_price:,.0f}")
-
-        if not cart:
-            st.info("👆 Add items by entering quantity above.")
-
-        st.divider()
-
-        # === PROMO ENGINE ===
-        promo_discount = 0.0
-        promo_messages = []
-
-        # Buy 10 Get 1 Free - Fresh Milk 1L
-        fresh_milk_qty = sum(item['qty'] for item in cart if "Fresh Milk 1L" in item['name'])
-        free_bottles = fresh_milk_qty // 10
-        if free_bottles > 0:
-            promo_discount += free_bottles * 50  # Assuming SRP ₱50
-            promo_messages.append(f"🎁 Buy 10 Get 1 Free → {free_bottles} free Fresh Milk 1L")
-
-        # Yogurt + Cheese Bundle - 10% off
-        bundle_items = [item for item in cart if "Yogurt" in item['name'] or "Cheese" in item['name']]
-        if len(bundle_items) >= 2:
-            bundle_total = sum(item['line_total'] for item in bundle_items)
-            bundle_discount = bundle_total * 0.10
-            promo_discount += bundle_discount
-            promo_messages.append("🎁 Yogurt + Cheese Bundle → 10% off")
-
-        # Loyalty Points Redemption
-        points_to_redeem = 0
-        points_discount = 0.0
-        if customer_type == "Registered Buyer" and loyalty_points >= 100:
-            max_redeemable = (loyalty_points // 100) * 100
-            points_to_redeem = st.slider("Redeem Loyalty Points (100 pts = ₱50)", 0, max_redeemable, 0, step=100, key="points_redeem")
-            points_discount = (points_to_redeem // 100) * 50
-
-        # Final Calculations
-        total_after_promo = subtotal - promo_discount
-        total_after_points = total_after_promo - points_discount
-        vat = total_after_points * 0.12
-        grand_total = round(total_after_points + vat, 2)
-
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("Subtotal", f"₱{subtotal:,.2f}")
-        with col2:
-            st.metric("Promo Discounts", f"-₱{promo_discount:,.2f}")
-        with col3:
-            st.metric("Points Redeemed", f"-₱{points_discount:,.2f}")
-        with col4:
-            st.metric("VAT 12%", f"₱{vat:,.2f}")
-
-        st.metric("**GRAND TOTAL**", f"₱{grand_total:,.2f}", delta=None)
-
-        if promo_messages:
-            st.success("Applied Promos: " + " | ".join(promo_messages))
-
-        # Payment Section
-        payment_method = st.selectbox("Payment Method", ["Cash", "GCash", "Bank Transfer", "Credit (Utang)", "Partial Payment"])
-
-        amount_paid = grand_total
-        if payment_method in ["Partial Payment", "Credit (Utang)"]:
-            amount_paid = st.number_input("Amount Paid Today", min_value=0.0, max_value=grand_total, value=0.0 if payment_method == "Credit (Utang)" else grand_total)
-
-        remaining = grand_total - amount_paid
-
-        if st.button("🧾 Confirm Sale & Print Digital Receipt", type="primary", use_container_width=True):
-            if not cart:
-                st.error("Cart is empty!")
-            elif remaining < 0:
-                st.error("Amount paid cannot exceed total.")
-            else:
-                # Record Sale
-                c.execute("""
-                    INSERT INTO sales (customer_type, customer_id, total_amount, payment_type, recorded_by)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (customer_type, customer_id, grand_total, payment_method, st.session_state.username))
-                sale_id = c.lastrowid
-
-                # Record Items & Update Stock
-                for item in cart:
-                    c.execute("INSERT INTO sale_items (sale_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?)",
-                              (sale_id, item["pid"], item["qty"], item["unit_price"]))
-                    conn.execute("UPDATE products SET current_stock = current_stock - ? WHERE id = ?", (item["qty"], item["pid"]))
-                    conn.execute("""
-                        INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, recorded_by)
-                        VALUES (?, 'OUT', ?, ?, ?)
-                    """, (item["pid"], item["qty"], f"Sale #{sale_id} to {customer_name}", st.session_state.username))
-
-                # Update Customer (if registered)
-                if customer_type == "Registered Buyer":
-                    new_balance = current_balance + remaining
-                    points_earned = int(grand_total // 10)
-                    new_points = loyalty_points - points_to_redeem + points_earned
-                    conn.execute("UPDATE customers SET current_balance = ?, loyalty_points = ? WHERE id = ?",
-                                 (new_balance, new_points, customer_id))
-
-                conn.commit()
-                st.success(f"Sale #{sale_id} completed successfully!")
-                st.balloons()
-
-                # Digital Receipt
-                with st.expander("📄 View Digital Receipt", expanded=True):
-                    st.markdown(f"**Mindoro Dairy** • Sale #{sale_id} • {date.today().strftime('%b %d, %Y %H:%M')}")
-                    st.markdown(f"**Customer:** {customer_name}")
-                    st.markdown("**Items:**")
-                    receipt_df = pd.DataFrame([
-                        {"Item": i["name"], "Qty": i["qty"], "Price": f"₱{i['unit_price']:,.2f}", "Total": f"₱{i['line_total']:,.2f}"}
-                        for i in cart
-                    ])
-                    st.table(receipt_df)
-                    st.markdown(f"**Subtotal:** ₱{subtotal:,.2f}")
-                    if promo_discount > 0:
-                        st.markdown(f"**Promo Discount:** -₱{promo_discount:,.2f}")
-                    if points_discount > 0:
-                        st.markdown(f"**Points Redeemed:** -₱{points_discount:,.2f}")
-                    st.markdown(f"**VAT (12%):** ₱{vat:,.2f}")
-                    st.markdown(f"**GRAND TOTAL:** ₱{grand_total:,.2f}")
-                    st.markdown(f"**Paid Today:** ₱{amount_paid:,.2f}")
-                    st.markdown(f"**Remaining Balance:** ₱{remaining:,.2f}")
-                    st.markdown("**Thank you for your purchase! 🥛**")
-
-                st.rerun()
+        sales_cart(products, customer_type, customer_id, customer_name,
+                   discount_type, discount_value, loyalty_points)
 
         st.divider()
 
         # Today's Sales Summary
         st.subheader("📊 Today's Sales Summary")
-        df_today_sales = pd.read_sql_query("""
+        df_today_sales = read_df("""
             SELECT p.name AS Product, SUM(si.quantity) AS Sold, SUM(si.quantity * si.unit_price) AS Revenue
             FROM sale_items si
             JOIN products p ON si.product_id = p.id
@@ -1037,14 +2060,17 @@ if st.session_state.user_type == "Internal":
             WHERE s.sale_date = date('now')
             GROUP BY p.name
             ORDER BY Revenue DESC
-        """, conn)
+        """)
 
         if not df_today_sales.empty:
-            st.dataframe(df_today_sales.style.format({"Sold": "{:.1f}", "Revenue": "₱{:.0f}"}), use_container_width=True)
+            st.dataframe(df_today_sales.style.format({"Sold": "{:.1f}", "Revenue": "₱{:.0f}"}), width="stretch")
         else:
             st.info("No sales recorded today yet.")
 
-        conn.close()
+        # === PROMOTIONS (Admin/Manager) ===
+        if st.session_state.role in ["Admin", "Manager"]:
+            promotions_admin()
+
     elif selection == "Inventory":
         # ========================
         # SIMPLE & AMAZING INVENTORY (ALL WORKING + REAL-TIME)
@@ -1052,16 +2078,13 @@ if st.session_state.user_type == "Internal":
         st.header("📦 Inventory Management")
         st.markdown("**Simple • Clean • All actions work perfectly • Real-time updates**")
 
-        conn = get_conn()
-        c = conn.cursor()
-
         # Real-time fresh data
-        df = pd.read_sql_query("""
+        df = read_df("""
             SELECT id, name AS Product, category AS Category, current_stock AS Stock,
                    low_stock_threshold AS Threshold, srp AS "SRP (₱)",
                    ROUND(current_stock * srp, 0) AS "Value (₱)"
             FROM products ORDER BY name
-        """, conn)
+        """)
 
         if df.empty:
             st.info("No products yet. Add your first product below!")
@@ -1081,132 +2104,24 @@ if st.session_state.user_type == "Internal":
             st.divider()
 
             st.dataframe(df[["Product", "Category", "Stock", "Threshold", "SRP (₱)", "Value (₱)"]],
-                         use_container_width=True, hide_index=True)
-
-        st.divider()
-
-        # Action selector
-        action = st.radio("Choose action:", 
-                          ["Add Product", "Edit Product", "Delete Product", "Adjust Stock"], 
-                          horizontal=True)
+                         width="stretch", hide_index=True)
 
-        # === ADD PRODUCT ===
-        if action == "Add Product":
-            if st.session_state.role not in ["Admin", "Manager"]:
-                st.info("Only Admin/Manager can add products.")
+            # === EXPIRING SOON (lot level) ===
+            days_ahead = st.slider("⏳ Show lots expiring within (days)", 1, 60, 7, key="expiring_days")
+            df_expiring = read_df(queries.EXPIRING_LOTS, ((date.today() + timedelta(days=days_ahead)).isoformat(),))
+            if df_expiring.empty:
+                st.success(f"No lots expire in the next {days_ahead} days.")
             else:
-                st.subheader("Add New Product")
-                with st.form("add_form", clear_on_submit=True):
-                    name = st.text_input("Product Name")
-                    category = st.selectbox("Category", ["Raw Milk", "Finished Goods", "By-Product"])
-                    unit = st.selectbox("Unit", ["Liter", "Bottle", "Pack", "Kg", "Piece"])
-                    srp = st.number_input("SRP (₱)", min_value=0.0, step=0.5)
-                    stock = st.number_input("Initial Stock", min_value=0.0, step=0.1)
-                    threshold = st.number_input("Low Stock Alert", min_value=1.0, value=10.0)
-
-                    if st.form_submit_button("Save Product", type="primary"):
-                        if not name.strip():
-                            st.error("Product name is required!")
-                        else:
-                            try:
-                                c.execute("""
-                                    INSERT INTO products (name, category, unit, srp, current_stock, low_stock_threshold)
-                                    VALUES (?, ?, ?, ?, ?, ?)
-                                """, (name.strip(), category, unit, srp, stock, threshold))
-                                conn.commit()
-                                st.success(f"**{name}** added!")
-                                st.rerun()
-                            except sqlite3.IntegrityError:
-                                st.error("Product name already exists!")
-
-        # === EDIT PRODUCT ===
-        elif action == "Edit Product":
-            if st.session_state.role not in ["Admin", "Manager"]:
-                st.info("Only Admin/Manager can edit.")
-            elif df.empty:
-                st.info("No products to edit.")
-            else:
-                st.subheader("Edit Product")
-                product_names = df["Product"].tolist()
-                selected_name = st.selectbox("Select product", product_names, key="edit_select_final")
+                df_expiring.insert(4, "Days Left", (pd.to_datetime(df_expiring["Expiry"]) - pd.Timestamp(date.today())).dt.days)
+                st.warning(f"**{len(df_expiring)} lot(s)** worth ₱{df_expiring['Value (₱)'].sum():,.0f} expire within {days_ahead} days — sell these first")
+                st.dataframe(df_expiring, width="stretch", hide_index=True)
 
-                pid = int(df[df["Product"] == selected_name]["id"].iloc[0])
-                current = conn.execute("SELECT * FROM products WHERE id = ?", (pid,)).fetchone()
+        stock_ledger()
 
-                if current:
-                    with st.form("edit_form", clear_on_submit=True):
-                        e_name = st.text_input("Product Name", value=current["name"])
-                        e_category = st.selectbox("Category", ["Raw Milk", "Finished Goods", "By-Product"],
-                                                  index=["Raw Milk", "Finished Goods", "By-Product"].index(current["category"]))
-                        e_unit = st.selectbox("Unit", ["Liter", "Bottle", "Pack", "Kg", "Piece"],
-                                              index=["Liter", "Bottle", "Pack", "Kg", "Piece"].index(current["unit"]))
-                        e_srp = st.number_input("SRP (₱)", min_value=0.0, value=float(current["srp"]))
-                        e_threshold = st.number_input("Low Stock Alert", min_value=1.0, value=float(current["low_stock_threshold"]))
-
-                        if st.form_submit_button("Update Product", type="primary"):
-                            try:
-                                c.execute("""
-                                    UPDATE products SET name = ?, category = ?, unit = ?, srp = ?, low_stock_threshold = ?
-                                    WHERE id = ?
-                                """, (e_name.strip(), e_category, e_unit, e_srp, e_threshold, pid))
-                                conn.commit()
-                                st.success(f"**{e_name}** updated!")
-                                st.rerun()
-                            except sqlite3.IntegrityError:
-                                st.error("Product name already exists!")
-                else:
-                    st.error("Product not found.")
-
-        # === DELETE PRODUCT ===
-        elif action == "Delete Product":
-            if st.session_state.role != "Admin":
-                st.info("Only Admin can delete.")
-            elif df.empty:
-                st.info("No products to delete.")
-            else:
-                st.subheader("Delete Product")
-                product_names = df["Product"].tolist()
-                selected_name = st.selectbox("Select product", product_names, key="delete_select_final")
-                pid = int(df[df["Product"] == selected_name]["id"].iloc[0])
-
-                st.warning("This is permanent!")
-                if st.button("Yes, Delete Permanently", type="secondary"):
-                    c.execute("DELETE FROM products WHERE id = ?", (pid,))
-                    conn.commit()
-                    st.error(f"**{selected_name}** deleted!")
-                    st.rerun()
-
-        # === ADJUST STOCK (NOW FULLY WORKING) ===
-        elif action == "Adjust Stock":
-            if st.session_state.role not in ["Admin", "Manager"]:
-                st.info("Only Admin/Manager can adjust stock.")
-            elif df.empty:
-                st.info("No products to adjust.")
-            else:
-                st.subheader("Adjust Stock")
-                product_names = df["Product"].tolist()
-                selected_name = st.selectbox("Select product", product_names, key="adjust_select_final")
-                pid = int(df[df["Product"] == selected_name]["id"].iloc[0])
-
-                with st.form("adjust_form", clear_on_submit=True):
-                    adj_type = st.radio("Action", ["Add Stock", "Remove Stock"], horizontal=True)
-                    qty = st.number_input("Quantity", min_value=0.01, step=0.1)
-                    reason = st.text_input("Reason (optional)")
-
-                    if st.form_submit_button("Apply Adjustment", type="primary"):
-                        if qty <= 0:
-                            st.error("Quantity must be greater than 0")
-                        else:
-                            trans = "IN" if adj_type == "Add Stock" else "OUT"
-                            op = 1 if trans == "IN" else -1
-                            c.execute("INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, recorded_by) VALUES (?, ?, ?, ?, ?)",
-                                      (pid, trans, qty, reason.strip() or "Manual adjustment", st.session_state.username))
-                            c.execute("UPDATE products SET current_stock = current_stock + (? * ?) WHERE id = ?", (qty, op, pid))
-                            conn.commit()
-                            st.success(f"Stock adjusted for **{selected_name}**!")
-                            st.rerun()  # Real-time update
+        st.divider()
+
+        inventory_actions(df)
 
-        conn.close()
     elif selection == "Production":
         # ========================
         # ADVANCE PRODUCTION
@@ -1214,161 +2129,31 @@ if st.session_state.user_type == "Internal":
         st.header("🏭 Advanced Production & Processing Module")
         st.markdown("**Transform Raw Milk into high-value finished goods • Smart yield calculation • Waste tracking • Batch expiry assignment • Full audit trail**")
 
-        conn = get_conn()
-        c = conn.cursor()
-
         # Current Raw Milk Stock
-        raw_row = conn.execute("SELECT current_stock FROM products WHERE name = 'Raw Milk'").fetchone()
+        raw_row = read_one("SELECT current_stock FROM products WHERE name = 'Raw Milk'")
         raw_available = raw_row["current_stock"] if raw_row else 0.0
 
         col1, col2, col3 = st.columns(3)
         with col1:
             st.metric("Available Raw Milk", f"{raw_available:.2f} L", delta=None)
         with col2:
-            today_produced = pd.read_sql_query("""
-                SELECT COALESCE(SUM(it.quantity), 0)
-                FROM inventory_transactions it
-                JOIN products p ON it.product_id = p.id
-                WHERE it.transaction_type = 'IN' AND p.category = 'Finished Goods'
-                  AND it.reason LIKE 'Production%'
-                  AND it.transaction_date = date('now')
-            """, conn).iloc[0,0]
+            today_produced = read_one(queries.UNITS_PRODUCED_TODAY)["units"]
             st.metric("Units Produced Today", f"{today_produced:.0f}")
         with col3:
             st.metric("Target Yield Efficiency", "≥98%")
 
         if raw_available <= 0:
             st.warning("🚫 No Raw Milk available for production. Please wait for collections.")
-            conn.close()
             st.stop()
 
         st.divider()
 
-        # === NEW PRODUCTION BATCH ===
-        st.subheader("🛠️ Start New Production Batch")
-
-        # Load Finished Goods
-        c.execute("SELECT id, name, unit FROM products WHERE category = 'Finished Goods' AND srp > 0 ORDER BY name")
-        finished_products = c.fetchall()
-
-        if not finished_products:
-            st.error("No finished goods defined. Please add them in Inventory first.")
-            conn.close()
-            st.stop()
-
-        product_options = [f"{p['name']} ({p['unit']})" for p in finished_products]
-        selected_display = st.selectbox("Select Product to Produce", product_options, key="prod_product_select")
-        selected_product = finished_products[product_options.index(selected_display)]
-        prod_id = selected_product["id"]
-        prod_name = selected_product["name"]
-        prod_unit = selected_product["unit"]
-
-        # Conversion Ratios (Customizable per product)
-        conversion_ratios = {
-            "Fresh Milk 1L": 1.00,   # 1L raw → 1 bottle (minimal loss)
-            "Yogurt 500g": 1.05,     # Slight loss in processing
-            "Cheese 200g": 10.0,     # Approx 10L raw → 1kg cheese (adjust based on your actual yield)
-            # Add more products here as needed
-        }
-        liters_per_unit = conversion_ratios.get(prod_name, 1.0)
-
-        st.info(f"**Conversion Rate:** {liters_per_unit:.2f} Liters Raw Milk → 1 {prod_unit} of **{prod_name}**")
-
-        col1, col2 = st.columns(2)
-        with col1:
-            units_to_produce = st.number_input(f"Quantity to Produce ({prod_unit})", min_value=1, step=1, value=10, key="units_input")
-        with col2:
-            raw_required = round(units_to_produce * liters_per_unit, 2)
-            st.metric("Raw Milk Required", f"{raw_required:.2f} L",
-                      delta=f"{raw_required - raw_available:.2f} L shortfall" if raw_required > raw_available else "Sufficient")
-
-        if raw_required > raw_available:
-            st.error("🚫 Not enough Raw Milk available. Reduce quantity or wait for more collections.")
-            st.stop()
-
-        waste_litres = st.number_input("Waste / Spoilage (Liters)", min_value=0.0, max_value=raw_required, step=0.1, value=0.0,
-                                       help="e.g. evaporation, testing, spillage")
-
-        total_raw_used = raw_required + waste_litres
-        if total_raw_used > raw_available:
-            st.error("Total raw milk used (including waste) exceeds available stock!")
-            st.stop()
-
-        batch_expiry = st.date_input("Batch Expiry Date", value=date.today() + timedelta(days=30),
-                                     min_value=date.today() + timedelta(days=7))
-
-        batch_notes = st.text_area("Batch Notes (optional)", placeholder="e.g. Batch #2025-001, pasteurized at 72°C for 15s, starter culture used")
-
-        if st.button("✅ Start Production Batch", type="primary", use_container_width=True):
-            raw_pid = conn.execute("SELECT id FROM products WHERE name = 'Raw Milk'").fetchone()["id"]
-            reason = f"Production → {units_to_produce} {prod_name} | Required: {raw_required:.2f}L | Waste: {waste_litres:.2f}L | {batch_notes or 'No notes'}"
-
-            # 1. Deduct Raw Milk
-            conn.execute("UPDATE products SET current_stock = current_stock - ? WHERE id = ?", (total_raw_used, raw_pid))
-            conn.execute("""
-                INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, recorded_by)
-                VALUES (?, 'OUT', ?, ?, ?)
-            """, (raw_pid, total_raw_used, reason, st.session_state.username))
-
-            # 2. Add Finished Goods
-            conn.execute("UPDATE products SET current_stock = current_stock + ? WHERE id = ?", (units_to_produce, prod_id))
-            conn.execute("""
-                INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, recorded_by)
-                VALUES (?, 'IN', ?, ?, ?)
-            """, (prod_id, units_to_produce, reason, st.session_state.username))
-
-            # Optional: Store expiry in notes (or add batch table later)
-            conn.commit()
-
-            yield_percent = round((raw_required / total_raw_used) * 100, 1) if total_raw_used > 0 else 100
-
-            st.success("Production batch completed successfully!")
-            st.success(f"**+{units_to_produce} {prod_name}** added to inventory")
-            st.info(f"Yield Efficiency: **{yield_percent}%**")
-            if waste_litres > 0:
-                st.warning(f"Recorded {waste_litres:.2f}L waste/spoilage")
-            st.balloons()
-
-            add_notification("Internal", None, f"New production: {units_to_produce} {prod_name} by {st.session_state.username}")
-
-            st.rerun()
+        production_batch_form(raw_available)
 
         st.divider()
 
-        # === PRODUCTION HISTORY ===
-        st.subheader("📋 Production History (Last 30 Days)")
-
-        df_prod_history = pd.read_sql_query("""
-            SELECT
-                p.name AS Product,
-                it.quantity AS "Units Produced",
-                it.reason AS Details,
-                it.transaction_date AS Date,
-                it.recorded_by AS Operator
-            FROM inventory_transactions it
-            JOIN products p ON it.product_id = p.id
-            WHERE it.reason LIKE 'Production%'
-              AND it.transaction_type = 'IN'
-              AND p.category = 'Finished Goods'
-              AND it.transaction_date >= date('now', '-30 days')
-            ORDER BY it.transaction_date DESC
-        """, conn)
-
-        if not df_prod_history.empty:
-            # Extract waste from reason
-            df_prod_history["Waste (L)"] = df_prod_history["Details"].str.extract(r"Waste: ([\d.]+)L").astype(float).fillna(0)
-
-            st.dataframe(df_prod_history[["Date", "Operator", "Product", "Units Produced", "Waste (L)", "Details"]],
-                         use_container_width=True, hide_index=True)
-
-            if st.button("📥 Export Production Report", type="secondary"):
-                df_prod_history.to_excel("Production_Report_Last30Days.xlsx", index=False)
-                st.success("Report exported successfully!")
-                st.balloons()
-        else:
-            st.info("No production recorded in the last 30 days.")
+        production_history()
 
-        conn.close()
     elif selection == "Manage Farmers" and st.session_state.role in ["Admin", "Manager"]:
         # ========================
         # ADVANCE MANAGE FARMERS
@@ -1376,9 +2161,6 @@ if st.session_state.user_type == "Internal":
         st.header("🐄 Advanced Farmer Management – Supplier CRM")
         st.markdown("**Complete farmer registry • Performance analytics • Loyalty tier control • Lifetime stats • Individual deep dive**")
 
-        conn = get_conn()
-        c = conn.cursor()
-
         # === ADD NEW FARMER ===
         with st.expander("➕ Register New Dairy Farmer", expanded=False):
             with st.form("add_farmer_form"):
@@ -1397,16 +2179,15 @@ if st.session_state.user_type == "Internal":
                         st.error("Name, username, and password are required.")
                     else:
                         try:
-                            c.execute("""
-                                INSERT INTO dairy_farmers
-                                (name, contact, address, username, password, loyalty_tier)
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            """, (new_name.strip(), new_contact or None, new_address or None,
-                                  new_username.strip(), new_password, initial_tier))
-                            new_farmer_id = c.lastrowid
-                            conn.commit()
+                            with write_tx() as conn:
+                                new_farmer_id = conn.execute("""
+                                    INSERT INTO dairy_farmers
+                                    (name, contact, address, username, password, loyalty_tier)
+                                    VALUES (?, ?, ?, ?, ?, ?)
+                                """, (new_name.strip(), new_contact or None, new_address or None,
+                                      new_username.strip(), new_password, initial_tier)).lastrowid
+                                add_notification("Farmer", new_farmer_id, f"Welcome to Mindoro Dairy! Your account is ready.")
                             st.success(f"Farmer **{new_name}** registered successfully!")
-                            add_notification("Farmer", new_farmer_id, f"Welcome to Mindoro Dairy! Your account is ready.")
                             st.rerun()  # This will refresh everything
                         except sqlite3.IntegrityError as e:
                             if "username" in str(e):
@@ -1419,25 +2200,10 @@ if st.session_state.user_type == "Internal":
         st.divider()
 
         # === ALWAYS FRESH FARMERS LIST ===
-        df_farmers = pd.read_sql_query("""
-            SELECT
-                df.id,
-                df.name,
-                df.contact,
-                df.address,
-                df.loyalty_tier,
-                COALESCE(SUM(mc.class_a_litres + mc.class_b_litres), 0) AS total_litres,
-                COALESCE(SUM(mc.total_payment), 0) AS total_earnings,
-                COUNT(mc.id) AS total_deliveries
-            FROM dairy_farmers df
-            LEFT JOIN milk_collections mc ON mc.farmer_id = df.id
-            GROUP BY df.id
-            ORDER BY total_litres DESC
-        """, conn)
+        df_farmers = read_df(queries.FARMER_LIST_WITH_TOTALS)
 
         if df_farmers.empty:
             st.info("No farmers registered yet.")
-            conn.close()
             st.stop()
 
         df_display = df_farmers.copy()
@@ -1454,110 +2220,12 @@ if st.session_state.user_type == "Internal":
         })
         df_display = df_display[["Farmer Name", "Tier", "Lifetime Supply", "Lifetime Earnings", "Total Deliveries", "Contact", "Location"]]
 
-        st.dataframe(df_display, use_container_width=True, hide_index=True)
+        st.dataframe(df_display, width="stretch", hide_index=True)
 
         st.divider()
 
-        # === INDIVIDUAL FARMER DEEP DIVE ===
-        st.subheader("🔍 Farmer Performance Deep Dive")
-
-        # Always use fresh names from latest query
-        farmer_names = df_farmers["name"].tolist()
-        selected_farmer_name = st.selectbox("Select Farmer for Detailed View", farmer_names, key="deep_dive_select")
-
-        # Get fresh row & ID
-        farmer_row = df_farmers[df_farmers["name"] == selected_farmer_name].iloc[0]
-        farmer_id = int(farmer_row["id"])
-
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("Current Tier", farmer_row["loyalty_tier"])
-        with col2:
-            st.metric("Lifetime Liters", f"{farmer_row['total_litres']:.1f} L")
-        with col3:
-            st.metric("Lifetime Earnings", f"₱{farmer_row['total_earnings']:,.0f}")
-        with col4:
-            st.metric("Total Deliveries", farmer_row["total_deliveries"])
-
-        # Monthly Trend Chart (same as before)
-        df_monthly = pd.read_sql_query(f"""
-            SELECT 
-                strftime('%Y-%m', collection_date) AS month,
-                SUM(class_a_litres + class_b_litres) AS liters,
-                SUM(total_payment) AS earnings
-            FROM milk_collections
-            WHERE farmer_id = {farmer_id}
-            GROUP BY month
-            ORDER BY month
-        """, conn)
-
-        if not df_monthly.empty:
-            fig = go.Figure()
-            fig.add_trace(go.Bar(x=df_monthly['month'], y=df_monthly['liters'], name="Liters", marker_color="#2E8B57"))
-            fig.add_trace(go.Scatter(x=df_monthly['month'], y=df_monthly['earnings'], name="Earnings ₱", yaxis='y2', line=dict(color="#FFD700", width=3)))
-            fig.update_layout(
-                title=f"Monthly Performance - {selected_farmer_name}",
-                yaxis=dict(title="Liters"),
-                yaxis2=dict(title="Earnings ₱", overlaying="y", side="right"),
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info("No collection history yet for this farmer.")
-
-        # Recent Collections Table (same)
-        st.subheader("Recent Collections")
-        df_recent = pd.read_sql_query(f"""
-            SELECT 
-                collection_date AS Date,
-                ROUND(class_a_litres + class_b_litres, 1) AS Liters,
-                fat_percentage AS "Fat %",
-                snf_percentage AS "SNF %",
-                quality_score AS Score,
-                total_payment AS "Payment ₱",
-                notes
-            FROM milk_collections
-            WHERE farmer_id = {farmer_id}
-            ORDER BY collection_date DESC
-            LIMIT 20
-        """, conn)
+        farmer_deep_dive(df_farmers)
 
-        if not df_recent.empty:
-            st.dataframe(df_recent.style.format({
-                "Liters": "{:.1f}",
-                "Fat %": "{:.2f}",
-                "SNF %": "{:.2f}",
-                "Score": "{:.0f}",
-                "Payment ₱": "₱{:.0f}"
-            }), use_container_width=True, hide_index=True)
-        else:
-            st.info("No collections recorded yet.")
-
-        # Edit Farmer Details (SAFE)
-        with st.expander("✏️ Edit Farmer Details", expanded=False):
-            current = conn.execute("SELECT name, contact, address, loyalty_tier FROM dairy_farmers WHERE id = ?", (farmer_id,)).fetchone()
-            
-            if current is None:
-                st.error("Farmer data not loaded properly. Try refreshing or re-selecting the farmer.")
-            else:
-                with st.form("edit_farmer_form"):
-                    edit_name = st.text_input("Name", value=current["name"])
-                    edit_contact = st.text_input("Contact", value=current["contact"] or "")
-                    edit_address = st.text_input("Address", value=current["address"] or "")
-                    edit_tier = st.selectbox("Loyalty Tier", ["Bronze", "Silver", "Gold", "Platinum"], 
-                                             index=["Bronze", "Silver", "Gold", "Platinum"].index(current["loyalty_tier"]))
-                    edit_submitted = st.form_submit_button("Update Farmer", type="primary")
-                    if edit_submitted:
-                        conn.execute("""
-                            UPDATE dairy_farmers
-                            SET name = ?, contact = ?, address = ?, loyalty_tier = ?
-                            WHERE id = ?
-                        """, (edit_name.strip(), edit_contact or None, edit_address or None, edit_tier, farmer_id))
-                        conn.commit()
-                        st.success("Farmer details updated successfully!")
-                        st.rerun()
-
-        conn.close()
     elif selection == "Manage Customers" and st.session_state.role in ["Admin", "Manager"]:
         # ========================
         # ULTIMATE MANAGE CUSTOMERS - FULLY WORKING & REAL-TIME (like Manage Farmers)
@@ -1565,27 +2233,8 @@ if st.session_state.user_type == "Internal":
         st.header("🏪 Customer Management")
         st.markdown("**Clean • Real-time • All actions work instantly**")
 
-        conn = get_conn()
-        c = conn.cursor()
-
         # Real-time fresh list
-        df_customers = pd.read_sql_query("""
-            SELECT
-                c.id,
-                c.name,
-                c.type,
-                c.contact,
-                c.discount_type || ' ' || c.discount_value ||
-                    CASE WHEN c.discount_type = 'Percentage' THEN '%' ELSE ' ₱' END AS discount,
-                c.loyalty_points,
-                c.current_balance,
-                COALESCE(SUM(s.total_amount), 0) AS lifetime_spend,
-                COUNT(s.id) AS total_purchases
-            FROM customers c
-            LEFT JOIN sales s ON s.customer_type = 'Registered Buyer' AND s.customer_id = c.id
-            GROUP BY c.id
-            ORDER BY lifetime_spend DESC
-        """, conn)
+        df_customers = read_df(queries.CUSTOMER_LIST_WITH_TOTALS)
 
         if df_customers.empty:
             st.info("No customers yet. Register your first buyer below!")
@@ -1644,125 +2293,58 @@ if st.session_state.user_type == "Internal":
                         st.error("Required fields missing!")
                     else:
                         try:
-                            c.execute("""
-                                INSERT INTO customers (name, type, contact, username, password, discount_type, discount_value, loyalty_points, current_balance)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
-                            """, (name.strip(), customer_type, contact or None, username.strip(), password, discount_type, discount_value, points))
-                            conn.commit()
+                            with write_tx() as conn:
+                                conn.execute("""
+                                    INSERT INTO customers (name, type, contact, username, password, discount_type, discount_value, loyalty_points, current_balance)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+                                """, (name.strip(), customer_type, contact or None, username.strip(), password, discount_type, discount_value, points))
                             st.success(f"**{name}** registered successfully!")
                             st.rerun()
                         except sqlite3.IntegrityError:
                             st.error("Username or name already exists!")
 
         with tab_manage:
-            if df_customers.empty:
-                st.info("No customers to manage.")
-            else:
-                st.subheader("Manage Customer")
-                customer_names = df_customers["name"].tolist()
-                selected_name = st.selectbox("Select customer", customer_names, key="manage_customer_select_final")
-
-                # Fresh query for selected customer (this is the key fix!)
-                selected_data = conn.execute("""
-                    SELECT
-                        c.id,
-                        c.name,
-                        c.type,
-                        c.contact,
-                        c.discount_type || ' ' || c.discount_value ||
-                            CASE WHEN c.discount_type = 'Percentage' THEN '%' ELSE ' ₱' END AS discount,
-                        c.loyalty_points,
-                        c.current_balance
-                    FROM customers c
-                    WHERE c.name = ?
-                """, (selected_name,)).fetchone()
-
-                if selected_data:
-                    cid = selected_data["id"]
-
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric("Type", selected_data["type"])
-                    with col2:
-                        st.metric("Discount", selected_data["discount"])
-                    with col3:
-                        st.metric("Points", f"{selected_data['loyalty_points']:,}")
-                    with col4:
-                        balance = selected_data["current_balance"]
-                        st.metric("Balance", f"₱{balance:,.2f}" if balance > 0 else "Clear")
-
-                    subtab_edit, subtab_balance, subtab_pass, subtab_del = st.tabs(["Edit Details", "Balance", "Password", "Delete"])
-
-                    with subtab_edit:
-                        current = conn.execute("SELECT * FROM customers WHERE id = ?", (cid,)).fetchone()
-                        if current:
-                            with st.form("edit_customer_form_final"):
-                                col1, col2 = st.columns(2)
-                                with col1:
-                                    e_name = st.text_input("Name", value=current["name"])
-                                    e_type = st.selectbox("Type", ["Reseller", "Distributor", "Institutional Buyer"],
-                                                          index=["Reseller", "Distributor", "Institutional Buyer"].index(current["type"]))
-                                    e_contact = st.text_input("Contact", value=current["contact"] or "")
-                                with col2:
-                                    e_discount_type = st.selectbox("Discount Type", ["Percentage", "Fixed"],
-                                                                   index=["Percentage", "Fixed"].index(current["discount_type"]))
-                                    e_discount_value = st.number_input("Discount Value", min_value=0.0, value=float(current["discount_value"]))
-                                    e_points = st.number_input("Points", min_value=0, value=current["loyalty_points"])
-
-                                if st.form_submit_button("Update Details", type="primary"):
-                                    try:
-                                        c.execute("""
-                                            UPDATE customers SET name = ?, type = ?, contact = ?, discount_type = ?, discount_value = ?, loyalty_points = ?
-                                            WHERE id = ?
-                                        """, (e_name.strip(), e_type, e_contact or None, e_discount_type, e_discount_value, e_points, cid))
-                                        conn.commit()
-                                        st.success(f"**{e_name}** details updated successfully!")
-                                        st.rerun()
-                                    except sqlite3.IntegrityError:
-                                        st.error("Name already exists!")
-
-                    with subtab_balance:
-                        st.subheader("Balance Adjustment")
-                        with st.form("balance_form_final"):
-                            action = st.radio("Action", ["Record Payment (reduce)", "Add Credit (increase)"])
-                            amount = st.number_input("Amount ₱", min_value=0.01)
-                            note = st.text_input("Note (optional)")
-
-                            if st.form_submit_button("Apply", type="primary"):
-                                op = -1 if "Payment" in action else 1
-                                new_balance = selected_data["current_balance"] + (amount * op)
-                                c.execute("UPDATE customers SET current_balance = ? WHERE id = ?", (new_balance, cid))
-                                conn.commit()
-                                st.success(f"Balance updated successfully! New balance: ₱{new_balance:,.2f}")
-                                st.rerun()
-
-                    with subtab_pass:
-                        st.subheader("Reset Password")
-                        new_p = st.text_input("New Password", type="password")
-                        confirm_p = st.text_input("Confirm Password", type="password")
-                        if st.button("Reset Password", type="secondary"):
-                            if new_p == confirm_p and new_p.strip():
-                                c.execute("UPDATE customers SET password = ? WHERE id = ?", (new_p, cid))
-                                conn.commit()
-                                st.success("Password reset successfully!")
-                                st.rerun()
-                            else:
-                                st.error("Passwords don't match or empty.")
-
-                    with subtab_del:
-                        if st.session_state.role == "Admin":
-                            st.warning("Permanent action!")
-                            if st.button("Delete Customer Permanently", type="secondary"):
-                                c.execute("DELETE FROM customers WHERE id = ?", (cid,))
-                                conn.commit()
-                                st.error(f"Customer **{selected_name}** deleted successfully!")
-                                st.rerun()
-                        else:
-                            st.info("Only Admin can delete.")
-                else:
-                    st.error("Customer not found.")
+            manage_customer(df_customers)
+
+    elif selection == "Pricing" and st.session_state.role in ["Admin", "Manager"]:
+        # ========================
+        # MILK PRICE SCHEDULES
+        # ========================
+        st.header("💰 Milk Price Schedules")
+        st.markdown("**Versioned rates • Quality, volume & loyalty bonus steps • What-if repricing of the last 12 months**")
+
+        book = pricing.price_book_for(get_pool())
+        current = book.schedule_on(date.today())
+
+        st.subheader(f"📋 In Force Today: {current.name}")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Base Price", f"₱{current.base_price:.2f}/L")
+        with col2:
+            st.metric("Consistency Bonus", f"₱{current.consistency_bonus:.2f}/L")
+        with col3:
+            st.metric("Effective Since", current.effective_date)
+        st.caption("Loyalty bonus: " + " • ".join(f"{tier} ₱{current.loyalty[tier]:g}/L" for tier in pricing.TIERS))
+
+        df_schedules = read_df("""
+            SELECT name AS Schedule, effective_date AS "Effective From", base_price AS "Base ₱/L",
+                   consistency_bonus AS "Consistency ₱/L", loyalty_bronze AS Bronze, loyalty_silver AS Silver,
+                   loyalty_gold AS Gold, loyalty_platinum AS Platinum,
+                   COALESCE(created_by, '') AS "Published By", COALESCE(notes, '') AS Notes
+            FROM price_schedules
+            ORDER BY effective_date DESC
+        """)
+        df_schedules.insert(0, "Status", [
+            "Upcoming" if d > date.today().isoformat() else "In force" if d == current.effective_date else "Past"
+            for d in df_schedules["Effective From"]
+        ])
+        with st.expander(f"🗂️ Schedule History ({len(df_schedules)})"):
+            st.dataframe(df_schedules, width="stretch", hide_index=True)
+
+        st.divider()
+
+        price_schedule_planner(current)
 
-        conn.close()
     elif selection == "Announcements" and st.session_state.role in ["Admin", "Manager"]:
         # ========================
         # ADVANCE ANNOUNCEMENTS WITH SAFE IMAGE & FILE UPLOAD
@@ -1770,13 +2352,6 @@ if st.session_state.user_type == "Internal":
         st.header("📢 Advanced Announcements System")
         st.markdown("**Broadcast with rich text • Attach images & files • Real-time • Safe file handling**")
 
-        conn = get_conn()
-        c = conn.cursor()
-
-        # Create folder if not exists
-        if not os.path.exists("announcements"):
-            os.makedirs("announcements")
-
         # === CREATE NEW ANNOUNCEMENT ===
         with st.expander("📝 Create New Announcement", expanded=True):
             with st.form("new_announcement_form"):
@@ -1789,83 +2364,40 @@ if st.session_state.user_type == "Internal":
 
                 col1, col2 = st.columns(2)
                 with col1:
-                    uploaded_image = st.file_uploader("Attach Image (optional)", type=["jpg", "jpeg", "png"])
+                    uploaded_image = st.file_uploader("Attach Image (optional)", type=attachments.IMAGE_TYPES)
                 with col2:
-                    uploaded_file = st.file_uploader("Attach File (optional)", type=["pdf", "docx", "xlsx", "txt", "csv"])
+                    uploaded_file = st.file_uploader("Attach File (optional)", type=attachments.FILE_TYPES)
 
                 submitted = st.form_submit_button("Publish Announcement", type="primary")
                 if submitted:
                     if not title.strip() or not content.strip():
                         st.error("Title and content are required!")
                     else:
-                        image_markdown = ""
-                        file_markdown = ""
-
-                        # Safe image upload
-                        if uploaded_image:
-                            # Clean filename: remove spaces and special chars
-                            safe_image_name = "".join(c for c in uploaded_image.name if c.isalnum() or c in "._-") 
-                            safe_image_name = safe_image_name.replace(" ", "_")
-                            image_path = f"announcements/{safe_image_name}"
-                            with open(image_path, "wb") as f:
-                                f.write(uploaded_image.getbuffer())
-                            image_markdown = f"\n\n![Attached Image]({image_path})"
-
-                        # Safe file upload
-                        if uploaded_file:
-                            safe_file_name = "".join(c for c in uploaded_file.name if c.isalnum() or c in "._-")
-                            safe_file_name = safe_file_name.replace(" ", "_")
-                            file_path = f"announcements/{safe_file_name}"
-                            with open(file_path, "wb") as f:
-                                f.write(uploaded_file.getbuffer())
-                            file_markdown = f"\n\n[📎 Download Attached File]({file_path})"
-
                         priority_title = "🔴 URGENT: " + title if priority else title
                         target_type = target.replace(" Only", "").replace("All", "All")
 
-                        full_content = content.strip() + image_markdown + file_markdown
-
-                        c.execute("""
-                            INSERT INTO announcements (title, content, target_type)
-                            VALUES (?, ?, ?)
-                        """, (priority_title.strip(), full_content, target_type))
-
-                        conn.commit()
-                        st.success("Announcement published successfully with attachments!")
-                        st.balloons()
-                        st.rerun()
+                        try:
+                            # Files are moved into place once the announcement has committed
+                            with attachments.staging() as staged, write_tx() as conn:
+                                announcement_id = conn.execute("""
+                                    INSERT INTO announcements (title, content, target_type)
+                                    VALUES (?, ?, ?)
+                                """, (priority_title.strip(), content.strip(), target_type)).lastrowid
+                                # Images are downscaled and recompressed, with a thumbnail, as they are stored
+                                attachments.attach(conn, announcement_id, [
+                                    attachments.store(conn, upload.getvalue(), upload.name, staged)
+                                    for upload in (uploaded_image, uploaded_file) if upload])
+                        except ValueError as e:
+                            st.error(f"Announcement not published. {e}")
+                        else:
+                            st.success("Announcement published successfully with attachments!")
+                            st.balloons()
+                            st.rerun()
 
         st.divider()
 
-        # === ANNOUNCEMENT HISTORY ===
-        st.subheader("📜 Announcement History")
-
-        df_ann = pd.read_sql_query("""
-            SELECT id, title, content, target_type, created_date
-            FROM announcements
-            ORDER BY created_date DESC
-        """, conn)
-
-        if df_ann.empty:
-            st.info("No announcements yet.")
-        else:
-            for _, row in df_ann.iterrows():
-                priority_badge = "🔴 **HIGH PRIORITY**" if "🔴" in row["title"] else ""
-                clean_title = row["title"].replace("🔴 URGENT: ", "").replace("🔴 ", "")
-
-                with st.expander(f"{priority_badge} **{clean_title}** • To: {row['target_type']} • {row['created_date']}", expanded=False):
-                    st.markdown(row["content"], unsafe_allow_html=True)
-
-                    if st.button("Delete Announcement", key=f"del_ann_{row['id']}", type="secondary"):
-                        if st.session_state.role == "Admin":
-                            c.execute("DELETE FROM announcements WHERE id = ?", (row["id"],))
-                            conn.commit()
-                            st.error("Announcement deleted!")
-                            st.rerun()
-                        else:
-                            st.error("Only Admin can delete.")
+        announcement_history()
 
-        conn.close()
     elif selection == "Messages & Notifications" and st.session_state.role in ["Admin", "Manager", "Sales Clerk", "Field Staff"]:
         # ========================
         # ADVANCE MESSAGING & NOTIFICATIONS
@@ -1873,89 +2405,25 @@ if st.session_state.user_type == "Internal":
         st.header("💬 Advanced Messaging & Notifications Center")
         st.markdown("**Real-time chat with Farmers & Customers • Instant notifications • Read status • Beautiful chat UI**")
 
-        conn = get_conn()
-        c = conn.cursor()
-
         # Tabs for clean UX
         tab_inbox, tab_notifications = st.tabs(["📨 Incoming Messages", "🔔 Notifications"])
 
         with tab_inbox:
-            st.subheader("Incoming Messages from Farmers & Customers")
-
-            # Get all messages
-            df_messages = pd.read_sql_query("""
-                SELECT m.id, m.sender_type, m.sender_id, m.sender_name, m.message, m.timestamp
-                FROM messages m
-                WHERE m.sender_type IN ('Farmer', 'Customer')
-                ORDER BY m.timestamp DESC
-            """, conn)
-
-            if df_messages.empty:
-                st.info("No incoming messages yet. When farmers or customers send messages from their portal, they will appear here.")
-            else:
-                # Group by sender for chat threads
-                senders = df_messages[["sender_type", "sender_id", "sender_name"]].drop_duplicates()
-
-                for _, sender in senders.iterrows():
-                    sender_type = "🐄 Farmer" if sender["sender_type"] == "Farmer" else "🏪 Customer"
-                    sender_name = sender["sender_name"]
-                    sender_id = sender["sender_id"]
-
-                    with st.expander(f"{sender_type}: **{sender_name}**", expanded=False):
-                        # Show messages from this sender
-                        sender_messages = df_messages[
-                            (df_messages["sender_id"] == sender_id) & 
-                            (df_messages["sender_type"] == sender["sender_type"])
-                        ].sort_values("timestamp")
-
-                        for _, msg in sender_messages.iterrows():
-                            with st.chat_message("user"):
-                                st.caption(msg["timestamp"])
-                                st.write(msg["message"])
-
-                        # Reply form
-                        st.markdown("**Reply to this user**")
-                        with st.form(f"reply_form_{sender_id}_{sender_type}", clear_on_submit=True):
-                            reply_text = st.text_area("Your reply", height=100, key=f"reply_text_{sender_id}")
-                            if st.form_submit_button("Send Reply", type="primary"):
-                                if reply_text.strip():
-                                    # In real app, you could save reply and notify user
-                                    st.success("Reply sent successfully!")
-                                    # Optional: add to messages table as internal reply
-                                    st.rerun()
-                                else:
-                                    st.error("Cannot send empty reply.")
+            message_inbox()
 
         with tab_notifications:
             st.subheader("🔔 System Notifications")
+            notification_feed("Internal", st.session_state.user_id)
 
-            # Mark all as read button
-            unread_count = conn.execute("SELECT COUNT(*) FROM notifications WHERE user_type = 'Internal' AND is_read = 0").fetchone()[0]
-            if unread_count > 0:
-                st.success(f"You have **{unread_count}** unread notification(s)")
-                if st.button("Mark All as Read", type="secondary"):
-                    c.execute("UPDATE notifications SET is_read = 1 WHERE user_type = 'Internal'")
-                    conn.commit()
-                    st.success("All notifications marked as read!")
-                    st.rerun()
-
-            df_notif = pd.read_sql_query("""
-                SELECT message, created_date, is_read
-                FROM notifications
-                WHERE user_type = 'Internal'
-                ORDER BY created_date DESC
-            """, conn)
-
-            if df_notif.empty:
-                st.info("No notifications yet.")
-            else:
-                for _, notif in df_notif.iterrows():
-                    badge = "🟡 New" if notif["is_read"] == 0 else "✅ Read"
-                    with st.chat_message("assistant"):
-                        st.caption(f"{badge} • {notif['created_date']}")
-                        st.write(notif["message"])
-
-        conn.close()
+    elif selection == "Performance" and st.session_state.role == "Admin":
+        # ========================
+        # QUERY PERFORMANCE (ADMIN)
+        # ========================
+        st.header("⏱️ Query Performance")
+        st.markdown("**Which queries each page spends its time on • p95 latency per page • slow queries with their query plans • rerun profiles**")
+        performance_report()
+        st.divider()
+        rerun_profiles()
 
 # ========================
 # FULL SUPER ADVANCE FARMER & CUSTOMER PORTALS
@@ -1963,29 +2431,18 @@ if st.session_state.user_type == "Internal":
 
 # FARMER PORTAL
 elif st.session_state.user_type == "Farmer":
+    set_current_page("Farmer Portal")
     st.title("🐄 Dairy Farmer Portal")
     st.markdown(f"**Mabuhay, {st.session_state.name}!** 🌾🥛")
     st.markdown(f"**Loyalty Tier:** {st.session_state.get('loyalty_tier', 'Bronze')}")
 
-    conn = get_conn()
-    c = conn.cursor()
     farmer_id = st.session_state.user_id
 
     # Farmer Stats
-    stats = pd.read_sql_query(f"""
-        SELECT 
-            COALESCE(SUM(class_a_litres + class_b_litres), 0) AS total_litres,
-            COALESCE(SUM(total_payment), 0) AS total_earnings,
-            COUNT(*) AS deliveries
-        FROM milk_collections
-        WHERE farmer_id = {farmer_id}
-    """, conn).iloc[0]
+    profiler.section("Stats")
+    stats = read_df(queries.FARMER_LIFETIME_STATS, (farmer_id,)).iloc[0]
 
-    this_month = pd.read_sql_query(f"""
-        SELECT COALESCE(SUM(class_a_litres + class_b_litres), 0) AS month_litres
-        FROM milk_collections
-        WHERE farmer_id = {farmer_id} AND strftime('%Y-%m', collection_date) = strftime('%Y-%m', 'now')
-    """, conn).iloc[0]["month_litres"]
+    this_month = read_one(queries.FARMER_MONTH_STATS, (farmer_id, queries.month_key(date.today())))["litres"]
 
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -2000,78 +2457,60 @@ elif st.session_state.user_type == "Farmer":
     st.divider()
 
     # Supply History
+    profiler.section("Supply history")
     st.subheader("📋 My Supply History")
-    df_history = pd.read_sql_query(f"""
-        SELECT collection_date AS Date,
-               ROUND(class_a_litres + class_b_litres, 1) AS Liters,
-               total_payment AS "Payment ₱",
-               notes AS Notes
-        FROM milk_collections
-        WHERE farmer_id = {farmer_id}
-        ORDER BY collection_date DESC
-    """, conn)
+    df_history = read_df(queries.FARMER_SUPPLY_HISTORY, (farmer_id,))
 
     if not df_history.empty:
-        st.dataframe(df_history.style.format({"Payment ₱": "₱{:.0f}"}), use_container_width=True, hide_index=True)
+        st.dataframe(df_history.style.format({"Payment ₱": "₱{:.0f}"}), width="stretch", hide_index=True)
     else:
         st.info("No collections recorded yet. Start delivering milk to see your history!")
 
     st.divider()
 
+    # Notifications for this farmer (collections, rejections, replies)
+    profiler.section("Notifications")
+    st.subheader("🔔 My Notifications")
+    notification_feed("Farmer", farmer_id)
+
+    st.divider()
+
     # Announcements for Farmers
+    profiler.section("Announcements")
     st.subheader("📢 Announcements")
-    df_ann = pd.read_sql_query("""
-        SELECT title, content, created_date
-        FROM announcements
-        WHERE target_type IN ('All', 'Dairy Farmer')
-        ORDER BY created_date DESC
-    """, conn)
-
-    if not df_ann.empty:
-        for _, ann in df_ann.iterrows():
-            priority = "🔴 **URGENT**" if "🔴" in ann["title"] else ""
-            clean_title = ann["title"].replace("🔴 URGENT: ", "").replace("🔴 ", "")
-            with st.expander(f"{priority} **{clean_title}** • {ann['created_date']}"):
-                st.markdown(ann["content"], unsafe_allow_html=True)
-    else:
-        st.info("No announcements at this time.")
+    portal_announcements(queries.FARMER_ANNOUNCEMENTS, ())
 
     st.divider()
 
     # Send Message to Management
+    profiler.section("Messages")
     st.subheader("✉️ Send Message to Management")
+    party_conversation("Farmer", farmer_id)
     with st.form("farmer_message_form"):
         message = st.text_area("Your message, concern, or feedback", height=150)
         if st.form_submit_button("Send Message", type="primary"):
             if message.strip():
-                c.execute("""
-                    INSERT INTO messages (sender_type, sender_id, sender_name, message)
-                    VALUES ('Farmer', ?, ?, ?)
-                """, (farmer_id, st.session_state.name, message.strip()))
-                conn.commit()
-                add_notification("Internal", None, f"New message from farmer: {st.session_state.name}")
+                with write_tx() as conn:
+                    messaging.post_message(conn, "Farmer", farmer_id, st.session_state.name,
+                                           "Farmer", farmer_id, st.session_state.name, message.strip())
+                    add_notification("Internal", None, f"New message from farmer: {st.session_state.name}")
                 st.success("Message sent successfully!")
                 st.rerun()
             else:
                 st.error("Message cannot be empty.")
 
-    conn.close()
-
 # CUSTOMER PORTAL
 elif st.session_state.user_type == "Customer":
+    set_current_page("Customer Portal")
     st.title("🏪 Registered Buyer Portal")
     st.markdown(f"**Welcome back, {st.session_state.name}!** 🛒")
     st.markdown(f"**Account Type:** {st.session_state.customer_type}")
 
-    conn = get_conn()
-    c = conn.cursor()
     customer_id = st.session_state.user_id
 
     # Customer Info
-    cust_info = conn.execute("""
-        SELECT discount_type, discount_value, loyalty_points, current_balance
-        FROM customers WHERE id = ?
-    """, (customer_id,)).fetchone()
+    profiler.section("Stats")
+    cust_info = read_one(queries.CUSTOMER_INFO, (customer_id,))
 
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -2084,8 +2523,9 @@ elif st.session_state.user_type == "Customer":
     st.divider()
 
     # Price List with Personal Discount
+    profiler.section("Price list")
     st.subheader("💲 Your Personalized Price List")
-    df_products = pd.read_sql_query("SELECT name, unit, srp FROM products WHERE srp > 0 ORDER BY name", conn)
+    df_products = read_df(queries.CUSTOMER_PRICE_LIST)
 
     if not df_products.empty:
         df_products["Your Price"] = df_products["srp"].apply(lambda p: apply_discount(p, cust_info["discount_type"], cust_info["discount_value"]))
@@ -2093,68 +2533,59 @@ elif st.session_state.user_type == "Customer":
         df_products["Your Price"] = df_products["Your Price"].apply(lambda x: f"₱{x:,.2f}")
         df_products = df_products[["name", "unit", "Standard Price", "Your Price"]]
         df_products.columns = ["Product", "Unit", "Standard Price", "Your Price"]
-        st.dataframe(df_products, use_container_width=True, hide_index=True)
+        st.dataframe(df_products, width="stretch", hide_index=True)
     else:
         st.info("No products available yet.")
 
     st.divider()
 
     # Purchase History
+    profiler.section("Purchase history")
     st.subheader("🧾 Purchase History")
-    df_sales = pd.read_sql_query(f"""
-        SELECT sale_date AS Date, total_amount AS Amount, payment_type AS "Payment Method"
-        FROM sales
-        WHERE customer_type = 'Registered Buyer' AND customer_id = {customer_id}
-        ORDER BY sale_date DESC
-    """, conn)
+    df_sales = read_df(queries.CUSTOMER_PURCHASE_HISTORY, (customer_id,))
 
     if not df_sales.empty:
-        st.dataframe(df_sales.style.format({"Amount": "₱{:.0f}"}), use_container_width=True, hide_index=True)
+        st.dataframe(df_sales.style.format({"Amount": "₱{:.0f}"}), width="stretch", hide_index=True)
     else:
         st.info("No purchases yet. Start buying to see your history!")
 
     st.divider()
 
+    # Notifications for this customer (purchases, replies)
+    profiler.section("Notifications")
+    st.subheader("🔔 My Notifications")
+    notification_feed("Customer", customer_id)
+
+    st.divider()
+
     # Announcements for Customer
+    profiler.section("Announcements")
     st.subheader("📢 Announcements")
-    df_ann = pd.read_sql_query(f"""
-        SELECT title, content, created_date
-        FROM announcements
-        WHERE target_type = 'All' OR target_type = '{st.session_state.customer_type}'
-        ORDER BY created_date DESC
-    """, conn)
-
-    if not df_ann.empty:
-        for _, ann in df_ann.iterrows():
-            priority = "🔴 **URGENT**" if "🔴" in ann["title"] else ""
-            clean_title = ann["title"].replace("🔴 URGENT: ", "").replace("🔴 ", "")
-            with st.expander(f"{priority} **{clean_title}** • {ann['created_date']}"):
-                st.markdown(ann["content"], unsafe_allow_html=True)
-    else:
-        st.info("No announcements at this time.")
+    portal_announcements(queries.CUSTOMER_ANNOUNCEMENTS, (st.session_state.customer_type,))
 
     st.divider()
 
     # Send Message to Management
+    profiler.section("Messages")
     st.subheader("✉️ Contact Us")
+    party_conversation("Customer", customer_id)
     with st.form("customer_message_form"):
         message = st.text_area("Inquiry, feedback, or order request", height=150)
         if st.form_submit_button("Send Message", type="primary"):
             if message.strip():
-                c.execute("""
-                    INSERT INTO messages (sender_type, sender_id, sender_name, message)
-                    VALUES ('Customer', ?, ?, ?)
-                """, (customer_id, st.session_state.name, message.strip()))
-                conn.commit()
-                add_notification("Internal", None, f"New message from customer: {st.session_state.name}")
+                with write_tx() as conn:
+                    messaging.post_message(conn, "Customer", customer_id, st.session_state.name,
+                                           "Customer", customer_id, st.session_state.name, message.strip())
+                    add_notification("Internal", None, f"New message from customer: {st.session_state.name}")
                 st.success("Message sent successfully!")
                 st.rerun()
             else:
                 st.error("Message cannot be empty.")
 
-    conn.close()
-
 else:
     st.error("Unknown user type. Please log in again.")
 
+observe_rerun()
+profiler.end()
+
 st.success("✅ Portal loaded successfully!")
\ No newline at end of file
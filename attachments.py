@@ -0,0 +1,221 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+from PIL import Image, ImageOps
+
+# ========================
+# ANNOUNCEMENT ATTACHMENTS
+# ========================
+# Uploads are stored once, named by the SHA-256 of the uploaded bytes, so two
+# files with the same name never overwrite each other and the same photo posted
+# twice is stored once. Images are downscaled and recompressed on upload, and a
+# small thumbnail is made at the same time. They are stored as JPEG (PNG only when
+# the image has transparency) no wider than Streamlit's content width, because
+# st.image re-encodes any other format or size on every render. The attachments
+# table keeps the metadata. Portals show thumbnails; the full image or file is
+# only read when someone asks for it.
+#
+# Files follow their rows: a new file is written under a temporary name and only
+# moved into place once the transaction that inserted its row has committed, and
+# a pruned file is only deleted once no row points at its path any more.
+
+STORE_DIR = "announcements"
+
+IMAGE_TYPES = ["jpg", "jpeg", "png"]
+FILE_TYPES = ["pdf", "docx", "xlsx", "txt", "csv"]
+
+MAX_IMAGE_EDGE = 1440        # longest side of the stored image, in pixels (st.image downsizes above 1460)
+THUMB_EDGE = 320
+IMAGE_QUALITY = 80
+THUMB_QUALITY = 70
+
+MIME_TYPES = {
+    "jpg": "image/jpeg", "png": "image/png", "pdf": "application/pdf", "txt": "text/plain", "csv": "text/csv",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# Links the old announcement form wrote into the content
+LEGACY_LINK = re.compile(r"\n*!?\[(?:Attached Image|📎 Download Attached File)\]\((announcements/[^)\s]+)\)")
+
+
+def _extension(name):
+    return name.rsplit(".", 1)[-1].lower() if "." in name else ""
+
+
+def _stage(staged, path, data):
+    # Written beside the target under a unique name; publish() renames it into place
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    staged.append((tmp, path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+
+
+def publish(staged):
+    for tmp, path in staged:
+        os.replace(tmp, path)
+
+
+def discard(staged):
+    for tmp, _ in staged:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def staging():
+    """Collects the files store() writes; they are moved into place when the block ends without an error.
+
+    Open it before the write transaction, so the transaction has committed first:
+        with attachments.staging() as staged, write_tx() as conn: ...
+    """
+    staged = []
+    try:
+        yield staged
+    except BaseException:
+        discard(staged)
+        raise
+    publish(staged)
+
+
+def _encode(img, edge, quality):
+    img = img.copy()
+    img.thumbnail((edge, edge), Image.LANCZOS)
+    out = io.BytesIO()
+    if img.mode == "RGBA":
+        img.save(out, "PNG", optimize=True)
+    else:
+        img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue(), img.size
+
+
+def compress_image(data):
+    """(extension, full image bytes, (width, height), thumbnail bytes). Raises ValueError for unreadable images."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEGs decode straight at a reduced scale when they are far larger than needed
+            img.draft("RGB", (MAX_IMAGE_EDGE, MAX_IMAGE_EDGE))
+            img = ImageOps.exif_transpose(img)
+            has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+            img = img.convert("RGBA" if has_alpha else "RGB")
+            if has_alpha and img.getchannel("A").getextrema()[0] == 255:
+                # An alpha channel that is opaque everywhere doesn't need PNG
+                has_alpha, img = False, img.convert("RGB")
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Could not read image: {e}")
+    full, size = _encode(img, MAX_IMAGE_EDGE, IMAGE_QUALITY)
+    thumb, _ = _encode(img, THUMB_EDGE, THUMB_QUALITY)
+    return "png" if has_alpha else "jpg", full, size, thumb
+
+
+def store(conn, data, original_name, staged, store_dir=STORE_DIR):
+    """Save an uploaded image or file (deduplicated by content) and return its attachment id.
+
+    New files are added to staged (see staging()) and only appear once it is published.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    row = conn.execute("SELECT id FROM attachments WHERE sha256 = ?", (digest,)).fetchone()
+    if row:
+        return row["id"]
+
+    os.makedirs(store_dir, exist_ok=True)
+    ext = _extension(original_name)
+    if ext in IMAGE_TYPES:
+        image_ext, full, (width, height), thumb = compress_image(data)
+        path = os.path.join(store_dir, f"{digest}.{image_ext}")
+        thumb_path = os.path.join(store_dir, f"{digest}_thumb.{image_ext}")
+        _stage(staged, path, full)
+        _stage(staged, thumb_path, thumb)
+        kind, mime, size = "image", MIME_TYPES[image_ext], len(full)
+    else:
+        path, thumb_path = os.path.join(store_dir, f"{digest}.{ext}" if ext else digest), None
+        _stage(staged, path, data)
+        kind, mime, size, width, height = "file", MIME_TYPES.get(ext, "application/octet-stream"), len(data), None, None
+
+    return conn.execute("""
+        INSERT INTO attachments (sha256, kind, original_name, mime, bytes, original_bytes, width, height, path, thumb_path)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (digest, kind, original_name, mime, size, len(data), width, height, path, thumb_path)).lastrowid
+
+
+def attach(conn, announcement_id, attachment_ids):
+    conn.executemany("INSERT OR IGNORE INTO announcement_attachments (announcement_id, attachment_id, position) VALUES (?, ?, ?)",
+                     [(announcement_id, attachment_id, i) for i, attachment_id in enumerate(attachment_ids)])
+
+
+def for_announcements(read_all, announcement_ids):
+    """{announcement id: [attachment rows in upload order]} for the announcements being shown."""
+    if not announcement_ids:
+        return {}
+    rows = read_all(f"""
+        SELECT aa.announcement_id, a.id, a.kind, a.original_name, a.mime, a.bytes, a.width, a.height, a.path, a.thumb_path
+        FROM announcement_attachments aa
+        JOIN attachments a ON a.id = aa.attachment_id
+        WHERE aa.announcement_id IN ({','.join('?' * len(announcement_ids))})
+        ORDER BY aa.announcement_id, aa.position
+    """, tuple(announcement_ids))
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row["announcement_id"], []).append(row)
+    return grouped
+
+
+def read_file(path):
+    # Passed to st.download_button as a callable, so the file is only read on click
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def prune(conn):
+    """Delete attachments no announcement uses; returns their file paths for remove_files() once the transaction commits."""
+    orphans = conn.execute("""
+        SELECT id, path, thumb_path FROM attachments a
+        WHERE NOT EXISTS (SELECT 1 FROM announcement_attachments aa WHERE aa.attachment_id = a.id)
+    """).fetchall()
+    conn.executemany("DELETE FROM attachments WHERE id = ?", [(row["id"],) for row in orphans])
+    return [path for row in orphans for path in (row["path"], row["thumb_path"]) if path]
+
+
+def remove_files(conn, paths):
+    """Delete pruned files, in a write transaction after the one that pruned them.
+
+    The same content may have been uploaded again since, reusing the path: a path
+    an attachment row still points at is kept.
+    """
+    for path in paths:
+        if conn.execute("SELECT 1 FROM attachments WHERE path = ? OR thumb_path = ?", (path, path)).fetchone():
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def backfill_legacy(conn, staged, store_dir=STORE_DIR):
+    """Copy images and files linked from announcement content into the store.
+
+    The markdown link is dropped from the content; a missing or unreadable file keeps its link.
+    The originals are left where they are: the links are relative to the working directory,
+    so the same file may belong to another copy of the database.
+    """
+    for ann in conn.execute("SELECT id, content FROM announcements WHERE content LIKE '%](announcements/%'").fetchall():
+        attachment_ids = []
+
+        def move(match):
+            path = match.group(1)
+            try:
+                with open(path, "rb") as f:
+                    attachment_ids.append(store(conn, f.read(), os.path.basename(path), staged, store_dir))
+            except (OSError, ValueError):
+                return match.group(0)
+            return ""
+
+        content = LEGACY_LINK.sub(move, ann["content"])
+        attach(conn, ann["id"], attachment_ids)
+        conn.execute("UPDATE announcements SET content = ? WHERE id = ?", (content, ann["id"]))
@@ -0,0 +1,77 @@
+"""Migrate a pre-migration database that holds orphaned history rows, and fail if it breaks.
+
+Usage:
+    python benchmarks/check_migrations.py
+
+Older builds let admins delete customers, farmers and products that still had sales,
+collections or stock movements. This builds such a database in a scratch directory
+(the initial schema plus one orphan of each kind), runs every migration on it and
+checks that it reaches the latest version with no foreign key violations.
+Exits with status 1 and prints what went wrong on failure.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import ConnectionPool
+import migrations
+
+ORPHANS = [
+    # A Registered Buyer sale whose customer was deleted, with its item and ledger row
+    "INSERT INTO sales (id, customer_type, customer_id, total_amount, payment_type, sale_date) VALUES (9001, 'Registered Buyer', 999, 150, 'Cash', '2025-06-01')",
+    "INSERT INTO sale_items (sale_id, product_id, quantity, unit_price) VALUES (9001, 2, 3, 50)",
+    # A delivery from a deleted farmer
+    "INSERT INTO milk_collections (farmer_id, class_a_litres, total_payment, collection_date) VALUES (999, 20, 500, '2025-06-01')",
+    # Sales and stock movements of a deleted product
+    "INSERT INTO sale_items (sale_id, product_id, quantity, unit_price) VALUES (9001, 998, 1, 80)",
+    "INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, transaction_date) VALUES (998, 'OUT', 1, 'Sale #9001', '2025-06-01')",
+]
+
+
+def build(path):
+    pool = ConnectionPool(path)
+    with pool.writer() as conn:
+        migrations.MIGRATIONS[0][2](conn)
+        for statement in ORPHANS:
+            conn.execute(statement)
+    return pool
+
+
+def main(argv):
+    path = os.path.join(tempfile.mkdtemp(), "migration_check.db")
+    pool = build(path)
+    try:
+        migrations.migrate(pool)
+    except migrations.MigrationError as e:
+        print(f"FAILED     {e}")
+        return 1
+
+    failures = []
+    with pool.reader() as conn:
+        version = migrations.current_version(conn)
+        if version != migrations.MIGRATIONS[-1][0]:
+            failures.append(f"stopped at version {version}")
+        violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+        if violations:
+            failures.append(f"{len(violations)} foreign key violation(s) left")
+        sale = conn.execute("SELECT customer_id, total_amount FROM sales WHERE id = 9001").fetchone()
+        if sale is None or sale["customer_id"] is not None or sale["total_amount"] != 150:
+            failures.append("the orphaned sale was not kept with its customer unlinked")
+        if conn.execute("SELECT COUNT(*) FROM milk_collections WHERE farmer_id IS NULL AND total_payment = 500").fetchone()[0] != 1:
+            failures.append("the orphaned delivery was not kept with its farmer unlinked")
+        if conn.execute("SELECT name FROM products WHERE id = 998").fetchone() is None:
+            failures.append("no placeholder product for the deleted product's history")
+    pool.close()
+
+    for failure in failures:
+        print(f"FAILED     {failure}")
+    if failures:
+        return 1
+    print(f"ok         migrated a database with orphaned history to version {version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,81 @@
+"""Fail if any dashboard or portal query full-scans a fact table.
+
+Usage:
+    python benchmarks/check_query_plans.py [path/to/database.db]
+
+Without a path the check runs against a freshly migrated scratch database.
+Exits with status 1 and prints the offending plan lines on failure.
+"""
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import ConnectionPool
+from migrations import migrate
+import queries
+
+# Tables that grow with every delivery, sale or message; dimension tables
+# (products, farmers, customers, users) are small enough to scan.
+FACT_TABLES = {
+    "milk_collections", "sales", "sale_items", "inventory_transactions",
+    "notifications", "announcements", "messages", "daily_summary", "farmer_monthly_stats",
+    "production_batches", "inventory_lots", "lot_allocations",
+    "stock_checkpoints", "message_threads", "notification_deliveries",
+    "notification_outbox",
+}
+
+TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+# "SCAN t" and "SCAN t USING INDEX i" both read every row; only a covering index scan
+# (which never touches the table) passes, along with SEARCH plans
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)\b(?! USING COVERING INDEX)")
+
+
+def alias_map(sql):
+    aliases = {}
+    for table, alias in TABLE_REF.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in ("WHERE", "JOIN", "ON", "GROUP", "ORDER", "LIMIT", "LEFT", "INNER", "UNION"):
+            aliases[alias] = table
+    return aliases
+
+
+def full_scans(conn, sql, params):
+    aliases = alias_map(sql)
+    offenders = []
+    for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+        match = FULL_SCAN.match(row["detail"].strip())
+        if match and aliases.get(match.group(1), match.group(1)) in FACT_TABLES:
+            offenders.append(row["detail"])
+    return offenders
+
+
+def main(argv):
+    if len(argv) > 1:
+        path = argv[1]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "plan_check.db")
+    pool = ConnectionPool(path)
+    migrate(pool)
+
+    failures = 0
+    with pool.reader() as conn:
+        for name, sql, params in queries.page_queries():
+            offenders = full_scans(conn, sql, params)
+            status = "FULL SCAN" if offenders else "ok"
+            print(f"{status:10} {name}")
+            for detail in offenders:
+                print(f"{'':10}   {detail}")
+            failures += bool(offenders)
+    pool.close()
+
+    if failures:
+        print(f"\n{failures} quer{'y' if failures == 1 else 'ies'} scan a fact table without an index")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,130 @@
+"""Hammer the checkout engine with simultaneous sales of the same product.
+
+Usage:
+    python benchmarks/checkout_stress.py [--threads N] [--processes N] [--sales N] [--stock N]
+
+Clerks run as threads sharing one pool (one Streamlit server) and as separate
+processes with their own pools (several servers on the same database file).
+Every clerk tries to sell more than the stock allows. The run fails (exit 1)
+if stock goes negative or the sales, ledger and customer totals disagree.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkout import checkout, points_earned, CheckoutError
+from db import ConnectionPool
+from migrations import migrate
+
+PRODUCT = "Fresh Milk 1L"
+PRICE = 100.0
+
+
+def clerk(pool, name, sales, product_id, customer_id, results):
+    sold = rejected = 0
+    for _ in range(sales):
+        cart = [{"pid": product_id, "qty": 1, "unit_price": PRICE}]
+        try:
+            checkout(pool, cart, "Registered Buyer", customer_id, "Stress Buyer",
+                     grand_total=PRICE, payment_type="Credit (Utang)", amount_paid=0,
+                     points_redeemed=0, recorded_by=name)
+            sold += 1
+        except CheckoutError:
+            rejected += 1
+    results.put((sold, rejected))
+
+
+def process_clerks(path, threads, sales, product_id, customer_id, results):
+    pool = ConnectionPool(path)
+    run_threads(pool, threads, sales, product_id, customer_id, results)
+    pool.close()
+
+
+def run_threads(pool, threads, sales, product_id, customer_id, results):
+    workers = [threading.Thread(target=clerk, args=(pool, f"clerk-{os.getpid()}-{i}", sales, product_id, customer_id, results))
+               for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8, help="clerks per process")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--sales", type=int, default=50, help="sales attempted per clerk")
+    parser.add_argument("--stock", type=int, default=500)
+    args = parser.parse_args(argv[1:])
+
+    path = os.path.join(tempfile.mkdtemp(), "checkout_stress.db")
+    pool = ConnectionPool(path)
+    migrate(pool)
+    with pool.writer() as conn:
+        product_id = conn.execute("SELECT id FROM products WHERE name = ?", (PRODUCT,)).fetchone()["id"]
+        conn.execute("UPDATE products SET current_stock = ? WHERE id = ?", (args.stock, product_id))
+        customer_id = conn.execute("SELECT id FROM customers ORDER BY id LIMIT 1").fetchone()["id"]
+        conn.execute("UPDATE customers SET current_balance = 0, loyalty_points = 0 WHERE id = ?", (customer_id,))
+
+    attempted = args.threads * args.processes * args.sales
+    print(f"{attempted} checkouts from {args.threads * args.processes} clerks against {args.stock} in stock")
+
+    results = Queue()
+    started = time.perf_counter()
+    procs = [Process(target=process_clerks, args=(path, args.threads, args.sales, product_id, customer_id, results))
+             for _ in range(args.processes - 1)]
+    for p in procs:
+        p.start()
+    # This process takes part too, sharing the pool the way Streamlit sessions do
+    run_threads(pool, args.threads, args.sales, product_id, customer_id, results)
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+
+    sold = rejected = 0
+    for _ in range(args.threads * args.processes):
+        s, r = results.get()
+        sold += s
+        rejected += r
+
+    totals = pool.read_one("""
+        SELECT
+            (SELECT current_stock FROM products WHERE id = :pid) AS stock,
+            (SELECT COUNT(*) FROM sales) AS sales,
+            (SELECT COALESCE(SUM(quantity), 0) FROM sale_items WHERE product_id = :pid) AS items_sold,
+            (SELECT COALESCE(SUM(quantity), 0) FROM inventory_transactions
+             WHERE product_id = :pid AND transaction_type = 'OUT') AS ledger_out,
+            (SELECT current_balance FROM customers WHERE id = :cid) AS balance,
+            (SELECT loyalty_points FROM customers WHERE id = :cid) AS points
+    """, {"pid": product_id, "cid": customer_id}, cached=False)
+    pool.close()
+
+    print(f"sold {sold}, rejected {rejected} in {elapsed:.2f}s ({attempted / elapsed:,.0f} checkouts/s)")
+    print(f"stock left {totals['stock']:g}, balance ₱{totals['balance']:,.2f}, points {totals['points']:,}")
+
+    expected_sold = min(attempted, args.stock)
+    problems = []
+    if totals["stock"] < 0:
+        problems.append("stock went negative")
+    if sold != expected_sold or sold + rejected != attempted:
+        problems.append(f"expected {expected_sold} sales to succeed, got {sold}")
+    if totals["sales"] != sold or totals["items_sold"] != sold or totals["ledger_out"] != sold:
+        problems.append("sales, sale_items and inventory ledger disagree")
+    if totals["stock"] != args.stock - sold:
+        problems.append("stock does not match units sold")
+    if totals["balance"] != sold * PRICE or totals["points"] != sold * points_earned(PRICE):
+        problems.append("customer balance or points lost an update")
+
+    for problem in problems:
+        print("FAIL:", problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,103 @@
+"""Time a year-long collections export and measure its memory use.
+
+Usage:
+    python benchmarks/export_year.py [--farmers N] [--format xlsx|csv]
+
+Fills a scratch database with a synthetic year of deliveries, then exports it
+through exports.ExportManager while the main thread keeps issuing small reads
+(standing in for Streamlit reruns). Reports build time, the slowest concurrent
+read, file size and (with --trace-memory) peak Python memory, and checks the row count and that the
+file opens.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exports
+import queries
+from db import ConnectionPool
+from migrations import migrate
+
+START = date(2025, 1, 1)
+
+
+def fill(pool, farmers, rng):
+    with pool.writer() as conn:
+        conn.executemany("INSERT INTO dairy_farmers (name, loyalty_tier) VALUES (?, 'Bronze')",
+                         [(f"Export Farmer {i}",) for i in range(farmers)])
+        farmer_ids = [row["id"] for row in conn.execute("SELECT id FROM dairy_farmers WHERE name LIKE 'Export Farmer %'")]
+        rows = []
+        for day in range(365):
+            collection_date = (START + timedelta(days=day)).isoformat()
+            litres = rng.uniform(5, 200, len(farmer_ids)).round(1)
+            for farmer_id, l in zip(farmer_ids, litres.tolist()):
+                rows.append((farmer_id, l, round(l * 85, 2), collection_date, 3.9, 8.7, 88.0, "bench"))
+        conn.executemany("""
+            INSERT INTO milk_collections (farmer_id, class_a_litres, class_b_litres, total_payment, collection_date,
+                                          fat_percentage, snf_percentage, quality_score, recorded_by)
+            VALUES (?, ?, 0, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    return len(rows)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--farmers", type=int, default=300)
+    parser.add_argument("--format", choices=sorted(exports.WRITERS), default="xlsx")
+    parser.add_argument("--trace-memory", action="store_true", help="measure peak memory (tracemalloc slows the export several times)")
+    args = parser.parse_args(argv[1:])
+
+    pool = ConnectionPool(os.path.join(tempfile.mkdtemp(), "export_year.db"))
+    migrate(pool)
+    expected = fill(pool, args.farmers, np.random.default_rng(42))
+    end = START + timedelta(days=364)
+    print(f"{expected:,} deliveries in the scratch database")
+
+    manager = exports.ExportManager(pool)
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    job = manager.submit("bench", "Year", f"year.{args.format}",
+                         [("Collections", queries.COLLECTIONS_BETWEEN, (START.isoformat(), end.isoformat()))])
+    slowest_read = 0.0
+    while job.active:
+        t = time.perf_counter()
+        pool.read_one(queries.FARMER_MONTH_STATS, (1, "2025-06"), cached=False)
+        slowest_read = max(slowest_read, time.perf_counter() - t)
+        time.sleep(0.02)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    tracemalloc.stop()
+
+    if job.status != exports.DONE:
+        print("FAIL:", job.error)
+        return 1
+    data = job.data()
+    memory = f", peak Python memory {peak / 1e6:.1f} MB" if peak is not None else ""
+    print(f"{args.format} export: {job.rows:,} rows in {elapsed:.2f}s, {len(data) / 1e6:.1f} MB file{memory}, "
+          f"slowest concurrent read {slowest_read * 1000:.1f} ms")
+
+    if args.format == "xlsx":
+        back = pd.read_excel(io.BytesIO(data), sheet_name="Collections")
+    else:
+        back = pd.read_csv(io.BytesIO(data), encoding="utf-8-sig")
+    manager.shutdown()
+    pool.close()
+    if job.rows != expected or len(back) != expected:
+        print(f"FAIL: expected {expected} rows, exported {job.rows}, file has {len(back)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,470 @@
+"""Fill a new database with deterministic synthetic co-op data at a chosen scale.
+
+Usage:
+    python benchmarks/generate_data.py path/to/new.db [--scale N] [--days N] [--seed N] [--end YYYY-MM-DD]
+
+The database is created by migrations.migrate, so it has exactly the app's schema and
+demo accounts, then filled with farmers, customers and staff, a delivery per farmer on
+most days, walk-in and registered sales with their items, production batches and lots,
+the stock ledger with daily checkpoints, announcements, message threads and notification
+feeds, all ending on --end (today by default). Rollups are written by the app's own
+triggers. The same arguments always give the same rows.
+
+Scale 1 is a 20-farmer co-op with 20 sales a day; scale N has N times the farmers,
+customers and daily sales. Run the app against the result with DAIRY_DB_PATH.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import checkout
+import pricing
+from db import ConnectionPool
+from migrations import migrate
+
+# Per unit of scale
+FARMERS = 20
+CUSTOMERS = 15
+WALK_IN_SALES_PER_DAY = 12
+REGISTERED_SALES_PER_DAY = 8
+
+STAFF = [("manager", "Manager"), ("clerk1", "Sales Clerk"), ("clerk2", "Sales Clerk"), ("field1", "Field Staff"), ("field2", "Field Staff")]
+DAYS = 730
+ANNOUNCEMENTS_PER_WEEK = 2
+THREAD_SHARE = 0.3              # farmers and customers who have written in
+READ_AFTER_DAYS = 3             # notifications older than this have been read
+OUTBOX_KEEP_DAYS = 30
+REJECTION_RATE = 0.02
+STOCK_DAYS = 3                  # production tops finished goods up to this many days of demand
+RAW_TANK_DAYS = 2               # raw milk above this many days of deliveries goes to a processor
+
+# (name, category, srp, unit, raw litres per unit, shelf life in days, share of demand)
+EXTRA_PRODUCTS = [
+    ("Chocolate Milk 1L", "Finished Goods", 65, "Bottle", 1.0, 7, 0.12),
+    ("Kesong Puti 250g", "Finished Goods", 95, "Pack", 1.2, 10, 0.08),
+    ("Pastillas 10pc", "Finished Goods", 60, "Pack", 0.4, 60, 0.10),
+    ("Butter 200g", "Finished Goods", 140, "Pack", 4.0, 90, 0.04),
+    ("Cream 250ml", "Finished Goods", 85, "Bottle", 0.8, 14, 0.06),
+]
+SEEDED_PRODUCTS = {   # raw litres per unit, shelf life, share of demand
+    "Fresh Milk 1L": (1.0, 7, 0.35), "Yogurt 500g": (0.6, 21, 0.15), "Cheese 200g": (2.0, 60, 0.10),
+}
+
+TOWNS = ["Calapan", "Naujan", "Victoria", "Socorro", "Pola", "Pinamalayan", "Gloria", "Bansud",
+         "Bongabong", "Roxas", "Mansalay", "Bulalacao", "Baco", "San Teodoro", "Puerto Galera"]
+SURNAMES = ["Santos", "Reyes", "Cruz", "Bautista", "Garcia", "Mendoza", "Torres", "Flores", "Villanueva",
+            "Ramos", "Aquino", "Castillo", "Rivera", "Navarro", "Dizon", "Manalo", "Pascual", "Salazar"]
+CUSTOMER_TYPES = ["Reseller", "Distributor", "Institutional Buyer"]
+PAYMENT_TYPES = ["Cash", "GCash", "Bank Transfer", "Credit (Utang)", "Partial Payment"]
+PAYMENT_WEIGHTS = [0.5, 0.25, 0.1, 0.1, 0.05]
+ANNOUNCEMENT_TARGETS = ["All", "Dairy Farmer", "Reseller", "Distributor", "Institutional Buyer", "Internal Staff"]
+REJECTION_REASONS = ["Failed alcohol test", "High acidity", "Low SNF", "Temperature too high"]
+MESSAGES = ["Kailan po ang bayad ngayong linggo?", "Pwede po bang dagdagan ang order namin?",
+            "Late po ang pickup kanina.", "Salamat po sa bonus!", "May tanong po ako tungkol sa presyo."]
+REPLIES = ["Salamat po, we will call you.", "Noted po, aayusin namin.", "Payment goes out on Friday po."]
+
+FLUSH_ROWS = 100_000
+
+
+class Tables:
+    """Rows waiting to be written, flushed in foreign-key order."""
+
+    ORDER = [
+        ("production_batches", "id, product_id, units, raw_litres, waste_litres, yield_percent, expiry_date, batch_date, operator"),
+        ("inventory_lots", "id, product_id, batch_id, expiry_date, received_date, quantity_received, quantity_remaining"),
+        ("sales", "id, customer_type, customer_id, total_amount, payment_type, sale_date, recorded_by"),
+        ("sale_items", "sale_id, product_id, quantity, unit_price"),
+        ("lot_allocations", "lot_id, sale_id, quantity, allocated_date"),
+        ("milk_collections", "farmer_id, class_a_litres, class_b_litres, total_payment, collection_date, notes, recorded_by, "
+                             "fat_percentage, snf_percentage, quality_score"),
+        ("inventory_transactions", "product_id, transaction_type, quantity, reason, transaction_date, recorded_by, batch_id"),
+        ("stock_checkpoints", "product_id, checkpoint_date, quantity"),
+        ("messages", "id, sender_type, sender_id, sender_name, message, timestamp, thread_id"),
+        ("notifications", "id, user_type, user_id, message, is_read, created_date"),
+        ("notification_outbox", "recipient_type, recipient_id, channel, message, created_date, status, attempts, next_attempt_at, sent_date"),
+    ]
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.rows = {name: [] for name, _ in self.ORDER}
+        self.pending = 0
+        self.written = dict.fromkeys(self.rows, 0)
+
+    def add(self, table, row):
+        self.rows[table].append(row)
+        self.pending += 1
+
+    def flush(self, force=False):
+        if self.pending < FLUSH_ROWS and not force:
+            return
+        with self.pool.writer() as conn:
+            for name, columns in self.ORDER:
+                rows = self.rows[name]
+                if rows:
+                    marks = ", ".join("?" * len(rows[0]))
+                    conn.executemany(f"INSERT INTO {name} ({columns}) VALUES ({marks})", rows)
+                    self.written[name] += len(rows)
+                    rows.clear()
+        self.pending = 0
+
+
+def _stamp(day, rng):
+    return f"{day.isoformat()} {int(rng.integers(6, 19)):02d}:{int(rng.integers(0, 60)):02d}:{int(rng.integers(0, 60)):02d}"
+
+
+def _next_id(conn, table):
+    return conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+
+
+def add_people(pool, scale, rng):
+    """Farmers, customers and staff; returns their attributes for the daily simulation."""
+    n_farmers, n_customers = FARMERS * scale, CUSTOMERS * scale
+    with pool.writer() as conn:
+        conn.executemany("INSERT OR IGNORE INTO internal_users (username, password, role) VALUES (?, ?, ?)",
+                         [(name, f"{name}123", role) for name, role in STAFF])
+        existing = conn.execute("SELECT COUNT(*) FROM dairy_farmers").fetchone()[0]
+        conn.executemany("INSERT INTO dairy_farmers (name, contact, address, username, password) VALUES (?, ?, ?, ?, ?)", [
+            (f"{SURNAMES[i % len(SURNAMES)]} Farm {i:05d}", f"09{int(rng.integers(10, 99))}-{int(rng.integers(1_000_000, 9_999_999))}",
+             TOWNS[int(rng.integers(len(TOWNS)))], f"farmer{i}", f"farmer{i}pw")
+            for i in range(existing + 1, n_farmers + 1)
+        ])
+        existing = conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+        conn.executemany("""
+            INSERT INTO customers (name, type, contact, username, password, discount_type, discount_value)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (f"{SURNAMES[i % len(SURNAMES)]} Store {i:05d}", CUSTOMER_TYPES[int(rng.choice(3, p=[0.7, 0.2, 0.1]))],
+             f"09{int(rng.integers(10, 99))}-{int(rng.integers(1_000_000, 9_999_999))}", f"buyer{i}", f"buyer{i}pw",
+             "Percentage", float(rng.choice([0, 5, 10, 15])))
+            for i in range(existing + 1, n_customers + 1)
+        ])
+        checkpoint = conn.execute("SELECT MIN(checkpoint_date) FROM stock_checkpoints").fetchone()[0] or "2000-01-01"
+        for name, category, srp, unit, *_ in EXTRA_PRODUCTS:
+            product_id = conn.execute("INSERT INTO products (name, category, srp, unit, current_stock) VALUES (?, ?, ?, ?, 0)",
+                                      (name, category, srp, unit)).lastrowid
+            conn.execute("INSERT INTO stock_checkpoints (product_id, checkpoint_date, quantity) VALUES (?, ?, 0)",
+                         (product_id, checkpoint))
+
+        farmers = conn.execute("SELECT id, name FROM dairy_farmers ORDER BY id").fetchall()
+        customers = conn.execute("SELECT id, name, type, discount_type, discount_value FROM customers ORDER BY id").fetchall()
+        staff = [row["username"] for row in conn.execute("SELECT username FROM internal_users ORDER BY id")]
+        staff_ids = [row["id"] for row in conn.execute("SELECT id FROM internal_users ORDER BY id")]
+        products = conn.execute("SELECT id, name, category, srp, current_stock FROM products ORDER BY id").fetchall()
+        lots = conn.execute("SELECT id, product_id, quantity_remaining FROM inventory_lots ORDER BY id").fetchall()
+    return farmers, customers, staff, staff_ids, products, lots
+
+
+def plan_conversations(pool, farmers, customers, staff_ids, start, end, rng):
+    """Create the message threads and return their messages by day offset.
+
+    Message ids follow the timestamps, as they would have in the app.
+    """
+    span = (end - start).days + 1
+    planned = []
+    parties = [("Farmer", row["id"], row["name"]) for row in farmers] + [("Customer", row["id"], row["name"]) for row in customers]
+    for party_type, party_id, name in parties:
+        if rng.random() >= THREAD_SHARE:
+            continue
+        stamps = sorted(_stamp(start + timedelta(days=int(d)), rng) for d in rng.integers(0, span, 1 + int(rng.poisson(5))))
+        for i, stamp in enumerate(stamps):
+            if i == 0 or rng.random() < 0.55:
+                planned.append((stamp, party_type, party_id, name, party_type, party_id, name, MESSAGES[int(rng.integers(len(MESSAGES)))]))
+            else:
+                planned.append((stamp, party_type, party_id, name, "Internal", int(rng.choice(staff_ids)), "admin",
+                                REPLIES[int(rng.integers(len(REPLIES)))]))
+    planned.sort(key=lambda m: m[0])
+
+    with pool.writer() as conn:
+        thread_id, message_id = _next_id(conn, "message_threads"), _next_id(conn, "messages")
+        threads, by_day = {}, {}
+        for stamp, party_type, party_id, name, sender_type, sender_id, sender_name, body in planned:
+            thread = threads.get((party_type, party_id))
+            if thread is None:
+                thread = threads[(party_type, party_id)] = [thread_id, party_type, party_id, name, None, None, None, 0, 0]
+                thread_id += 1
+            from_party = sender_type == party_type
+            thread[4:9] = [stamp, message_id, body[:120], thread[7] + 1, thread[8] + 1 if from_party else 0]
+            by_day.setdefault((date.fromisoformat(stamp[:10]) - start).days, []).append(
+                (message_id, sender_type, sender_id, sender_name, body, stamp, thread[0]))
+            message_id += 1
+        conn.executemany("""
+            INSERT INTO message_threads (id, party_type, party_id, party_name, last_message_at, last_message_id,
+                                         last_preview, message_count, unread_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [tuple(thread) for thread in threads.values()])
+    return by_day
+
+
+def simulate(pool, scale, days, end, rng):
+    farmers, customers, staff, staff_ids, products, opening_lots = add_people(pool, scale, rng)
+    tables = Tables(pool)
+    start = end - timedelta(days=days - 1)
+    conversations = plan_conversations(pool, farmers, customers, staff_ids, start, end, rng)
+    read_before = (end - timedelta(days=READ_AFTER_DAYS)).isoformat()
+    outbox_from = (end - timedelta(days=OUTBOX_KEEP_DAYS)).isoformat()
+
+    # Farmers: herd size (mean litres a delivery), how often they deliver, milk quality
+    farmer_ids = np.array([row["id"] for row in farmers])
+    farmer_names = [row["name"] for row in farmers]
+    herd = np.clip(rng.lognormal(np.log(35), 0.6, len(farmers)), 5, 400)
+    reliability = rng.beta(8, 2, len(farmers))
+    fat_mean = rng.normal(3.9, 0.25, len(farmers))
+
+    # Products: recipe, shelf life and share of demand for everything that is sold
+    recipe = {**SEEDED_PRODUCTS, **{name: (litres, shelf, share) for name, _, _, _, litres, shelf, share in EXTRA_PRODUCTS}}
+    raw_id = next(row["id"] for row in products if row["category"] == "Raw Milk")
+    sold = [row for row in products if row["name"] in recipe]
+    sold_ids = [row["id"] for row in sold]
+    srp = {row["id"]: row["srp"] for row in sold}
+    shares = np.array([recipe[row["name"]][2] for row in sold])
+    shares = shares / shares.sum()
+    stock = {row["id"]: row["current_stock"] or 0.0 for row in products}
+    # Lots as [lot id, remaining]: dated lots in expiry order, then the undated opening lots
+    # (production expiry grows with the batch date, so FEFO is first in, first out)
+    lots = {pid: deque() for pid in sold_ids}
+    undated = {pid: deque() for pid in sold_ids}
+    lot_remaining = {}
+    for row in opening_lots:
+        if row["product_id"] in undated:
+            undated[row["product_id"]].append([row["id"], row["quantity_remaining"]])
+        lot_remaining[row["id"]] = row["quantity_remaining"]
+
+    with pool.reader() as conn:
+        sale_id, lot_id, batch_id, notification_id = (_next_id(conn, t) for t in ("sales", "inventory_lots", "production_batches", "notifications"))
+    registered = [(row["id"], row["name"], row["type"], row["discount_type"], row["discount_value"]) for row in customers]
+    buyer_weights = np.array([{"Reseller": 1.0, "Distributor": 3.0, "Institutional Buyer": 2.0}[c[2]] for c in registered])
+    buyer_weights /= buyer_weights.sum()
+    points = {c[0]: 0 for c in registered}
+    balance = {c[0]: 0.0 for c in registered}
+    monthly_litres = {}
+
+    def notify(user_type, user_id, message, stamp, sms=False):
+        nonlocal notification_id
+        tables.add("notifications", (notification_id, user_type, user_id, message, int(stamp[:10] < read_before), stamp))
+        notification_id += 1
+        if stamp[:10] >= outbox_from:
+            for channel in (("in_app", "sms") if sms else ("in_app",)):
+                tables.add("notification_outbox", (user_type, user_id, channel, message, stamp, "Sent", 1, stamp, stamp))
+
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        day_str = day.isoformat()
+
+        # Morning deliveries: accepted milk goes into the raw milk tank
+        delivering = np.nonzero(rng.random(len(farmers)) < reliability)[0]
+        litres = np.round(herd[delivering] * rng.uniform(0.8, 1.2, len(delivering)), 1)
+        fat = np.round(fat_mean[delivering] + rng.normal(0, 0.15, len(delivering)), 2)
+        snf = np.round(rng.normal(8.6, 0.2, len(delivering)), 2)
+        quality = np.clip(np.round(70 + (fat - 3.5) * 20 + rng.normal(0, 4, len(delivering))), 50, 100)
+        rejected = rng.random(len(delivering)) < REJECTION_RATE
+        for i, l, f, s, q, bad in zip(delivering.tolist(), litres.tolist(), fat.tolist(), snf.tolist(), quality.tolist(), rejected.tolist()):
+            farmer_id, recorder, stamp = int(farmer_ids[i]), staff[int(rng.integers(len(staff)))], _stamp(day, rng)
+            if bad:
+                reason = REJECTION_REASONS[int(rng.integers(len(REJECTION_REASONS)))]
+                tables.add("milk_collections", (farmer_id, 0.0, 0.0, 0.0, day_str, f"REJECTED: {reason}", recorder, f, s, q))
+                notify("Farmer", farmer_id, f"Your delivery today was rejected: {reason}", stamp, sms=True)
+                continue
+            payment = round(l * (83 + max(0.0, f - 3.5) * 5), 2)
+            tables.add("milk_collections", (farmer_id, l, 0.0, payment, day_str, "Route sheet", recorder, f, s, q))
+            tables.add("inventory_transactions", (raw_id, "IN", l, f"Collection from {farmer_names[i]} | {l:.1f}L | Bonus ₱0",
+                                                  day_str, recorder, None))
+            notify("Farmer", farmer_id, f"New collection: {l:.1f}L → ₱{payment:,.2f}", stamp, sms=True)
+            stock[raw_id] += l
+            key = (farmer_id, day_str[:7])
+            monthly_litres[key] = monthly_litres.get(key, 0.0) + l
+
+        # Today's orders, then production tops each product up before the shop opens
+        n_walk_in = int(rng.poisson(WALK_IN_SALES_PER_DAY * scale))
+        n_registered = int(rng.poisson(REGISTERED_SALES_PER_DAY * scale))
+        orders = []
+        for k in range(n_walk_in + n_registered):
+            lines = min(len(sold_ids), 1 + int(rng.poisson(1.2)))
+            picked = rng.choice(len(sold_ids), size=lines, replace=False, p=shares)
+            buyer = registered[int(rng.choice(len(registered), p=buyer_weights))] if k >= n_walk_in else None
+            bulk = 1 if buyer is None else {"Reseller": 4, "Distributor": 12, "Institutional Buyer": 8}[buyer[2]]
+            orders.append((buyer, [(sold_ids[j], float(1 + rng.poisson(bulk))) for j in picked.tolist()]))
+        demand = {pid: 0.0 for pid in sold_ids}
+        for _, lines in orders:
+            for pid, qty in lines:
+                demand[pid] += qty
+
+        operator = staff[int(rng.integers(len(staff)))]
+        for row in sold:
+            pid, (per_unit, shelf, _) = row["id"], recipe[row["name"]]
+            units = float(max(0, round(demand[pid] * STOCK_DAYS - stock[pid])))
+            units = min(units, float(int(stock[raw_id] * 0.98 / per_unit)))
+            if units <= 0:
+                continue
+            raw = round(units * per_unit / 0.98, 2)
+            expiry = (day + timedelta(days=shelf)).isoformat()
+            tables.add("production_batches", (batch_id, pid, units, raw, round(raw - units * per_unit, 2), 98.0, expiry, day_str, operator))
+            reason = f"Production batch #{batch_id}"
+            tables.add("inventory_transactions", (raw_id, "OUT", raw, reason, day_str, operator, batch_id))
+            tables.add("inventory_transactions", (pid, "IN", units, reason, day_str, operator, batch_id))
+            tables.add("inventory_lots", (lot_id, pid, batch_id, expiry, day_str, units, units))
+            lots[pid].append([lot_id, units])
+            lot_remaining[lot_id] = units
+            stock[raw_id] -= raw
+            stock[pid] += units
+            batch_id += 1
+            lot_id += 1
+
+        # Surplus raw milk leaves in bulk at the end of the morning
+        surplus = round(stock[raw_id] - RAW_TANK_DAYS * float(litres[~rejected].sum()), 1)
+        if surplus > 0:
+            tables.add("inventory_transactions", (raw_id, "OUT", surplus, "Bulk raw milk to processor", day_str, operator, None))
+            stock[raw_id] -= surplus
+
+        # Sales: each line is filled from the oldest lots, short lines are sold short
+        for buyer, lines in orders:
+            filled = []
+            for pid, qty in lines:
+                qty = min(qty, stock[pid])
+                if qty <= 0:
+                    continue
+                if buyer is None:
+                    price = srp[pid]
+                elif buyer[3] == "Fixed":
+                    price = max(0.0, srp[pid] - buyer[4])
+                else:
+                    price = round(srp[pid] * (1 - buyer[4] / 100), 2)
+                filled.append((pid, qty, price))
+            if not filled:
+                continue
+            total = round(sum(qty * price for _, qty, price in filled), 2)
+            payment_type = PAYMENT_TYPES[int(rng.choice(len(PAYMENT_TYPES), p=PAYMENT_WEIGHTS))] if buyer else "Cash"
+            recorder = staff[int(rng.integers(len(staff)))]
+            tables.add("sales", (sale_id, "Registered Buyer" if buyer else "Walk-In (Cash)", buyer[0] if buyer else None,
+                                 total, payment_type, day_str, recorder))
+            for pid, qty, price in filled:
+                tables.add("sale_items", (sale_id, pid, qty, price))
+                tables.add("inventory_transactions", (pid, "OUT", qty, f"Sale #{sale_id} to {buyer[1] if buyer else 'Walk-in'}",
+                                                      day_str, recorder, None))
+                stock[pid] -= qty
+                left = qty
+                while left > 1e-9 and (lots[pid] or undated[pid]):
+                    queue = lots[pid] or undated[pid]
+                    lot = queue[0]
+                    take = min(left, lot[1])
+                    tables.add("lot_allocations", (lot[0], sale_id, take, day_str))
+                    lot[1] -= take
+                    lot_remaining[lot[0]] = lot[1]
+                    left -= take
+                    if lot[1] <= 1e-9:
+                        queue.popleft()
+            if buyer:
+                points[buyer[0]] += checkout.points_earned(total)
+                if payment_type == "Credit (Utang)" and (end - day).days < 30:
+                    balance[buyer[0]] += total
+                notify("Customer", buyer[0], f"Purchase #{sale_id}: ₱{total:,.2f}", _stamp(day, rng))
+            sale_id += 1
+
+        # Messages from farmers and customers (staff hear about each one) and staff replies
+        for message in conversations.get(offset, ()):
+            tables.add("messages", message)
+            if message[1] != "Internal":
+                notify("Internal", None, f"New message from {message[1].lower()}: {message[3]}", message[5])
+
+        if day < end:
+            for pid in [raw_id] + sold_ids:
+                tables.add("stock_checkpoints", (pid, day_str, round(stock[pid], 4)))
+        tables.flush()
+
+    tables.flush(force=True)
+    with pool.writer() as conn:
+        conn.executemany("UPDATE inventory_lots SET quantity_remaining = ? WHERE id = ?",
+                         [(round(max(q, 0.0), 4), lid) for lid, q in lot_remaining.items()])
+        conn.executemany("UPDATE products SET current_stock = ? WHERE id = ?", [(round(q, 4), pid) for pid, q in stock.items()])
+        conn.executemany("UPDATE customers SET loyalty_points = loyalty_points + ?, current_balance = ? WHERE id = ?",
+                         [(points[cid], round(balance[cid], 2), cid) for cid in points])
+        # Tier from the farmer's best month
+        best = {}
+        for (farmer_id, _), l in monthly_litres.items():
+            best[farmer_id] = max(best.get(farmer_id, 0.0), l)
+        tiers = []
+        for farmer_id, l in best.items():
+            tier = "Bronze"
+            while tier in pricing.TIER_UPGRADES and l >= pricing.TIER_UPGRADES[tier][1]:
+                tier = pricing.TIER_UPGRADES[tier][0]
+            tiers.append((tier, farmer_id))
+        conn.executemany("UPDATE dairy_farmers SET loyalty_tier = ? WHERE id = ?", tiers)
+    add_announcements(pool, start, end, rng)
+    deliver_notifications(pool)
+    return tables.written
+
+
+def add_announcements(pool, start, end, rng):
+    weeks = ((end - start).days + 1) // 7
+    rows = []
+    for week in range(weeks):
+        for _ in range(ANNOUNCEMENTS_PER_WEEK):
+            day = start + timedelta(days=week * 7 + int(rng.integers(7)))
+            target = ANNOUNCEMENT_TARGETS[int(rng.choice(len(ANNOUNCEMENT_TARGETS), p=[0.4, 0.25, 0.1, 0.1, 0.05, 0.1]))]
+            rows.append((f"Notice for week {week + 1}", "Schedule and price updates for the coming week.", target, day.isoformat()))
+    with pool.writer() as conn:
+        conn.executemany("INSERT INTO announcements (title, content, target_type, created_date) VALUES (?, ?, ?, ?)", rows)
+
+
+def deliver_notifications(pool):
+    # Per-recipient deliveries and inbox counters, the way notifications.notify_many keeps them
+    with pool.writer() as conn:
+        conn.execute("""
+            INSERT INTO notification_deliveries (recipient_type, recipient_id, notification_id)
+            SELECT user_type, user_id, id FROM notifications
+            WHERE user_type IN ('Farmer', 'Customer') AND user_id IS NOT NULL
+            UNION ALL
+            SELECT 'Internal', u.id, n.id FROM notifications n CROSS JOIN internal_users u
+            WHERE n.user_type = 'Internal'
+        """)
+        conn.execute("""
+            INSERT INTO notification_inboxes (recipient_type, recipient_id, read_through, unread_count)
+            SELECT d.recipient_type, d.recipient_id, COALESCE(MAX(CASE WHEN n.is_read = 1 THEN n.id END), 0),
+                   SUM(n.is_read = 0)
+            FROM notification_deliveries d
+            JOIN notifications n ON n.id = d.notification_id
+            GROUP BY d.recipient_type, d.recipient_id
+        """)
+
+
+def generate(path, scale=1, days=DAYS, seed=42, end=None):
+    """Create path (which must not exist) and fill it; returns {table: rows written in bulk}."""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    pool = ConnectionPool(path)
+    try:
+        migrate(pool)
+        written = simulate(pool, scale, days, end or date.today(), np.random.default_rng(seed))
+        with pool.writer() as conn:
+            conn.execute("ANALYZE")
+    finally:
+        pool.close()
+    return written
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--days", type=int, default=DAYS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end", type=date.fromisoformat, default=None, help="last day of data (default: today)")
+    args = parser.parse_args(argv[1:])
+
+    started = time.perf_counter()
+    written = generate(args.path, args.scale, args.days, args.seed, args.end)
+    print(f"{args.path}: scale {args.scale}, {args.days} days in {time.perf_counter() - started:.1f}s, "
+          f"{os.path.getsize(args.path) / 1e6:.1f} MB")
+    for table, rows in written.items():
+        print(f"  {table:24} {rows:>12,}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,351 @@
+"""Render every page as each role with Streamlit's AppTest and fail on pages over their time budget.
+
+Usage:
+    python benchmarks/page_render.py [--scale 10] [--repeat 3] [--data-dir DIR] [--budgets budgets.json]
+                                     [--budget-factor 1.0] [--no-memory] [--profile] [--out results.json]
+
+The app runs headless against a copy of a generated database (made once by
+generate_data.py and reused from --data-dir, like query_scale.py). Each role logs in
+through its login form, opens every page on its menu and drives the usual
+interactions: picking a buyer and adding cart lines, choosing a farmer and changing the
+fat %, drilling into a farmer. Every step is one rerun (or a login and its rerun),
+timed from the widget change to the finished page, so it includes widget building,
+Styler formatting and chart serialization as well as the queries.
+
+The whole walk runs --repeat times in one process. The first pass meets empty query
+caches, later ones mostly warm caches; a step is checked against its budget by its
+slowest pass. A final pass under tracemalloc records each step's peak Python memory.
+Exits with status 1 when a step raises, goes over its time budget or over
+MEMORY_BUDGET_MB.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_data
+from query_scale import database_for, git_commit
+
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.element_tree import Dataframe, Widget
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(REPO, "app.py")
+RUN_TIMEOUT = 120
+
+# (role, login form, username, password); staff accounts come from generate_data.STAFF
+ROLES = [
+    ("Admin", "internal", "admin", "admin123"),
+    ("Sales Clerk", "internal", "clerk1", "clerk1123"),
+    ("Field Staff", "internal", "field1", "field1123"),
+    ("Farmer", "farmer", "jose", "jose123"),
+    ("Customer", "customer", "juansstore", "store123"),
+]
+LOGIN_FIELDS = {
+    "internal": ("int_user", "int_pass", "Login as Staff"),
+    "farmer": ("farm_user", "farm_pass", "Login as Farmer"),
+    "customer": ("cust_user", "cust_pass", "Login as Buyer"),
+}
+
+# ========================
+# BUDGETS
+# ========================
+# Milliseconds per step on a 10x database, keyed "<role> / <step>" or just "<step>" for
+# every role. Steps not listed get DEFAULT_BUDGET_MS. --budgets overrides entries from a
+# JSON file and --budget-factor scales all of them (for slower machines or larger scales).
+DEFAULT_BUDGET_MS = 1000
+BUDGETS_MS = {
+    "Open app": 5000,                  # the first one in the process imports everything and opens the pool
+    "Log in": 1500,                    # the login run plus the rerun into the first page
+    "Pricing": 2000,                   # the planner reprices the last 12 months of deliveries
+}
+MEMORY_BUDGET_MB = 128
+
+
+# ========================
+# DATA EDITOR DRIVER
+# ========================
+# AppTest has no data_editor element: the grid shows up as a plain Dataframe. This
+# widget stands in for it and sends an edit the way the browser does, as a JSON
+# string of edited rows.
+class DataEditor(Widget):
+    def __init__(self, proto, root):
+        super().__init__(proto, root)
+        self.type = "data_editor"
+        self.disabled = False
+
+    @property
+    def id(self):
+        return self.proto.id
+
+    @property
+    def value(self):
+        return self._value
+
+    def edit(self, rows):
+        """rows: {row position: {column: new value}}"""
+        return self.set_value({"edited_rows": {str(i): cells for i, cells in rows.items()},
+                               "added_rows": [], "deleted_rows": []})
+
+    @property
+    def _widget_state(self):
+        ws = WidgetState()
+        ws.id = self.id
+        ws.string_value = json.dumps(self._value or {"edited_rows": {}, "added_rows": [], "deleted_rows": []})
+        return ws
+
+
+def data_editor(at, key):
+    """The data_editor with this key, swapped into the tree as an editable widget.
+
+    Asking again before the next run returns the same widget, with its pending edit.
+    """
+    def swap(block):
+        for i, node in list(getattr(block, "children", {}).items()):
+            if isinstance(node, (Dataframe, DataEditor)) and node.proto.id and node.proto.id.endswith(f"-{key}"):
+                if isinstance(node, Dataframe):
+                    block.children[i] = DataEditor(node.proto, node.root)
+                return block.children[i]
+            found = swap(node)
+            if found is not None:
+                return found
+        return None
+    editor = swap(at._tree)
+    if editor is None:
+        raise LookupError(f"no data_editor with key {key!r} on the page")
+    return editor
+
+
+# ========================
+# WALKTHROUGH
+# ========================
+def log_in(at, form, username, password):
+    user_key, pass_key, label = LOGIN_FIELDS[form]
+    at.text_input(key=user_key).input(username)
+    at.text_input(key=pass_key).input(password)
+    next(b for b in at.button if b.label == label).click()
+
+
+def interactions(page, at):
+    """(step name, action) pairs for a page; each action changes widgets for the next run."""
+    if page == "Sales":
+        def registered_buyer():
+            return next(r for r in at.radio if r.label == "Customer Type").set_value("Registered Buyer")
+
+        def pick_buyer():
+            buyers = at.selectbox(key="reg_buyer_select")
+            return buyers.set_value(buyers.options[min(1, len(buyers.options) - 1)])
+
+        def add_cart_lines():
+            return data_editor(at, "cart_0").edit({0: {"qty": 2}, 1: {"qty": 1}, 2: {"qty": 3}})
+
+        def change_quantity():
+            return data_editor(at, "cart_0").edit({0: {"qty": 5}, 1: {"qty": 1}, 2: {"qty": 3}})
+
+        return [("Sales: registered buyer", registered_buyer), ("Sales: pick buyer", pick_buyer),
+                ("Sales: add cart lines", add_cart_lines), ("Sales: change quantity", change_quantity)]
+    if page == "Milk Collection":
+        def select_farmer():
+            farmers = at.selectbox(key="milk_farmer_select")
+            return farmers.set_value(farmers.options[len(farmers.options) // 2])
+
+        return [("Milk Collection: select farmer", select_farmer),
+                ("Milk Collection: fat %", lambda: at.number_input(key="fat_input").set_value(4.2)),
+                ("Milk Collection: reject fat %", lambda: at.number_input(key="fat_input").set_value(2.0))]
+    if page == "Manage Farmers":
+        def deep_dive():
+            farmers = at.selectbox(key="deep_dive_select")
+            return farmers.set_value(farmers.options[len(farmers.options) // 2])
+
+        return [("Manage Farmers: farmer deep dive", deep_dive)]
+    return []
+
+
+def walk(role, form, username, password, step):
+    """Log in as role and visit its pages; step(at, name, action) measures the rerun after one action."""
+    at = AppTest.from_file(APP, default_timeout=RUN_TIMEOUT)
+    step(at, "Open app", lambda: None)
+    step(at, "Log in", lambda: log_in(at, form, username, password))
+    if form != "internal":
+        step(at, "Portal rerun", lambda: None)      # portals are one page; a plain rerun of it
+        return
+    for page in at.sidebar.radio[0].options:
+        step(at, page, lambda page=page: at.sidebar.radio[0].set_value(page))
+        for name, action in interactions(page, at):
+            step(at, name, action)
+
+
+def slowest_sections(at, limit=3):
+    # Top-level sections of the last profiled rerun (DAIRY_PROFILE must be set before the first run)
+    runs = at.session_state["profile_runs"] if "profile_runs" in at.session_state else None
+    if not runs:
+        return []
+    sections = sorted(runs[-1].children, key=lambda span: span.seconds, reverse=True)[:limit]
+    return [{"section": span.name, "ms": round(span.seconds * 1000, 1)} for span in sections]
+
+
+def run_pass(role, form, username, password, memory=False):
+    """One walk as role; {step: measurement}."""
+    results = {}
+
+    def step(at, name, action):
+        action()
+        if memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        at.run()
+        elapsed = (time.perf_counter() - started) * 1000
+        result = {"ms": elapsed}
+        if memory:
+            result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        errors = [str(e.value) for e in at.exception]
+        if errors:
+            result["errors"] = errors
+        sections = slowest_sections(at)
+        if sections:
+            result["sections"] = sections
+        results[name] = result
+
+    walk(role, form, username, password, step)
+    return results
+
+
+# ========================
+# RUNNER
+# ========================
+def working_copy(source, work_dir):
+    # The backup API also copies what is still in the source's WAL file
+    target = os.path.join(work_dir, "dairy_ecosystem.db")
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+    if os.path.isdir(os.path.join(REPO, "announcements")):
+        shutil.copytree(os.path.join(REPO, "announcements"), os.path.join(work_dir, "announcements"))
+    return target
+
+
+def budgets_for(overrides, factor):
+    budgets = dict(BUDGETS_MS, **overrides)
+
+    def budget(key):
+        step = key.split(" / ", 1)[1]
+        return budgets.get(key, budgets.get(step, DEFAULT_BUDGET_MS)) * factor
+    return budget
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--days", type=int, default=generate_data.DAYS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end", type=date.fromisoformat, default=None, help="last day of data (default: today)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed walks per role")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "dairy_bench"))
+    parser.add_argument("--roles", nargs="+", default=[role for role, *_ in ROLES])
+    parser.add_argument("--budgets", help="JSON file of {\"<role> / <step>\" or \"<step>\": ms} overrides")
+    parser.add_argument("--budget-factor", type=float, default=1.0, help="multiply every time budget by this")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--profile", action="store_true", help="run the app with DAIRY_PROFILE and report its slowest sections")
+    parser.add_argument("--out", default="page_render_results.json")
+    args = parser.parse_args(argv[1:])
+
+    end = args.end or date.today()
+    os.makedirs(args.data_dir, exist_ok=True)
+    source = database_for(args.data_dir, args.scale, args.days, args.seed, end)
+    overrides = {}
+    if args.budgets:
+        with open(args.budgets) as f:
+            overrides = json.load(f)
+    budget = budgets_for(overrides, args.budget_factor)
+    out = os.path.abspath(args.out)
+
+    # The app reads DAIRY_DB_PATH and DAIRY_PROFILE when it is first run, and writes its
+    # logs and exports next to itself: run it from a scratch directory
+    work_dir = tempfile.mkdtemp(prefix="dairy_render_")
+    os.environ["DAIRY_DB_PATH"] = working_copy(source, work_dir)
+    if args.profile:
+        os.environ["DAIRY_PROFILE"] = "1"
+    os.chdir(work_dir)
+
+    roles = [r for r in ROLES if r[0] in args.roles]
+    timings = {}
+    for n in range(args.repeat):
+        for role, form, username, password in roles:
+            print(f"pass {n + 1}/{args.repeat}: {role} ...", flush=True)
+            for name, result in run_pass(role, form, username, password).items():
+                timings.setdefault(f"{role} / {name}", []).append(result)
+    if not args.no_memory:
+        tracemalloc.start()
+        for role, form, username, password in roles:
+            print(f"memory pass: {role} ...", flush=True)
+            for name, result in run_pass(role, form, username, password, memory=True).items():
+                timings[f"{role} / {name}"].append(result)
+        tracemalloc.stop()
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "scale": args.scale, "days": args.days, "seed": args.seed, "end": end.isoformat(),
+        "repeat": args.repeat, "budget_factor": args.budget_factor,
+        "steps": {},
+    }
+    failures = []
+    print(f"\n{'step':58}{'first ms':>10}{'median':>10}{'max':>10}{'budget':>10}{'peak MB':>10}")
+    for key, results in timings.items():
+        timed = [r["ms"] for r in results if "peak_mb" not in r]
+        peak = max((r["peak_mb"] for r in results if "peak_mb" in r), default=None)
+        errors = sorted({e for r in results for e in r.get("errors", [])})
+        step = {
+            "first_ms": round(timed[0], 1), "median_ms": round(float(np.median(timed)), 1),
+            "max_ms": round(max(timed), 1), "budget_ms": round(budget(key), 1),
+        }
+        if peak is not None:
+            step["peak_mb"] = round(peak, 1)
+        if errors:
+            step["errors"] = errors
+        sections = next((r["sections"] for r in results if "sections" in r), None)
+        if sections:
+            step["sections"] = sections
+        report["steps"][key] = step
+
+        print(f"{key:58}{step['first_ms']:>10.0f}{step['median_ms']:>10.0f}{step['max_ms']:>10.0f}{step['budget_ms']:>10.0f}"
+              + (f"{peak:>10.1f}" if peak is not None else ""))
+        if errors:
+            failures.append(f"ERROR {key}: {errors[0]}")
+        if step["max_ms"] > step["budget_ms"]:
+            failures.append(f"OVER BUDGET {key}: {step['max_ms']:.0f} ms > {step['budget_ms']:.0f} ms")
+        if peak is not None and peak > MEMORY_BUDGET_MB:
+            failures.append(f"OVER MEMORY {key}: {peak:.0f} MB > {MEMORY_BUDGET_MB} MB")
+
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {out}")
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        return 1
+    print("every page rendered within its budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
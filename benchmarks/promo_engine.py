@@ -0,0 +1,110 @@
+"""Time the promotion engine on large carts with many active rules.
+
+Usage:
+    python benchmarks/promo_engine.py [--products N] [--repeat N]
+
+Each scenario compiles a synthetic rule set and evaluates random carts with the
+vectorized engine and with a straightforward per-rule, per-line Python loop.
+Both must agree; the run exits 1 if any discount differs.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from promotions import PromoEngine, RULE_TYPES
+
+CATEGORIES = ["Raw Milk", "Finished Goods", "By-Product"]
+
+
+def make_catalog(n, rng):
+    return [(pid, rng.choice(CATEGORIES)) for pid in range(1, n + 1)]
+
+
+def make_rules(n, products, rng):
+    rules, targets = [], []
+    for rid in range(1, n + 1):
+        rule_type = RULE_TYPES[rid % len(RULE_TYPES)]
+        rules.append({
+            "id": rid, "name": f"Promo {rid}", "rule_type": rule_type,
+            "category": rng.choice(CATEGORIES) if rid % 7 == 0 else None,
+            "buy_qty": float(rng.randint(2, 12)) if rule_type != "Bundle" else None,
+            "free_qty": 1.0 if rule_type == "Buy X Get Y" else None,
+            "min_lines": rng.randint(2, 4) if rule_type == "Bundle" else None,
+            "percent": float(rng.choice([5, 10, 15])) if rule_type != "Buy X Get Y" else None,
+        })
+        for pid, _ in rng.sample(products, min(len(products), rng.randint(1, 40))):
+            targets.append((rid, pid))
+    return rules, targets
+
+
+def make_cart(lines, products, rng):
+    chosen = rng.sample(products, lines)
+    pids = [pid for pid, _ in chosen]
+    qty = [float(rng.randint(1, 30)) for _ in chosen]
+    price = [float(rng.randint(20, 300)) for _ in chosen]
+    return pids, qty, price
+
+
+def reference_discounts(rules, targets, products, pids, qty, price):
+    # The obvious implementation: loop over every rule and every cart line
+    category_of = dict(products)
+    targeted = {}
+    for rid, pid in targets:
+        targeted.setdefault(rid, set()).add(pid)
+    out = []
+    for rule in rules:
+        lines = [i for i, pid in enumerate(pids)
+                 if qty[i] > 0 and (pid in targeted.get(rule["id"], ()) or
+                                    (rule["category"] and category_of.get(pid) == rule["category"]))]
+        if rule["rule_type"] == "Buy X Get Y":
+            d = 0.0
+            for i in lines:
+                if rule["buy_qty"]:
+                    d += min((qty[i] // rule["buy_qty"]) * rule["free_qty"], qty[i]) * price[i]
+        elif rule["rule_type"] == "Bundle":
+            d = sum(qty[i] * price[i] for i in lines) * rule["percent"] / 100 if len(lines) >= rule["min_lines"] else 0.0
+        else:
+            d = sum(qty[i] * price[i] for i in lines if qty[i] >= rule["buy_qty"]) * rule["percent"] / 100
+        out.append(d)
+    return np.array(out)
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args(argv[1:])
+
+    rng = random.Random(42)
+    products = make_catalog(args.products, rng)
+    failures = 0
+    print(f"{'rules':>6} {'lines':>6} {'compile ms':>11} {'engine ms':>10} {'loop ms':>9}")
+    for n_rules in (2, 12, 48):
+        rules, targets = make_rules(n_rules, products, rng)
+        compile_ms, engine = timed(lambda: PromoEngine(rules, targets, products), 5)
+        for lines in (10, 100, 500):
+            pids, qty, price = make_cart(lines, products, rng)
+            engine_ms, fast = timed(lambda: engine.evaluate(pids, qty, price), args.repeat)
+            loop_ms, slow = timed(lambda: reference_discounts(rules, targets, products, pids, qty, price), max(1, args.repeat // 10))
+            ok = np.allclose(fast, slow)
+            failures += not ok
+            print(f"{n_rules:>6} {lines:>6} {compile_ms:>11.2f} {engine_ms:>10.3f} {loop_ms:>9.3f}{'' if ok else '   MISMATCH'}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,143 @@
+"""Time every page query against generated databases at several scales and save the results as JSON.
+
+Usage:
+    python benchmarks/query_scale.py [--scales 1 10 100] [--repeat 7] [--data-dir DIR]
+                                     [--out results.json] [--baseline previous.json] [--tolerance 0.5]
+
+Each scale's database is made once by generate_data.py and reused from --data-dir
+(named by scale, days, seed and end date). Every query in queries.page_queries() runs
+--repeat times, uncached, on a pooled reader after one warm-up run; the JSON keeps the
+median, p95 and fastest time and the row count per query and scale. With --baseline, a
+query whose median grew by more than --tolerance (and by at least 1 ms) is reported
+and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_data
+import queries
+from db import ConnectionPool
+
+MIN_REGRESSION_MS = 1.0
+COUNTED_TABLES = ["dairy_farmers", "customers", "milk_collections", "sales", "sale_items",
+                  "inventory_transactions", "notifications", "notification_deliveries", "messages"]
+
+
+def database_for(data_dir, scale, days, seed, end):
+    path = os.path.join(data_dir, f"dairy_scale{scale}_days{days}_seed{seed}_{end.isoformat()}.db")
+    if not os.path.exists(path):
+        print(f"generating scale {scale} ({days} days) ...", flush=True)
+        started = time.perf_counter()
+        generate_data.generate(path, scale, days, seed, end)
+        print(f"  {time.perf_counter() - started:.1f}s, {os.path.getsize(path) / 1e6:.1f} MB", flush=True)
+    return path
+
+
+def time_queries(path, day, repeat):
+    pool = ConnectionPool(path)
+    results = {}
+    try:
+        with pool.reader() as conn:
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in COUNTED_TABLES}
+        for name, sql, params in queries.page_queries(day=day):
+            rows = len(pool.read_all(sql, params, cached=False))      # warm-up
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                pool.read_all(sql, params, cached=False)
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {
+                "median_ms": round(float(np.median(timings)), 3),
+                "p95_ms": round(float(np.percentile(timings, 95)), 3),
+                "min_ms": round(min(timings), 3),
+                "rows": rows,
+            }
+    finally:
+        pool.close()
+    return counts, results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(report, baseline, tolerance):
+    found = []
+    for scale, run in report["scales"].items():
+        before = baseline.get("scales", {}).get(scale, {}).get("queries", {})
+        for name, now in run["queries"].items():
+            old = before.get(name)
+            if old and now["median_ms"] > old["median_ms"] * (1 + tolerance) and now["median_ms"] - old["median_ms"] >= MIN_REGRESSION_MS:
+                found.append((scale, name, old["median_ms"], now["median_ms"]))
+    return found
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--days", type=int, default=generate_data.DAYS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end", type=date.fromisoformat, default=None, help="last day of data (default: today)")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "dairy_bench"))
+    parser.add_argument("--out", default="query_scale_results.json")
+    parser.add_argument("--baseline", help="an earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed growth of a query's median (0.5 = 50%%)")
+    args = parser.parse_args(argv[1:])
+
+    end = args.end or date.today()
+    os.makedirs(args.data_dir, exist_ok=True)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.platform(),
+        "days": args.days, "seed": args.seed, "end": end.isoformat(), "repeat": args.repeat,
+        "scales": {},
+    }
+    for scale in args.scales:
+        path = database_for(args.data_dir, scale, args.days, args.seed, end)
+        counts, results = time_queries(path, end, args.repeat)
+        report["scales"][str(scale)] = {"tables": counts, "queries": results}
+
+    scales = list(report["scales"])
+    names = list(report["scales"][scales[0]]["queries"])
+    print(f"\n{'median ms':40}" + "".join(f"{f'{s}x':>12}" for s in scales))
+    for name in names:
+        print(f"{name:40}" + "".join(f"{report['scales'][s]['queries'][name]['median_ms']:>12.2f}" for s in scales))
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for scale, name, old, new in found:
+            print(f"REGRESSION {scale}x {name}: {old:.2f} ms -> {new:.2f} ms")
+        if found:
+            return 1
+        print(f"no query slower than the baseline by more than {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
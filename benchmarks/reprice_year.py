@@ -0,0 +1,88 @@
+"""Time the what-if repricing of a year of milk collections.
+
+Usage:
+    python benchmarks/reprice_year.py [--farmers N] [--repeat N]
+
+Builds a synthetic year (every farmer delivering on most days), prices it with the
+seeded schedule through pricing.reprice, and checks the vectorized ladders against
+a per-delivery Python loop over the same schedule. Exits 1 on any mismatch.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pricing
+from db import ConnectionPool
+from migrations import migrate
+
+
+def make_year(farmers, rng):
+    days = [(date(2025, 1, 1) + timedelta(days=i)).isoformat() for i in range(365)]
+    farmer_ids = np.repeat(np.arange(1, farmers + 1), len(days))
+    dates = np.tile(days, farmers)
+    keep = rng.random(len(dates)) < 0.85
+    n = int(keep.sum())
+    return pd.DataFrame({
+        "farmer_id": farmer_ids[keep],
+        "collection_date": dates[keep],
+        "litres": rng.uniform(5, 250, n).round(1),
+        "fat": rng.uniform(3.0, 4.8, n).round(2),
+        "snf": rng.uniform(7.5, 9.6, n).round(2),
+        "loyalty_tier": rng.choice(pricing.TIERS, n),
+        "total_payment": 0.0,
+    })
+
+
+def reference_price(schedule, litres, fat, snf, tier, yesterday):
+    # One delivery at a time, walking each ladder
+    def ladder(component, value):
+        bonus = 0.0
+        for threshold, step_bonus in zip(*schedule.ladders[component]):
+            if value >= threshold:
+                bonus = step_bonus
+        return bonus
+    per_liter = (schedule.base_price + ladder("fat", fat) + ladder("snf", snf) + ladder("volume", litres)
+                 + schedule.loyalty[tier] + (schedule.consistency_bonus if yesterday else 0.0))
+    return round(litres * per_liter, 2)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--farmers", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv[1:])
+
+    pool = ConnectionPool(os.path.join(tempfile.mkdtemp(), "reprice_year.db"))
+    migrate(pool)
+    schedule = pricing.price_book_for(pool).schedule_on(date.today())
+    pool.close()
+
+    rng = np.random.default_rng(42)
+    year = make_year(args.farmers, rng)
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        repriced = pricing.reprice(year, schedule)
+    elapsed = (time.perf_counter() - started) / args.repeat
+    print(f"{len(year):,} deliveries from {args.farmers} farmers repriced in {elapsed * 1000:.0f} ms "
+          f"({len(year) / elapsed:,.0f} deliveries/s)")
+
+    sample = repriced.sample(min(len(repriced), 5000), random_state=1)
+    yesterday = pricing.delivered_previous_day(year["farmer_id"], year["collection_date"])[sample.index]
+    expected = [reference_price(schedule, *row, y) for row, y in
+                zip(sample[["litres", "fat", "snf", "loyalty_tier"]].itertuples(index=False), yesterday)]
+    ok = np.allclose(sample["proposed_payment"], expected)
+    print("reference loop agrees" if ok else "FAIL: vectorized prices differ from the reference loop")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,134 @@
+# ========================
+# POS CHECKOUT ENGINE
+# ========================
+# Commits one sale atomically: the sale row, its items, the stock movements and
+# the customer's balance/points either all land or none do.
+# Stock and points are checked by the UPDATE itself, so two clerks selling the
+# last bottles at the same time cannot drive stock negative.
+# Lot-tracked products are then picked from their lots first-expired-first-out.
+
+import sqlite3
+import time
+
+import inventory
+import metrics
+import outbox
+
+
+class CheckoutError(Exception):
+    """The sale was rejected and nothing was written."""
+
+
+class InsufficientStock(CheckoutError):
+    def __init__(self, shortages):
+        # shortages: [(product name, requested, available), ...]
+        self.shortages = shortages
+        details = ", ".join(f"{name} (wanted {wanted:g}, {available:g} left)" for name, wanted, available in shortages)
+        super().__init__(f"Not enough stock: {details}")
+
+
+class InsufficientPoints(CheckoutError):
+    def __init__(self, requested):
+        self.requested = requested
+        super().__init__(f"Customer no longer has {requested:,} loyalty points to redeem")
+
+
+def points_earned(grand_total):
+    # 1 point per ₱10 spent
+    return int(grand_total // 10)
+
+
+def _quantities_by_product(items):
+    # The same product may appear on more than one cart line
+    totals = {}
+    for item in items:
+        totals[item["pid"]] = totals.get(item["pid"], 0) + item["qty"]
+    return totals
+
+
+def checkout(pool, items, customer_type, customer_id, customer_name, grand_total,
+             payment_type, amount_paid, points_redeemed, recorded_by):
+    """Record a sale in a single BEGIN IMMEDIATE transaction and return its id.
+
+    items are cart lines with "pid", "qty" and "unit_price".
+    Raises InsufficientStock or InsufficientPoints (after rolling back) when the
+    database no longer has what the cart was built from.
+    """
+    started = time.perf_counter()
+    try:
+        sale_id = _record_sale(pool, items, customer_type, customer_id, customer_name, grand_total,
+                               payment_type, amount_paid, points_redeemed, recorded_by)
+    except CheckoutError:
+        metrics.CHECKOUT_SECONDS.observe(time.perf_counter() - started, outcome="rejected")
+        raise
+    except sqlite3.Error:
+        metrics.CHECKOUT_SECONDS.observe(time.perf_counter() - started, outcome="error")
+        raise
+    metrics.CHECKOUT_SECONDS.observe(time.perf_counter() - started, outcome="committed")
+    metrics.SALES.inc(customer_type=customer_type)
+    metrics.REVENUE.inc(grand_total, customer_type=customer_type)
+    return sale_id
+
+
+def _record_sale(pool, items, customer_type, customer_id, customer_name, grand_total,
+                 payment_type, amount_paid, points_redeemed, recorded_by):
+    if not items:
+        raise CheckoutError("Cart is empty")
+    quantities = _quantities_by_product(items)
+
+    with pool.writer() as conn:
+        # Guarded decrement: a row only changes if it still has enough stock.
+        # Every line is tried so the error can list all shortages at once.
+        shortages = []
+        for pid, qty in quantities.items():
+            updated = conn.execute(
+                "UPDATE products SET current_stock = current_stock - ? WHERE id = ? AND current_stock >= ?",
+                (qty, pid, qty),
+            ).rowcount
+            if not updated:
+                row = conn.execute("SELECT name, current_stock FROM products WHERE id = ?", (pid,)).fetchone()
+                shortages.append((row["name"], qty, row["current_stock"]) if row else (f"Product #{pid}", qty, 0))
+        if shortages:
+            raise InsufficientStock(shortages)
+        # Checked here, in the transaction: the sale row would fail its foreign key, and the
+        # points update below would otherwise look like a shortage of points
+        if customer_id is not None and conn.execute("SELECT 1 FROM customers WHERE id = ?", (customer_id,)).fetchone() is None:
+            raise CheckoutError("Customer no longer exists")
+
+        sale_id = conn.execute("""
+            INSERT INTO sales (customer_type, customer_id, total_amount, payment_type, recorded_by)
+            VALUES (?, ?, ?, ?, ?)
+        """, (customer_type, customer_id, grand_total, payment_type, recorded_by)).lastrowid
+
+        conn.executemany(
+            "INSERT INTO sale_items (sale_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?)",
+            [(sale_id, item["pid"], item["qty"], item["unit_price"]) for item in items],
+        )
+        for row in conn.execute(f"SELECT id, name, category FROM products WHERE id IN ({','.join('?' * len(quantities))})",
+                                tuple(quantities)).fetchall():
+            if inventory.is_lot_tracked(row["category"]):
+                try:
+                    inventory.allocate_fefo(conn, row["id"], quantities[row["id"]], sale_id)
+                except inventory.StockShortage as e:
+                    raise InsufficientStock([(row["name"], e.requested, e.available)])
+
+        reason = f"Sale #{sale_id} to {customer_name}"
+        conn.executemany("""
+            INSERT INTO inventory_transactions (product_id, transaction_type, quantity, reason, recorded_by)
+            VALUES (?, 'OUT', ?, ?, ?)
+        """, [(item["pid"], item["qty"], reason, recorded_by) for item in items])
+
+        if customer_id is not None:
+            # Relative update: concurrent sales to the same customer both count
+            updated = conn.execute("""
+                UPDATE customers
+                SET current_balance = current_balance + ?,
+                    loyalty_points = loyalty_points - ? + ?
+                WHERE id = ? AND loyalty_points >= ?
+            """, (grand_total - amount_paid, points_redeemed, points_earned(grand_total),
+                  customer_id, points_redeemed)).rowcount
+            if not updated:
+                raise InsufficientPoints(points_redeemed)
+            outbox.enqueue(conn, "Customer", customer_id, f"Purchase #{sale_id}: ₱{grand_total:,.2f}")
+
+    return sale_id
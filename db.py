@@ -0,0 +1,294 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+import pandas as pd
+
+import metrics
+from tracing import TracedConnection
+
+# ========================
+# CONNECTION TUNING
+# ========================
+# Applied to every pooled connection when it is opened
+CONNECTION_PRAGMAS = [
+    "PRAGMA busy_timeout = 5000",      # wait for a competing writer instead of failing with "database is locked"
+    "PRAGMA cache_size = -20000",      # ~20 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+]
+
+# Applied once to the writer connection (journal_mode is persistent in the db file)
+WRITER_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",       # readers never block the writer and vice versa
+    "PRAGMA synchronous = NORMAL",     # safe with WAL, one fsync per checkpoint instead of per commit
+    "PRAGMA foreign_keys = ON",
+]
+
+DEFAULT_READERS = 4
+
+# Query result cache bounds
+CACHE_MAX_ENTRIES = 256
+CACHE_MAX_ROWS = 50000     # larger results are served uncached
+
+WRITE_ACTIONS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+
+TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)", re.IGNORECASE)
+
+
+# ========================
+# QUERY RESULT CACHE
+# ========================
+_tables_by_sql = {}
+
+def referenced_tables(sql):
+    # Tables a SELECT reads from; CTE or subquery names just never get bumped
+    tables = _tables_by_sql.get(sql)
+    if tables is None:
+        tables = frozenset(name.lower() for name in TABLE_REF.findall(sql))
+        _tables_by_sql[sql] = tables
+    return tables
+
+
+class QueryCache:
+    """Bounded LRU of read results, evicted by table as soon as a write commits."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_rows=CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (tables, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, tables, value, rows):
+        if rows > self.max_rows:
+            return
+        with self._lock:
+            self._entries[key] = (tables, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tables):
+        with self._lock:
+            stale = [key for key, (deps, _) in self._entries.items() if deps & tables]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# ========================
+# CONNECTION POOL
+# ========================
+class ConnectionPool:
+    """Process-wide pool: one serialized writer connection plus a set of read-only connections."""
+
+    def __init__(self, path, readers=DEFAULT_READERS, tracer=None):
+        self.path = os.path.abspath(path)
+        self.max_readers = readers
+        # Optional tracing.QueryTracer: pooled reads, writer statements and cache hits are reported to it
+        self.tracer = tracer
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._open_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+
+        # Per-table write counters; part of every cache key
+        self.cache = QueryCache()
+        self._versions = {}
+        self._versions_lock = threading.Lock()
+        self._dirty = set()
+
+        # Statement caching is off on the writer so the authorizer sees every statement,
+        # including the tables touched by triggers
+        self._writer = self._connect(self.path, cached_statements=0)
+        for pragma in WRITER_PRAGMAS:
+            self._writer.execute(pragma)
+        self._writer.set_authorizer(self._track_writes)
+
+    def _connect(self, target, uri=False, cached_statements=128):
+        # isolation_level=None: no implicit transactions, writer() issues BEGIN/COMMIT itself
+        conn = sqlite3.connect(target, uri=uri, check_same_thread=False, isolation_level=None,
+                               cached_statements=cached_statements)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._open_lock:
+            if self._opened < self.max_readers:
+                self._opened += 1
+                try:
+                    return self._connect(f"file:{pathname2url(self.path)}?mode=ro", uri=True)
+                except sqlite3.Error:
+                    self._opened -= 1
+                    raise
+        # All readers are busy: wait for one to be returned
+        return self._idle.get()
+
+    @contextmanager
+    def reader(self):
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """Borrow the writer inside a BEGIN IMMEDIATE transaction.
+
+        Commits when the block exits cleanly and rolls back on any exception.
+        A nested writer() on the same thread joins the outer transaction.
+        """
+        conn = self._writer if self.tracer is None else TracedConnection(self._writer, self.tracer)
+        waiting = time.perf_counter()
+        with self._write_lock:
+            if self._write_depth:
+                self._write_depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._write_depth -= 1
+                return
+
+            # Time spent behind other writers: this process's lock, then SQLite's busy wait
+            try:
+                self._writer.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e):
+                    metrics.SQLITE_BUSY.inc()
+                raise
+            metrics.WRITE_LOCK_WAIT_SECONDS.observe(time.perf_counter() - waiting)
+            self._write_depth = 1
+            self._dirty = set()
+            try:
+                yield conn
+                self._writer.execute("COMMIT")
+                self._bump(self._dirty)
+            except BaseException:
+                if self._writer.in_transaction:
+                    self._writer.execute("ROLLBACK")
+                raise
+            finally:
+                self._write_depth = 0
+                self._dirty = set()
+
+    def _track_writes(self, action, arg1, arg2, db_name, trigger):
+        if action in WRITE_ACTIONS:
+            self._dirty.add(arg1.lower())
+        return sqlite3.SQLITE_OK
+
+    def _bump(self, tables):
+        if not tables:
+            return
+        with self._versions_lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+        self.cache.invalidate(frozenset(tables))
+
+    def table_versions(self, tables):
+        with self._versions_lock:
+            return tuple(sorted((table, self._versions.get(table, 0)) for table in tables))
+
+    # ========================
+    # CACHED READS
+    # ========================
+    # Keyed on SQL, parameters and the version of every table the SQL reads.
+    # Versions only move on writes made through this pool, i.e. this server process.
+    def _cached(self, kind, sql, params, load, cached):
+        if not cached:
+            return load(sql, params)
+        tables = referenced_tables(sql)
+        # Named parameters come as a dict
+        param_key = tuple(sorted(params.items())) if isinstance(params, dict) else tuple(params)
+        key = (kind, sql, param_key, self.table_versions(tables))
+        if "'now'" in sql:
+            # date('now') results change at midnight even without writes
+            key += (time.strftime("%Y-%m-%d", time.gmtime()),)
+        hit, value = self.cache.get(key)
+        if hit and self.tracer is not None:
+            self.tracer.cache_hit(sql)
+        if not hit:
+            value = load(sql, params)
+            self.cache.put(key, tables, value, 1 if kind == "one" else len(value))
+        return value
+
+    def _traced(self, conn, sql, params, run, count):
+        if self.tracer is None:
+            return run()
+        started = time.perf_counter()
+        result = run()
+        self.tracer.record(sql, params, time.perf_counter() - started, count(result), conn)
+        return result
+
+    def _load_df(self, sql, params):
+        with self.reader() as conn:
+            return self._traced(conn, sql, params, lambda: pd.read_sql_query(sql, conn, params=params), len)
+
+    def _load_all(self, sql, params):
+        with self.reader() as conn:
+            return self._traced(conn, sql, params, lambda: conn.execute(sql, params).fetchall(), len)
+
+    def _load_one(self, sql, params):
+        with self.reader() as conn:
+            return self._traced(conn, sql, params, lambda: conn.execute(sql, params).fetchone(),
+                                lambda row: 0 if row is None else 1)
+
+    def read_df(self, sql, params=(), cached=True):
+        # Callers are free to mutate the frame they get back
+        return self._cached("df", sql, params, self._load_df, cached).copy()
+
+    def read_all(self, sql, params=(), cached=True):
+        return list(self._cached("all", sql, params, self._load_all, cached))
+
+    def read_one(self, sql, params=(), cached=True):
+        return self._cached("one", sql, params, self._load_one, cached)
+
+    @contextmanager
+    def foreign_keys_disabled(self):
+        # Table rebuilds in migrations need enforcement off; the pragma is a no-op inside a transaction
+        with self._write_lock:
+            self._writer.execute("PRAGMA foreign_keys = OFF")
+            try:
+                yield
+            finally:
+                self._writer.execute("PRAGMA foreign_keys = ON")
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,177 @@
+import io
+import itertools
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from openpyxl import Workbook
+
+# ========================
+# REPORT EXPORTS
+# ========================
+# Reports are built on a small thread pool, off the Streamlit script thread, so a
+# year of collections never freezes the page. Each job streams its queries from a
+# pooled reader in chunks into a write-only (constant-memory) workbook or a CSV,
+# spooled to a temp file, and the page hands the finished file to st.download_button.
+# Nothing is written to the server's working directory.
+
+EXPORT_WORKERS = 2
+CHUNK_ROWS = 5000
+SPOOL_MAX_BYTES = 8 * 1024 * 1024    # larger files roll over from memory to a temp file
+JOBS_KEPT_PER_USER = 10
+
+QUEUED, RUNNING, DONE, FAILED = "Queued", "Running", "Done", "Failed"
+
+MIME_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+}
+
+
+class ExportJob:
+    """One report being built; sheets are (sheet name, sql, params)."""
+
+    def __init__(self, job_id, owner, title, file_name, sheets):
+        self.id = job_id
+        self.owner = owner
+        self.title = title
+        self.file_name = file_name
+        self.format = file_name.rsplit(".", 1)[-1].lower()
+        self.sheets = sheets
+        self.status = QUEUED
+        self.rows = 0
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._buffer = None
+        self._buffer_lock = threading.Lock()    # downloads and discards may race on the spooled file
+
+    @property
+    def mime(self):
+        return MIME_TYPES[self.format]
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    def data(self):
+        # Passed to st.download_button as a callable, so the file is only read on click.
+        # seek + read under the lock: every download gets its own complete copy of the bytes
+        with self._buffer_lock:
+            if self._buffer is None:
+                return b""
+            self._buffer.seek(0)
+            return self._buffer.read()
+
+    def close(self):
+        with self._buffer_lock:
+            if self._buffer is not None:
+                self._buffer.close()
+                self._buffer = None
+
+
+def _chunks(conn, sql, params):
+    return pd.read_sql_query(sql, conn, params=params, chunksize=CHUNK_ROWS)
+
+
+def _cells(chunk):
+    # NaN/NaT as empty cells, numpy scalars as plain Python values
+    return chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def write_xlsx(pool, sheets, out):
+    """Stream every sheet into a write-only workbook; returns the number of data rows."""
+    wb = Workbook(write_only=True)
+    rows = 0
+    with pool.reader() as conn:
+        for name, sql, params in sheets:
+            ws = wb.create_sheet(title=name[:31])
+            for i, chunk in enumerate(_chunks(conn, sql, params)):
+                if i == 0:
+                    ws.append(list(chunk.columns))
+                for row in _cells(chunk):
+                    ws.append(row)
+                rows += len(chunk)
+    wb.save(out)
+    return rows
+
+
+def write_csv(pool, sheets, out):
+    """Stream one query to UTF-8 CSV (with BOM, so Excel reads ₱ correctly); returns the row count."""
+    (_, sql, params), = sheets
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    rows = 0
+    with pool.reader() as conn:
+        for i, chunk in enumerate(_chunks(conn, sql, params)):
+            chunk.to_csv(text, header=i == 0, index=False)
+            rows += len(chunk)
+    text.flush()
+    text.detach()
+    return rows
+
+
+WRITERS = {"xlsx": write_xlsx, "csv": write_csv}
+
+
+class ExportManager:
+    """Process-wide export queue; each user sees and downloads only their own jobs."""
+
+    def __init__(self, pool, workers=EXPORT_WORKERS):
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+        self._jobs = {}     # owner -> OrderedDict(job id -> job), oldest first
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, owner, title, file_name, sheets):
+        """Queue a report. CSV exports take exactly one (sheet name, sql, params)."""
+        job = ExportJob(next(self._ids), owner, title, file_name, sheets)
+        if job.format not in WRITERS:
+            raise ValueError(f"Unsupported export format: {file_name}")
+        if job.format == "csv" and len(sheets) != 1:
+            raise ValueError("A CSV export holds exactly one query")
+        with self._lock:
+            jobs = self._jobs.setdefault(owner, OrderedDict())
+            jobs[job.id] = job
+            # Drop the oldest finished jobs past the per-user limit
+            for old in [j for j in jobs.values() if not j.active][:max(0, len(jobs) - JOBS_KEPT_PER_USER)]:
+                jobs.pop(old.id).close()
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        job.status = RUNNING
+        buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        try:
+            job.rows = WRITERS[job.format](self.pool, job.sheets, buffer)
+        except Exception as e:
+            buffer.close()
+            job.error = str(e)
+            job.status = FAILED
+        else:
+            with job._buffer_lock:
+                job._buffer = buffer
+            job.status = DONE
+        job.finished = time.time()
+
+    def jobs_for(self, owner):
+        # Newest first
+        with self._lock:
+            return list(reversed(self._jobs.get(owner, {}).values()))
+
+    def discard(self, owner, job_id):
+        with self._lock:
+            job = self._jobs.get(owner, {}).get(job_id)
+            if job is not None and not job.active:
+                self._jobs[owner].pop(job_id).close()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for jobs in self._jobs.values():
+                for job in jobs.values():
+                    job.close()
+            self._jobs.clear()
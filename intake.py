@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+
+import metrics
+import outbox
+import pricing
+
+# ========================
+# BULK ROUTE-SHEET INTAKE
+# ========================
+# A collection centre's route sheet (CSV or Excel, one row per delivery) is graded and
+# priced as whole columns with the rules in pricing.py, previewed, then written in a
+# single transaction.
+
+REQUIRED_COLUMNS = ["farmer", "litres", "fat", "snf", "temperature"]
+
+# Header spellings seen on route sheets -> canonical column
+COLUMN_ALIASES = {
+    "farmer": "farmer", "farmer_name": "farmer", "name": "farmer", "username": "farmer", "farmer_id": "farmer",
+    "litres": "litres", "liters": "litres", "total_litres": "litres", "total_liters": "litres", "volume": "litres",
+    "fat": "fat", "fat_%": "fat", "fat_percent": "fat", "fat_percentage": "fat",
+    "snf": "snf", "snf_%": "snf", "snf_percent": "snf", "snf_percentage": "snf",
+    "temperature": "temperature", "temp": "temperature", "temperature_(°c)": "temperature", "temp_c": "temperature",
+    "notes": "notes", "remarks": "notes",
+}
+
+TEMPLATE_CSV = (
+    "farmer,litres,fat,snf,temperature,notes\n"
+    "Mang Jose,42.5,3.9,8.6,4.5,\n"
+    "maria,120,4.1,8.9,5.0,Morning route\n"
+).encode("utf-8")
+
+
+def read_route_sheet(uploaded):
+    """Load an uploaded CSV/Excel route sheet and normalise its headers.
+
+    Raises ValueError when the file can't be read or a required column is missing.
+    """
+    # Read as text: with one blank cell pandas would make a farmer id column float ("3.0").
+    # The number columns are parsed when the sheet is graded.
+    try:
+        if uploaded.name.lower().endswith(".csv"):
+            sheet = pd.read_csv(uploaded, dtype=str)
+        else:
+            sheet = pd.read_excel(uploaded, dtype=str)
+    except Exception as e:
+        raise ValueError(f"Could not read route sheet: {e}")
+
+    headers = sheet.columns.astype(str).str.strip().str.lower().str.replace(" ", "_")
+    sheet.columns = [COLUMN_ALIASES.get(h, h) for h in headers]
+    sheet = sheet.loc[:, ~sheet.columns.duplicated()]
+    missing = [c for c in REQUIRED_COLUMNS if c not in sheet.columns]
+    if missing:
+        raise ValueError(f"Route sheet is missing column(s): {', '.join(missing)}")
+    if "notes" not in sheet.columns:
+        sheet["notes"] = ""
+    sheet = sheet.dropna(how="all", subset=REQUIRED_COLUMNS)
+    return sheet[REQUIRED_COLUMNS + ["notes"]].reset_index(drop=True)
+
+
+def grade_route_sheet(sheet, farmers, delivered_yesterday, schedule):
+    """Score, accept/reject and price every row of a route sheet.
+
+    farmers: DataFrame with id, name, username, loyalty_tier.
+    schedule: the pricing.PriceSchedule in force today.
+    delivered_yesterday: farmer ids eligible for the consistency bonus.
+    Returns one row per delivery with a status of Accepted, Rejected or "Error: ...".
+    """
+    # A farmer can be written as name, portal username or id. A key that fits two
+    # different farmers is an error rather than a guess.
+    keys = pd.concat([
+        farmers.assign(key=farmers["name"].str.strip().str.lower()),
+        farmers.assign(key=farmers["username"].fillna("").str.strip().str.lower()),
+        farmers.assign(key=farmers["id"].astype(str)),
+    ])
+    keys = keys[keys["key"] != ""].drop_duplicates(["key", "id"])
+    ambiguous = set(keys.loc[keys["key"].duplicated(), "key"])
+    keys = keys.drop_duplicates("key")
+    keys.loc[keys["key"].isin(ambiguous), ["id", "name", "loyalty_tier"]] = None
+
+    # Ids typed into a numeric column come as "3.0"
+    farmer = sheet["farmer"].fillna("").astype(str).str.strip().str.lower().str.replace(r"^(\d+)\.0*$", r"\1", regex=True)
+    graded = sheet.assign(key=farmer)
+    graded = graded.merge(keys[["key", "id", "name", "loyalty_tier"]], on="key", how="left")
+    graded = graded.rename(columns={"id": "farmer_id", "name": "farmer_name"})
+    is_ambiguous = graded["key"].isin(ambiguous)
+    graded = graded.drop(columns="key")
+
+    for col in ["litres", "fat", "snf", "temperature"]:
+        graded[col] = pd.to_numeric(graded[col], errors="coerce")
+    graded["notes"] = graded["notes"].fillna("").astype(str).str.strip()
+
+    bad_number = graded[["litres", "fat", "snf", "temperature"]].isna().any(axis=1)
+    error = np.select(
+        [is_ambiguous, graded["farmer_id"].isna(), bad_number, graded["litres"] <= 0],
+        ["Ambiguous farmer", "Unknown farmer", "Missing or invalid number", "Liters must be greater than 0"],
+        "",
+    )
+    numbers = graded[["litres", "fat", "snf", "temperature"]].fillna(0)
+    rejected = pricing.is_rejected(numbers["fat"], numbers["snf"], numbers["temperature"]) & (error == "")
+    priced = schedule.price(numbers["litres"], numbers["fat"], numbers["snf"],
+                            graded["loyalty_tier"].fillna("Bronze"),
+                            graded["farmer_id"].isin(delivered_yesterday))
+    accepted = (error == "") & ~rejected
+
+    graded["quality_score"] = pricing.quality_score(numbers["litres"], numbers["fat"], numbers["snf"], numbers["temperature"])
+    graded["price_per_liter"] = np.where(accepted, priced["price_per_liter"], 0.0)
+    graded["total_bonus"] = np.where(accepted, priced["total_bonus"], 0.0)
+    graded["total_payment"] = np.where(accepted, priced["total_payment"], 0.0)
+    graded["status"] = np.select([error != "", rejected], ["Error: " + pd.Series(error), "Rejected"], "Accepted")
+    graded["reason"] = np.where(rejected, pricing.rejection_reasons(numbers["fat"], numbers["snf"], numbers["temperature"]), "")
+    return graded
+
+
+def record_route_sheet(pool, graded, recorded_by, month):
+    """Write every accepted and rejected delivery in one transaction; error rows are skipped.
+
+    month is the farmer_monthly_stats key used for tier upgrades.
+    Returns counts, totals and the tier upgrades that were applied.
+    """
+    accepted = graded[graded["status"] == "Accepted"]
+    rejected = graded[graded["status"] == "Rejected"]
+    farmer_ids = accepted["farmer_id"].astype(int).tolist()
+    litres = accepted["litres"].tolist()
+    payments = accepted["total_payment"].tolist()
+
+    with pool.writer() as conn:
+        conn.executemany("""
+            INSERT INTO milk_collections
+            (farmer_id, class_a_litres, class_b_litres, total_payment, notes, recorded_by,
+             fat_percentage, snf_percentage, quality_score)
+            VALUES (?, ?, 0, ?, ?, ?, ?, ?, ?)
+        """, list(zip(
+            farmer_ids, litres, payments,
+            accepted["notes"].replace("", "Route sheet").tolist(),
+            [recorded_by] * len(accepted),
+            accepted["fat"].tolist(), accepted["snf"].tolist(), accepted["quality_score"].tolist(),
+        )) + list(zip(
+            rejected["farmer_id"].astype(int).tolist(),
+            [0.0] * len(rejected), [0.0] * len(rejected),
+            ("REJECTED: " + rejected["reason"]).tolist(),
+            [recorded_by] * len(rejected),
+            rejected["fat"].tolist(), rejected["snf"].tolist(), rejected["quality_score"].tolist(),
+        )))
+
+        if farmer_ids:
+            conn.execute("UPDATE products SET current_stock = current_stock + ? WHERE name = 'Raw Milk'", (sum(litres),))
+            conn.executemany("""
+                INSERT INTO inventory_transactions
+                (product_id, transaction_type, quantity, reason, recorded_by)
+                VALUES ((SELECT id FROM products WHERE name = 'Raw Milk'), 'IN', ?, ?, ?)
+            """, [(l, f"Collection from {name} | {l:.1f}L | Bonus ₱{bonus:.0f}", recorded_by)
+                  for name, l, bonus in zip(accepted["farmer_name"], litres, accepted["total_bonus"].tolist())])
+
+        # Tier upgrades from the month totals, which the rollup trigger has already updated
+        month_litres = dict(conn.execute(
+            "SELECT farmer_id, litres FROM farmer_monthly_stats WHERE month = ?", (month,)).fetchall())
+        tiers = dict(zip(farmer_ids, accepted["loyalty_tier"]))
+        upgrades = []
+        for farmer_id, tier in tiers.items():
+            new_tier = pricing.tier_after(tier, month_litres.get(farmer_id, 0))
+            if new_tier != tier:
+                upgrades.append((farmer_id, tier, new_tier))
+        conn.executemany("UPDATE dairy_farmers SET loyalty_tier = ? WHERE id = ?",
+                         [(new_tier, farmer_id) for farmer_id, _, new_tier in upgrades])
+
+        # In-app and SMS, sent by the outbox worker after this commits
+        outbox.enqueue_many(conn, "Farmer",
+                            [(fid, f"New collection: {l:.1f}L → ₱{pay:,.2f}") for fid, l, pay in zip(farmer_ids, litres, payments)]
+                            + [(int(fid), f"Your delivery today was rejected: {reason}")
+                               for fid, reason in zip(rejected["farmer_id"], rejected["reason"])],
+                            channels=(outbox.IN_APP, outbox.SMS))
+
+    metrics.COLLECTIONS.inc(len(accepted), status="accepted")
+    metrics.COLLECTIONS.inc(len(rejected), status="rejected")
+    metrics.LITRES_IN.inc(sum(litres))
+
+    names = dict(zip(farmer_ids, accepted["farmer_name"]))
+    return {
+        "accepted": len(accepted),
+        "rejected": len(rejected),
+        "litres": sum(litres),
+        "payment": sum(payments),
+        "upgrades": [(names[fid], old, new) for fid, old, new in upgrades],
+    }
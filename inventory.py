@@ -0,0 +1,152 @@
+from datetime import timedelta
+
+# ========================
+# LOT INVENTORY (FEFO)
+# ========================
+# Sellable stock is held in inventory_lots, each with its own expiry date.
+# products.current_stock remains the product total (and the oversell guard at
+# checkout); the lots say which units those are. Stock leaves in
+# first-expired-first-out order: every pick is one seek on idx_inventory_lots_fefo,
+# which only holds lots that still have stock.
+
+# Categories kept as a single bulk quantity instead of lots
+UNTRACKED_CATEGORIES = ("Raw Milk",)
+
+NEXT_LOT = """
+    SELECT id, quantity_remaining
+    FROM inventory_lots
+    WHERE product_id = ? AND quantity_remaining > 0
+    ORDER BY expiry_date IS NULL, expiry_date, id
+    LIMIT 1
+"""
+
+LOT_STOCK = "SELECT COALESCE(SUM(quantity_remaining), 0) FROM inventory_lots WHERE product_id = ? AND quantity_remaining > 0"
+
+
+class StockShortage(Exception):
+    """Less stock than asked for. Raised inside the write transaction, so nothing is written."""
+
+    def __init__(self, product_id, requested, available, where="in stock"):
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+        super().__init__(f"wanted {requested:g}, only {available:g} {where}")
+
+
+def is_lot_tracked(category):
+    return category not in UNTRACKED_CATEGORIES
+
+
+def receive_lot(conn, product_id, quantity, expiry_date=None, batch_id=None):
+    """Add a lot of stock (expiry_date as ISO text, or None for no expiry) and return its id."""
+    return conn.execute("""
+        INSERT INTO inventory_lots (product_id, batch_id, expiry_date, quantity_received, quantity_remaining)
+        VALUES (?, ?, ?, ?, ?)
+    """, (product_id, batch_id, expiry_date, quantity, quantity)).lastrowid
+
+
+def take_stock(conn, product_id, quantity):
+    """Guarded decrement of a product's stock counter; raises StockShortage instead of going below 0."""
+    updated = conn.execute("UPDATE products SET current_stock = current_stock - ? WHERE id = ? AND current_stock >= ?",
+                           (quantity, product_id, quantity)).rowcount
+    if not updated:
+        row = conn.execute("SELECT current_stock FROM products WHERE id = ?", (product_id,)).fetchone()
+        raise StockShortage(product_id, quantity, row["current_stock"] if row else 0)
+
+
+def allocate_fefo(conn, product_id, quantity, sale_id=None):
+    """Take quantity out of a product's lots, soonest expiry first.
+
+    Must run inside the same write transaction as the stock counter update.
+    Returns [(lot_id, quantity), ...]. Raises StockShortage, before taking anything,
+    when the lots hold less than quantity, so lots and counter never drift apart.
+    """
+    available = conn.execute(LOT_STOCK, (product_id,)).fetchone()[0]
+    if available < quantity - 1e-9:
+        raise StockShortage(product_id, quantity, available, "left in lots")
+    taken = []
+    remaining = quantity
+    while remaining > 1e-9:
+        lot = conn.execute(NEXT_LOT, (product_id,)).fetchone()
+        if lot is None:
+            break
+        qty = min(remaining, lot["quantity_remaining"])
+        conn.execute("UPDATE inventory_lots SET quantity_remaining = quantity_remaining - ? WHERE id = ?", (qty, lot["id"]))
+        taken.append((lot["id"], qty))
+        remaining -= qty
+    conn.executemany("INSERT INTO lot_allocations (lot_id, sale_id, quantity) VALUES (?, ?, ?)",
+                     [(lot_id, sale_id, qty) for lot_id, qty in taken])
+    return taken
+
+
+# ========================
+# STOCK LEDGER CHECKPOINTS
+# ========================
+# inventory_transactions is the stock ledger. stock_checkpoints holds each product's
+# ledger balance at the end of a closed day, written only for days the product moved.
+# Stock on any date = nearest checkpoint at or before it + the ledger rows after it,
+# so an as-of query reads a bounded tail instead of replaying the whole ledger.
+# Days are closed on the app's local date, but never before the ledger has finished
+# them: ledger rows are dated by SQLite's date('now'), which is UTC.
+
+SIGNED_QUANTITY = "CASE it.transaction_type WHEN 'IN' THEN it.quantity ELSE -it.quantity END"
+
+# :day is an ISO date; products created after it come back with 0
+STOCK_AS_OF = f"""
+    SELECT p.id AS product_id, p.name, p.category, p.unit, p.srp, p.current_stock,
+           cp.checkpoint_date, cp.quantity AS checkpoint_quantity,
+           COALESCE(cp.quantity, 0) + COALESCE((
+               SELECT SUM({SIGNED_QUANTITY})
+               FROM inventory_transactions it
+               WHERE it.product_id = p.id
+                 AND it.transaction_date > COALESCE(cp.checkpoint_date, '')
+                 AND it.transaction_date <= :day
+           ), 0) AS quantity
+    FROM products p
+    LEFT JOIN stock_checkpoints cp ON cp.product_id = p.id AND cp.checkpoint_date = (
+        SELECT MAX(checkpoint_date) FROM stock_checkpoints
+        WHERE product_id = p.id AND checkpoint_date <= :day
+    )
+    ORDER BY p.name
+"""
+
+# Counters this far from the ledger are reported as drift
+DRIFT_TOLERANCE = 1e-6
+
+
+def stock_as_of(conn, day):
+    return conn.execute(STOCK_AS_OF, {"day": day}).fetchall()
+
+
+def close_books(conn, today):
+    """Checkpoint the closing balance of the day before today (a local date) for every product that moved since its last checkpoint.
+
+    Safe to call any number of times; returns the number of checkpoints written.
+    """
+    # A row written later but dated on the closed day would fall behind its checkpoint
+    ledger_yesterday = conn.execute("SELECT date('now', '-1 day')").fetchone()[0]
+    yesterday = min((today - timedelta(days=1)).isoformat(), ledger_yesterday)
+    rows = [(row["product_id"], yesterday, row["quantity"]) for row in stock_as_of(conn, yesterday)
+            if row["checkpoint_date"] != yesterday and row["quantity"] != (row["checkpoint_quantity"] or 0)]
+    conn.executemany("INSERT OR REPLACE INTO stock_checkpoints (product_id, checkpoint_date, quantity) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+def reconcile(conn, today):
+    """Close the books, then compare every product's current_stock with its ledger balance.
+
+    Only ledger rows after each product's latest checkpoint are read.
+    Returns [{"product_id", "name", "counter", "ledger", "drift"}, ...] for every product.
+    """
+    close_books(conn, today)
+    # The counters include every ledger row so far, whatever day the ledger's clock gave it
+    ledger_today = conn.execute("SELECT date('now')").fetchone()[0]
+    report = []
+    for row in stock_as_of(conn, max(today.isoformat(), ledger_today)):
+        drift = row["current_stock"] - row["quantity"]
+        report.append({
+            "product_id": row["product_id"], "name": row["name"],
+            "counter": row["current_stock"], "ledger": row["quantity"],
+            "drift": drift if abs(drift) > DRIFT_TOLERANCE else 0.0,
+        })
+    return report
@@ -0,0 +1,96 @@
+# ========================
+# MESSAGE THREADS
+# ========================
+# Each farmer or customer has one thread with management. message_threads keeps
+# the newest message time, a preview and the staff unread count, so the inbox
+# lists threads a page at a time from one index (keyset pagination on
+# last_message_at, id) and loads a thread's messages only when it is opened.
+
+PAGE_SIZE = 20
+MESSAGES_SHOWN = 50
+PREVIEW_CHARS = 120
+
+# Cursor that sorts after every real thread: the first page starts here
+FIRST_PAGE = ("9999-12-31", 0)
+
+THREAD_PAGE = """
+    SELECT id, party_type, party_id, party_name, last_message_at, last_preview, message_count, unread_count
+    FROM message_threads
+    WHERE (last_message_at, id) < (?, ?)
+    ORDER BY last_message_at DESC, id DESC
+    LIMIT ?
+"""
+
+UNREAD_THREAD_PAGE = """
+    SELECT id, party_type, party_id, party_name, last_message_at, last_preview, message_count, unread_count
+    FROM message_threads
+    WHERE unread_count > 0 AND (last_message_at, id) < (?, ?)
+    ORDER BY last_message_at DESC, id DESC
+    LIMIT ?
+"""
+
+UNREAD_SUMMARY = """
+    SELECT COUNT(*) AS threads, COALESCE(SUM(unread_count), 0) AS messages
+    FROM message_threads
+    WHERE unread_count > 0
+"""
+
+# Newest MESSAGES_SHOWN messages of a thread, newest first
+THREAD_MESSAGES = """
+    SELECT id, sender_type, sender_name, message, timestamp
+    FROM messages
+    WHERE thread_id = ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+
+PARTY_THREAD = "SELECT id, message_count FROM message_threads WHERE party_type = ? AND party_id = ?"
+
+
+def thread_page(read_all, cursor=FIRST_PAGE, unread_only=False):
+    """One page of threads, most recent first, and the cursor for the next page (None on the last).
+
+    read_all is the caller's (cached) query function, e.g. ConnectionPool.read_all.
+    """
+    sql = UNREAD_THREAD_PAGE if unread_only else THREAD_PAGE
+    rows = read_all(sql, (cursor[0], cursor[1], PAGE_SIZE + 1))
+    if len(rows) <= PAGE_SIZE:
+        return rows, None
+    rows = rows[:PAGE_SIZE]
+    return rows, (rows[-1]["last_message_at"], rows[-1]["id"])
+
+
+def thread_messages(read_all, thread_id, limit=MESSAGES_SHOWN):
+    # Oldest first, for display
+    return list(reversed(read_all(THREAD_MESSAGES, (thread_id, limit))))
+
+
+def post_message(conn, party_type, party_id, party_name, sender_type, sender_id, sender_name, body):
+    """Append a message to the party's thread, creating the thread on first contact.
+
+    A message from the party adds to the staff unread count; a staff reply clears it.
+    Returns the thread id.
+    """
+    conn.execute("""
+        INSERT INTO message_threads (party_type, party_id, party_name) VALUES (?, ?, ?)
+        ON CONFLICT(party_type, party_id) DO UPDATE SET party_name = excluded.party_name
+    """, (party_type, party_id, party_name))
+    thread_id = conn.execute(PARTY_THREAD, (party_type, party_id)).fetchone()["id"]
+    message_id = conn.execute("""
+        INSERT INTO messages (sender_type, sender_id, sender_name, message, thread_id)
+        VALUES (?, ?, ?, ?, ?)
+    """, (sender_type, sender_id, sender_name, body, thread_id)).lastrowid
+    conn.execute("""
+        UPDATE message_threads
+        SET last_message_at = (SELECT timestamp FROM messages WHERE id = ?),
+            last_message_id = ?,
+            last_preview = ?,
+            message_count = message_count + 1,
+            unread_count = CASE WHEN ? THEN unread_count + 1 ELSE 0 END
+        WHERE id = ?
+    """, (message_id, message_id, body[:PREVIEW_CHARS], sender_type == party_type, thread_id))
+    return thread_id
+
+
+def mark_read(conn, thread_id):
+    conn.execute("UPDATE message_threads SET unread_count = 0 WHERE id = ? AND unread_count > 0", (thread_id,))
@@ -0,0 +1,311 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ========================
+# OPERATIONAL METRICS
+# ========================
+# Counters, gauges and histograms for the Ops dashboards, kept in this process and
+# rendered in the Prometheus text exposition format (version 0.0.4). No client library
+# or push gateway is needed: the text is served by a small HTTP thread
+# (DAIRY_METRICS_PORT) and/or rewritten to a file every few seconds (DAIRY_METRICS_FILE,
+# e.g. for node_exporter's textfile collector). Counters only ever go up from process
+# start, so graphs use rate(): rate(dairy_collections_total[5m]) shows the morning
+# intake peak. Values that already exist elsewhere (cache hits, active sessions) are
+# read when the metrics are rendered instead of being counted twice.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+FILE_INTERVAL_SECONDS = 15
+SESSION_IDLE_SECONDS = 300    # a session with no rerun for this long no longer counts as active
+
+# Histogram bucket bounds, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOCK_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {_escape_help(self.help)}",
+                f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+    def render(self):
+        return self.header() + self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("counters only go up")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Callback(Metric):
+    """A counter or gauge read when the metrics are rendered.
+
+    read() returns a number, or {label values tuple: number} when there are labels.
+    """
+
+    def __init__(self, name, help, read, kind="gauge", labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.read = read
+        self.kind = kind
+
+    def samples(self):
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket (not cumulative) plus +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        lines = []
+        for key, counts in sorted(values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # Names are unique: registering one again returns the metric already there
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, read, kind="gauge", labelnames=()):
+        # Replaces an earlier callback: it may close over objects that are gone
+        metric = Callback(name, help, read, kind, labelnames)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ========================
+# APP METRICS
+# ========================
+COLLECTIONS = REGISTRY.counter("dairy_collections_total", "Milk deliveries recorded, by outcome.", ["status"])
+LITRES_IN = REGISTRY.counter("dairy_collection_litres_total", "Litres of accepted raw milk received.")
+SALES = REGISTRY.counter("dairy_sales_total", "Sales committed at the POS, by customer type.", ["customer_type"])
+REVENUE = REGISTRY.counter("dairy_sales_revenue_pesos_total", "Grand total of committed sales in pesos, by customer type.", ["customer_type"])
+CHECKOUT_SECONDS = REGISTRY.histogram("dairy_checkout_seconds", "Time to commit a sale, by outcome.", ["outcome"])
+RERUN_SECONDS = REGISTRY.histogram("dairy_rerun_seconds", "Full script reruns that ran to the end, by page.", ["page"])
+WRITE_LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "dairy_sqlite_write_lock_wait_seconds", "Wait for the writer connection and BEGIN IMMEDIATE before a write transaction.",
+    buckets=LOCK_WAIT_BUCKETS)
+SQLITE_BUSY = REGISTRY.counter("dairy_sqlite_busy_total", "Write transactions that failed with 'database is locked'.")
+
+_STARTED = time.time()
+REGISTRY.callback("dairy_process_start_time_seconds", "Start time of this server process (unix seconds).", lambda: _STARTED)
+
+
+def watch_query_cache(cache):
+    """Expose a db.QueryCache's hit and miss counts and its hit ratio since start."""
+    REGISTRY.callback("dairy_query_cache_requests_total", "Cached reads served from the cache (hit) or the database (miss).",
+                      lambda: {("hit",): cache.hits, ("miss",): cache.misses}, kind="counter", labelnames=["result"])
+    REGISTRY.callback("dairy_query_cache_hit_ratio", "Share of cached reads served from the cache since start.",
+                      lambda: cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0)
+    REGISTRY.callback("dairy_query_cache_entries", "Results held in the query cache.", lambda: len(cache))
+
+
+class SessionTracker:
+    """Browser sessions that reran in the last SESSION_IDLE_SECONDS."""
+
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session_id):
+        with self._lock:
+            self._seen[session_id] = time.monotonic()
+
+    def active(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            for session_id in [s for s, seen in self._seen.items() if seen < cutoff]:
+                del self._seen[session_id]
+            return len(self._seen)
+
+
+SESSIONS = SessionTracker()
+REGISTRY.callback("dairy_active_sessions", "Sessions with a rerun in the last 5 minutes.", SESSIONS.active)
+
+
+# ========================
+# EXPORT
+# ========================
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass      # a scrape every 15 s would flood the server log
+
+
+def start_http_server(port, addr="127.0.0.1", registry=REGISTRY):
+    """Serve GET /metrics from a daemon thread; returns the server (server.shutdown() stops it)."""
+    handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def write_file(path, registry=REGISTRY):
+    # Written beside the target and renamed, so a reader never sees half a file
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+
+class FileExporter:
+    """Rewrites the metrics file every interval seconds from a daemon thread."""
+
+    def __init__(self, path, interval=FILE_INTERVAL_SECONDS, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-file", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                write_file(self.path, self.registry)
+            except OSError:
+                pass      # e.g. the directory is gone for a moment; try again next interval
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
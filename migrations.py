@@ -0,0 +1,875 @@
+import re
+
+import attachments
+
+# ========================
+# SCHEMA MIGRATIONS
+# ========================
+# Each step runs once, in order, inside its own write transaction.
+# The applied version is recorded in schema_version so restarts skip it.
+# A step that stores files returns them staged (see attachments.staging);
+# they are moved into place once its transaction commits.
+# Never edit a released step: append a new one instead.
+
+
+class MigrationError(Exception):
+    """A step left the database inconsistent; its transaction was rolled back."""
+
+
+def _table_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def _m001_initial_schema(conn):
+    # Databases created before migrations existed already have these tables
+    fresh_install = not _table_exists(conn, "internal_users")
+
+    c = conn.cursor()
+
+    # Internal Users
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS internal_users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('Admin', 'Manager', 'Sales Clerk', 'Field Staff'))
+        )
+    ''')
+
+    # Dairy Farmers
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS dairy_farmers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            contact TEXT,
+            address TEXT,
+            username TEXT UNIQUE,
+            password TEXT,
+            loyalty_tier TEXT DEFAULT 'Bronze',
+            bonus_earned REAL DEFAULT 0
+        )
+    ''')
+
+    # Customers
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            type TEXT CHECK(type IN ('Reseller', 'Distributor', 'Institutional Buyer')),
+            contact TEXT,
+            username TEXT UNIQUE,
+            password TEXT,
+            discount_type TEXT DEFAULT 'Percentage',
+            discount_value REAL DEFAULT 0,
+            loyalty_points INTEGER DEFAULT 0,
+            current_balance REAL DEFAULT 0
+        )
+    ''')
+
+    # Products
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            category TEXT,
+            srp REAL NOT NULL,
+            unit TEXT,
+            current_stock REAL DEFAULT 0,
+            low_stock_threshold REAL DEFAULT 10,
+            expiry_date TEXT
+        )
+    ''')
+
+    # Milk Collections (all quality fields included from start)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS milk_collections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            farmer_id INTEGER,
+            class_a_litres REAL DEFAULT 0,
+            class_b_litres REAL DEFAULT 0,
+            total_payment REAL,
+            collection_date TEXT DEFAULT (date('now')),
+            notes TEXT,
+            recorded_by TEXT,
+            fat_percentage REAL,
+            snf_percentage REAL,
+            quality_score REAL
+        )
+    ''')
+
+    # Sales & Items
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_type TEXT,
+            customer_id INTEGER,
+            total_amount REAL,
+            payment_type TEXT,
+            sale_date TEXT DEFAULT (date('now')),
+            recorded_by TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sale_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_id INTEGER,
+            product_id INTEGER,
+            quantity REAL,
+            unit_price REAL
+        )
+    ''')
+
+    # Inventory Transactions
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER,
+            transaction_type TEXT,
+            quantity REAL,
+            reason TEXT,
+            transaction_date TEXT DEFAULT (date('now')),
+            recorded_by TEXT
+        )
+    ''')
+
+    # Announcements, Messages, Notifications
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS announcements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            target_type TEXT NOT NULL,
+            created_date TEXT DEFAULT (date('now'))
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_type TEXT NOT NULL,
+            sender_id INTEGER,
+            sender_name TEXT,
+            message TEXT NOT NULL,
+            timestamp TEXT DEFAULT (datetime('now'))
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_type TEXT NOT NULL,
+            user_id INTEGER,
+            message TEXT NOT NULL,
+            is_read INTEGER DEFAULT 0,
+            created_date TEXT DEFAULT (datetime('now'))
+        )
+    ''')
+
+    if fresh_install:
+        _seed_defaults(c)
+
+
+def _seed_defaults(c):
+    # Demo accounts and starter catalog, applied on first install only
+    c.execute("INSERT OR IGNORE INTO internal_users (username, password, role) VALUES ('admin', 'admin123', 'Admin')")
+
+    sample_farmers = [
+        ("Mang Jose Santos", "0917-1234567", "San Teodoro", "jose", "jose123"),
+        ("Aling Maria Reyes", "0928-9876543", "Victoria", "maria", "maria123"),
+        ("Juan dela Cruz", "0999-5551111", "Naujan", "juan", "juan123")
+    ]
+    c.executemany("INSERT OR IGNORE INTO dairy_farmers (name, contact, address, username, password) VALUES (?, ?, ?, ?, ?)", sample_farmers)
+
+    sample_customers = [
+        ("Juan's Sari-Sari Store", "Reseller", "0909-1112222", "juansstore", "store123", "Percentage", 10.0, 850),
+        ("Reyes Mini Mart", "Distributor", "0918-3334444", "reyesmart", "mart123", "Percentage", 15.0, 2500),
+        ("Mindoro School Canteen", "Institutional Buyer", "0920-5556666", "schoolcanteen", "canteen123", "Fixed", 5.0, 0)
+    ]
+    c.executemany("INSERT OR IGNORE INTO customers (name, type, contact, username, password, discount_type, discount_value, loyalty_points) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", sample_customers)
+
+    sample_products = [
+        ("Raw Milk", "Raw Milk", 0, "Liter", 0, 50, None),
+        ("Fresh Milk 1L", "Finished Goods", 50, "Bottle", 100, 20, None),
+        ("Yogurt 500g", "Finished Goods", 80, "Pack", 50, 10, None),
+        ("Cheese 200g", "Finished Goods", 120, "Pack", 30, 5, None)
+    ]
+    c.executemany("INSERT OR IGNORE INTO products (name, category, srp, unit, current_stock, low_stock_threshold, expiry_date) VALUES (?, ?, ?, ?, ?, ?, ?)", sample_products)
+
+
+def _rebuild_table(conn, name, create_sql):
+    # SQLite cannot add constraints to an existing table: copy into a new definition and swap
+    columns = ", ".join(row["name"] for row in conn.execute(f"PRAGMA table_info({name})"))
+    conn.execute(create_sql.replace(f"CREATE TABLE {name}", f"CREATE TABLE {name}_new", 1))
+    conn.execute(f"INSERT INTO {name}_new ({columns}) SELECT {columns} FROM {name}")
+    conn.execute(f"DROP TABLE {name}")
+    conn.execute(f"ALTER TABLE {name}_new RENAME TO {name}")
+
+
+def _repair_orphans(conn):
+    # Older builds let admins delete customers, farmers and products that still had history.
+    # Sales and collections keep their totals with the buyer/farmer unlinked; item and ledger
+    # rows get a placeholder product back so stock history and reports still add up.
+    conn.execute("""
+        UPDATE sales SET customer_id = NULL
+        WHERE customer_id IS NOT NULL AND customer_id NOT IN (SELECT id FROM customers)
+    """)
+    conn.execute("""
+        UPDATE milk_collections SET farmer_id = NULL
+        WHERE farmer_id IS NOT NULL AND farmer_id NOT IN (SELECT id FROM dairy_farmers)
+    """)
+    conn.execute("""
+        INSERT INTO products (id, name, category, srp, unit, current_stock)
+        SELECT product_id, 'Deleted product #' || product_id, 'Discontinued', 0, NULL, 0
+        FROM (SELECT product_id FROM sale_items UNION SELECT product_id FROM inventory_transactions)
+        WHERE product_id IS NOT NULL AND product_id NOT IN (SELECT id FROM products)
+    """)
+
+
+def _m002_foreign_keys_and_indexes(conn):
+    # Older builds stored numpy int64 ids as 8-byte blobs; turn them back into integers
+    for table in ("inventory_transactions", "sale_items"):
+        blobs = conn.execute(f"SELECT id, product_id FROM {table} WHERE typeof(product_id) = 'blob'").fetchall()
+        conn.executemany(f"UPDATE {table} SET product_id = ? WHERE id = ?",
+                         [(int.from_bytes(row["product_id"], "little", signed=True), row["id"]) for row in blobs])
+    _repair_orphans(conn)
+
+    _rebuild_table(conn, "milk_collections", '''
+        CREATE TABLE milk_collections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            farmer_id INTEGER REFERENCES dairy_farmers(id),
+            class_a_litres REAL DEFAULT 0,
+            class_b_litres REAL DEFAULT 0,
+            total_payment REAL,
+            collection_date TEXT DEFAULT (date('now')),
+            notes TEXT,
+            recorded_by TEXT,
+            fat_percentage REAL,
+            snf_percentage REAL,
+            quality_score REAL
+        )
+    ''')
+    _rebuild_table(conn, "sales", '''
+        CREATE TABLE sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_type TEXT,
+            customer_id INTEGER REFERENCES customers(id),
+            total_amount REAL,
+            payment_type TEXT,
+            sale_date TEXT DEFAULT (date('now')),
+            recorded_by TEXT
+        )
+    ''')
+    _rebuild_table(conn, "sale_items", '''
+        CREATE TABLE sale_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_id INTEGER REFERENCES sales(id),
+            product_id INTEGER REFERENCES products(id),
+            quantity REAL,
+            unit_price REAL
+        )
+    ''')
+    _rebuild_table(conn, "inventory_transactions", '''
+        CREATE TABLE inventory_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER REFERENCES products(id),
+            transaction_type TEXT,
+            quantity REAL,
+            reason TEXT,
+            transaction_date TEXT DEFAULT (date('now')),
+            recorded_by TEXT
+        )
+    ''')
+
+    # Hot predicates used by the dashboard, portals and history pages
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_milk_collections_date ON milk_collections(collection_date)",
+        "CREATE INDEX IF NOT EXISTS idx_milk_collections_farmer_date ON milk_collections(farmer_id, collection_date)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_date ON sales(sale_date)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_customer ON sales(customer_type, customer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sale_items_sale ON sale_items(sale_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sale_items_product ON sale_items(product_id)",
+        "CREATE INDEX IF NOT EXISTS idx_inventory_tx_product_date ON inventory_transactions(product_id, transaction_date)",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_type, is_read, created_date)",
+        "CREATE INDEX IF NOT EXISTS idx_announcements_target_date ON announcements(target_type, created_date)",
+    ):
+        conn.execute(statement)
+
+
+def _m003_daily_summary(conn):
+    # One row per day, kept current by triggers in the same transaction as each collection/sale
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_summary (
+            summary_date TEXT PRIMARY KEY,
+            litres REAL NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            deliveries INTEGER NOT NULL DEFAULT 0,
+            distinct_farmers INTEGER NOT NULL DEFAULT 0,
+            sale_count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    # distinct_farmers only moves on a farmer's first delivery of the day (indexed lookup)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_summary_collection
+        AFTER INSERT ON milk_collections
+        BEGIN
+            INSERT INTO daily_summary (summary_date, litres, deliveries, distinct_farmers)
+            VALUES (
+                NEW.collection_date,
+                COALESCE(NEW.class_a_litres, 0) + COALESCE(NEW.class_b_litres, 0),
+                1,
+                (SELECT COUNT(*) = 1 FROM milk_collections
+                 WHERE farmer_id = NEW.farmer_id AND collection_date = NEW.collection_date)
+            )
+            ON CONFLICT(summary_date) DO UPDATE SET
+                litres = litres + excluded.litres,
+                deliveries = deliveries + 1,
+                distinct_farmers = distinct_farmers + excluded.distinct_farmers;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_summary_sale
+        AFTER INSERT ON sales
+        BEGIN
+            INSERT INTO daily_summary (summary_date, revenue, sale_count)
+            VALUES (NEW.sale_date, COALESCE(NEW.total_amount, 0), 1)
+            ON CONFLICT(summary_date) DO UPDATE SET
+                revenue = revenue + excluded.revenue,
+                sale_count = sale_count + 1;
+        END
+    """)
+    rebuild_daily_summary(conn)
+
+
+def rebuild_daily_summary(conn):
+    # Full recompute from the fact tables (backfill, or repair after bulk edits)
+    conn.execute("DELETE FROM daily_summary")
+    conn.execute("""
+        INSERT INTO daily_summary (summary_date, litres, revenue, deliveries, distinct_farmers, sale_count)
+        SELECT day, SUM(litres), SUM(revenue), SUM(deliveries), SUM(farmers), SUM(sale_count)
+        FROM (
+            SELECT collection_date AS day,
+                   SUM(COALESCE(class_a_litres, 0) + COALESCE(class_b_litres, 0)) AS litres,
+                   0 AS revenue, COUNT(*) AS deliveries, COUNT(DISTINCT farmer_id) AS farmers, 0 AS sale_count
+            FROM milk_collections
+            GROUP BY collection_date
+            UNION ALL
+            SELECT sale_date, 0, SUM(COALESCE(total_amount, 0)), 0, 0, COUNT(*)
+            FROM sales
+            GROUP BY sale_date
+        )
+        GROUP BY day
+    """)
+
+
+def _m004_farmer_monthly_stats(conn):
+    # Per-farmer totals per calendar month ('YYYY-MM'); rejections count as deliveries with 0 litres
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS farmer_monthly_stats (
+            farmer_id INTEGER NOT NULL REFERENCES dairy_farmers(id),
+            month TEXT NOT NULL,
+            litres REAL NOT NULL DEFAULT 0,
+            payment REAL NOT NULL DEFAULT 0,
+            deliveries INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (farmer_id, month)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_farmer_monthly_stats_month ON farmer_monthly_stats(month, litres)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_farmer_monthly_stats_collection
+        AFTER INSERT ON milk_collections
+        WHEN NEW.farmer_id IS NOT NULL
+        BEGIN
+            INSERT INTO farmer_monthly_stats (farmer_id, month, litres, payment, deliveries)
+            VALUES (
+                NEW.farmer_id,
+                substr(NEW.collection_date, 1, 7),
+                COALESCE(NEW.class_a_litres, 0) + COALESCE(NEW.class_b_litres, 0),
+                COALESCE(NEW.total_payment, 0),
+                1
+            )
+            ON CONFLICT(farmer_id, month) DO UPDATE SET
+                litres = litres + excluded.litres,
+                payment = payment + excluded.payment,
+                deliveries = deliveries + 1;
+        END
+    """)
+    rebuild_farmer_monthly_stats(conn)
+
+
+def rebuild_farmer_monthly_stats(conn):
+    conn.execute("DELETE FROM farmer_monthly_stats")
+    conn.execute("""
+        INSERT INTO farmer_monthly_stats (farmer_id, month, litres, payment, deliveries)
+        SELECT farmer_id, substr(collection_date, 1, 7),
+               SUM(COALESCE(class_a_litres, 0) + COALESCE(class_b_litres, 0)),
+               SUM(COALESCE(total_payment, 0)),
+               COUNT(*)
+        FROM milk_collections
+        WHERE farmer_id IS NOT NULL
+        GROUP BY farmer_id, substr(collection_date, 1, 7)
+    """)
+
+
+def _m005_promotions(conn):
+    # Cart promotions as data; promotions.py compiles the active rows into an evaluator.
+    # A rule targets the products listed in promotion_targets plus, optionally, a whole category.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS promotions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            rule_type TEXT NOT NULL CHECK(rule_type IN ('Buy X Get Y', 'Bundle', 'Percent Off')),
+            category TEXT,
+            buy_qty REAL,              -- Buy X Get Y: units bought per reward; Percent Off: minimum line qty
+            free_qty REAL,             -- Buy X Get Y: units given free per reward
+            min_lines INTEGER,         -- Bundle: distinct target products required in the cart
+            percent REAL,              -- Bundle / Percent Off
+            start_date TEXT NOT NULL DEFAULT (date('now')),
+            end_date TEXT,             -- inclusive; NULL = open-ended
+            is_active INTEGER NOT NULL DEFAULT 1,
+            created_by TEXT,
+            created_date TEXT DEFAULT (datetime('now'))
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS promotion_targets (
+            promotion_id INTEGER NOT NULL REFERENCES promotions(id) ON DELETE CASCADE,
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            PRIMARY KEY (promotion_id, product_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_promotions_active_dates ON promotions(is_active, start_date, end_date)")
+
+    # The two promos that used to be hardcoded in the Sales page
+    promo_id = conn.execute("""
+        INSERT INTO promotions (name, rule_type, buy_qty, free_qty, start_date, created_by)
+        VALUES ('Buy 10 Get 1 Free', 'Buy X Get Y', 10, 1, '2025-01-01', 'system')
+    """).lastrowid
+    conn.execute("""
+        INSERT INTO promotion_targets (promotion_id, product_id)
+        SELECT ?, id FROM products WHERE name = 'Fresh Milk 1L'
+    """, (promo_id,))
+    promo_id = conn.execute("""
+        INSERT INTO promotions (name, rule_type, min_lines, percent, start_date, created_by)
+        VALUES ('Yogurt + Cheese Bundle', 'Bundle', 2, 10, '2025-01-01', 'system')
+    """).lastrowid
+    conn.execute("""
+        INSERT INTO promotion_targets (promotion_id, product_id)
+        SELECT ?, id FROM products WHERE name LIKE '%Yogurt%' OR name LIKE '%Cheese%'
+    """, (promo_id,))
+
+
+def _m006_price_schedules(conn):
+    # Milk pricing by effective date: a schedule applies from effective_date until the next one starts.
+    # Fat / SNF / volume premiums are ladders: a delivery earns the bonus of the highest threshold it reaches.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS price_schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            effective_date TEXT NOT NULL UNIQUE,
+            base_price REAL NOT NULL,
+            consistency_bonus REAL NOT NULL DEFAULT 0,
+            loyalty_bronze REAL NOT NULL DEFAULT 0,
+            loyalty_silver REAL NOT NULL DEFAULT 0,
+            loyalty_gold REAL NOT NULL DEFAULT 0,
+            loyalty_platinum REAL NOT NULL DEFAULT 0,
+            notes TEXT,
+            created_by TEXT,
+            created_date TEXT DEFAULT (datetime('now'))
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS price_schedule_steps (
+            schedule_id INTEGER NOT NULL REFERENCES price_schedules(id) ON DELETE CASCADE,
+            component TEXT NOT NULL CHECK(component IN ('fat', 'snf', 'volume')),
+            threshold REAL NOT NULL,
+            bonus REAL NOT NULL,          -- ₱ per liter
+            PRIMARY KEY (schedule_id, component, threshold)
+        ) WITHOUT ROWID
+    """)
+
+    # The rates that used to be hardcoded in the Milk Collection page
+    schedule_id = conn.execute("""
+        INSERT INTO price_schedules (name, effective_date, base_price, consistency_bonus,
+                                     loyalty_bronze, loyalty_silver, loyalty_gold, loyalty_platinum, created_by)
+        VALUES ('Original rates', '2000-01-01', 80, 2, 0, 2, 5, 8, 'system')
+    """).lastrowid
+    conn.executemany("INSERT INTO price_schedule_steps (schedule_id, component, threshold, bonus) VALUES (?, ?, ?, ?)", [
+        (schedule_id, "fat", 3.8, 3), (schedule_id, "fat", 4.0, 5), (schedule_id, "fat", 4.2, 8),
+        (schedule_id, "snf", 8.8, 3), (schedule_id, "snf", 9.0, 5),
+        (schedule_id, "volume", 50, 2), (schedule_id, "volume", 100, 3), (schedule_id, "volume", 200, 5),
+    ])
+
+
+# Legacy production ledger rows: "Production → {units} {product} | Required: {x}L | Waste: {y}L | {notes}"
+LEGACY_PRODUCTION_REASON = re.compile(
+    r"^Production → [\d.]+ .*? \| Required: (?P<required>[\d.]+)L \| Waste: (?P<waste>[\d.]+)L \| ?(?P<notes>.*)$", re.S)
+
+
+def _m007_production_batches(conn):
+    # One row per production run; both of its ledger rows (raw milk OUT, finished goods IN) point back here
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS production_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL REFERENCES products(id),
+            units REAL NOT NULL,
+            raw_litres REAL NOT NULL,        -- raw milk taken from stock, waste included
+            waste_litres REAL NOT NULL DEFAULT 0,
+            yield_percent REAL NOT NULL,     -- share of raw_litres that went into product
+            expiry_date TEXT,
+            batch_date TEXT NOT NULL DEFAULT (date('now')),
+            operator TEXT,
+            notes TEXT
+        )
+    """)
+    conn.execute("ALTER TABLE inventory_transactions ADD COLUMN batch_id INTEGER REFERENCES production_batches(id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_production_batches_date ON production_batches(batch_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inventory_tx_batch ON inventory_transactions(batch_id) WHERE batch_id IS NOT NULL")
+    backfill_production_batches(conn)
+
+
+def backfill_production_batches(conn):
+    # Parse the legacy reason strings once. A batch is the finished-goods IN row plus the
+    # raw milk OUT row written just before it with the same reason, date and operator.
+    rows = conn.execute("""
+        SELECT it.id, it.product_id, it.transaction_type, it.quantity, it.reason, it.transaction_date, it.recorded_by
+        FROM inventory_transactions it
+        WHERE it.reason LIKE 'Production%' AND it.batch_id IS NULL
+        ORDER BY it.id
+    """).fetchall()
+    raw_out = {}
+    for row in rows:
+        key = (row["reason"], row["transaction_date"], row["recorded_by"])
+        if row["transaction_type"] == "OUT":
+            raw_out[key] = row
+            continue
+        match = LEGACY_PRODUCTION_REASON.match(row["reason"])
+        if row["transaction_type"] != "IN" or not match:
+            continue
+        out = raw_out.pop(key, None)
+        required, waste = float(match["required"]), float(match["waste"])
+        raw_litres = out["quantity"] if out else required + waste
+        notes = match["notes"].strip()
+        batch_id = conn.execute("""
+            INSERT INTO production_batches (product_id, units, raw_litres, waste_litres, yield_percent,
+                                            batch_date, operator, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (row["product_id"], row["quantity"], raw_litres, waste,
+              round(required / raw_litres * 100, 1) if raw_litres else 100.0,
+              row["transaction_date"], row["recorded_by"],
+              None if notes in ("", "No notes") else notes)).lastrowid
+        conn.executemany("UPDATE inventory_transactions SET batch_id = ? WHERE id = ?",
+                         [(batch_id, row["id"])] + ([(batch_id, out["id"])] if out else []))
+
+
+def _m008_inventory_lots(conn):
+    # Stock of sellable products held as lots with their own expiry; products.current_stock stays
+    # the total. Raw milk is one bulk tank and is not lot-tracked.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_lots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            batch_id INTEGER REFERENCES production_batches(id),
+            expiry_date TEXT,                -- NULL = does not expire, picked last
+            received_date TEXT NOT NULL DEFAULT (date('now')),
+            quantity_received REAL NOT NULL,
+            quantity_remaining REAL NOT NULL CHECK(quantity_remaining >= 0)
+        )
+    """)
+    # First-expired-first-out order per product; empty lots drop out of the index
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_inventory_lots_fefo
+        ON inventory_lots(product_id, expiry_date IS NULL, expiry_date, id)
+        WHERE quantity_remaining > 0
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS lot_allocations (
+            lot_id INTEGER NOT NULL REFERENCES inventory_lots(id) ON DELETE CASCADE,
+            sale_id INTEGER REFERENCES sales(id),
+            quantity REAL NOT NULL,
+            allocated_date TEXT NOT NULL DEFAULT (date('now'))
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lot_allocations_sale ON lot_allocations(sale_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lot_allocations_lot ON lot_allocations(lot_id)")
+
+    # Stock on hand becomes one opening lot per product, with the product's expiry if it had one
+    conn.execute("""
+        INSERT INTO inventory_lots (product_id, expiry_date, quantity_received, quantity_remaining)
+        SELECT id, expiry_date, current_stock, current_stock
+        FROM products
+        WHERE category != 'Raw Milk' AND current_stock > 0
+    """)
+
+
+def _m009_stock_checkpoints(conn):
+    # Ledger balance per product at the end of a day; the stock on any date is the nearest
+    # checkpoint plus the inventory_transactions after it (IN adds, OUT removes)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock_checkpoints (
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            checkpoint_date TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            PRIMARY KEY (product_id, checkpoint_date)
+        ) WITHOUT ROWID
+    """)
+
+    # Stock that predates the ledger (seeded or typed in as initial stock) becomes an opening
+    # balance, so today's ledger balance equals today's counter
+    conn.execute("""
+        INSERT INTO stock_checkpoints (product_id, checkpoint_date, quantity)
+        SELECT p.id, '2000-01-01',
+               p.current_stock - COALESCE(SUM(CASE it.transaction_type WHEN 'IN' THEN it.quantity ELSE -it.quantity END), 0)
+        FROM products p
+        LEFT JOIN inventory_transactions it ON it.product_id = p.id
+        GROUP BY p.id
+    """)
+    # One checkpoint per product for every closed day it had ledger activity
+    conn.execute("""
+        INSERT INTO stock_checkpoints (product_id, checkpoint_date, quantity)
+        SELECT d.product_id, d.day,
+               o.quantity + SUM(d.net) OVER (PARTITION BY d.product_id ORDER BY d.day)
+        FROM (
+            SELECT it.product_id, it.transaction_date AS day,
+                   SUM(CASE it.transaction_type WHEN 'IN' THEN it.quantity ELSE -it.quantity END) AS net
+            FROM inventory_transactions it
+            WHERE it.transaction_date < date('now')
+            GROUP BY it.product_id, it.transaction_date
+        ) d
+        JOIN stock_checkpoints o ON o.product_id = d.product_id AND o.checkpoint_date = '2000-01-01'
+    """)
+
+
+def _m010_message_threads(conn):
+    # One conversation per farmer or customer. The thread row carries what the inbox list
+    # shows (newest message time, preview, staff unread count) so it never aggregates messages.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS message_threads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            party_type TEXT NOT NULL CHECK(party_type IN ('Farmer', 'Customer')),
+            party_id INTEGER NOT NULL,
+            party_name TEXT,
+            last_message_at TEXT NOT NULL DEFAULT (datetime('now')),
+            last_message_id INTEGER,
+            last_preview TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            unread_count INTEGER NOT NULL DEFAULT 0,     -- messages from the party staff haven't opened
+            UNIQUE (party_type, party_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_message_threads_recent ON message_threads(last_message_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_message_threads_unread ON message_threads(last_message_at, id) WHERE unread_count > 0")
+    conn.execute("ALTER TABLE messages ADD COLUMN thread_id INTEGER REFERENCES message_threads(id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages(thread_id, id)")
+
+    # Existing messages were all sent by farmers and customers; none were tracked as read
+    conn.execute("""
+        INSERT INTO message_threads (party_type, party_id, party_name, last_message_at, last_message_id,
+                                     message_count, unread_count)
+        SELECT sender_type, sender_id, MAX(sender_name), MAX(timestamp), MAX(id), COUNT(*), COUNT(*)
+        FROM messages
+        WHERE sender_type IN ('Farmer', 'Customer') AND sender_id IS NOT NULL
+        GROUP BY sender_type, sender_id
+    """)
+    conn.execute("""
+        UPDATE message_threads
+        SET last_preview = (SELECT substr(message, 1, 120) FROM messages WHERE id = message_threads.last_message_id)
+    """)
+    conn.execute("""
+        UPDATE messages
+        SET thread_id = (SELECT t.id FROM message_threads t
+                         WHERE t.party_type = messages.sender_type AND t.party_id = messages.sender_id)
+        WHERE sender_type IN ('Farmer', 'Customer')
+    """)
+
+
+def _m011_notification_deliveries(conn):
+    # notifications keeps the text; who gets it and what they have read move to per-recipient rows.
+    # The feed reads deliveries by primary key, so the old (user_type, is_read, created_date) index goes.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notification_deliveries (
+            recipient_type TEXT NOT NULL CHECK(recipient_type IN ('Internal', 'Farmer', 'Customer')),
+            recipient_id INTEGER NOT NULL,
+            notification_id INTEGER NOT NULL REFERENCES notifications(id),
+            PRIMARY KEY (recipient_type, recipient_id, notification_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notification_inboxes (
+            recipient_type TEXT NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            read_through INTEGER NOT NULL DEFAULT 0,    -- every notification id up to here is read
+            PRIMARY KEY (recipient_type, recipient_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notification_deliveries_notification ON notification_deliveries(notification_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_created ON notifications(created_date)")
+    conn.execute("DROP INDEX IF EXISTS idx_notifications_user")
+
+    # Staff notifications were one shared row; each staff account now gets its own delivery
+    conn.execute("""
+        INSERT INTO notification_deliveries (recipient_type, recipient_id, notification_id)
+        SELECT user_type, user_id, id FROM notifications
+        WHERE user_type IN ('Farmer', 'Customer') AND user_id IS NOT NULL
+        UNION ALL
+        SELECT 'Internal', u.id, n.id FROM notifications n CROSS JOIN internal_users u
+        WHERE n.user_type = 'Internal'
+    """)
+    # "Mark All as Read" was the only way anything got read, so read rows always precede
+    # unread ones and the newest read id is an exact watermark
+    conn.execute("""
+        INSERT INTO notification_inboxes (recipient_type, recipient_id, read_through)
+        SELECT d.recipient_type, d.recipient_id, COALESCE(MAX(CASE WHEN n.is_read = 1 THEN n.id END), 0)
+        FROM notification_deliveries d
+        JOIN notifications n ON n.id = d.notification_id
+        GROUP BY d.recipient_type, d.recipient_id
+    """)
+    conn.execute("""
+        UPDATE notification_inboxes
+        SET unread_count = (SELECT COUNT(*) FROM notification_deliveries d
+                            WHERE d.recipient_type = notification_inboxes.recipient_type
+                              AND d.recipient_id = notification_inboxes.recipient_id
+                              AND d.notification_id > notification_inboxes.read_through)
+    """)
+
+
+def _m012_notification_outbox(conn):
+    # Written in the same transaction as the event; drained by outbox.OutboxDispatcher
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient_type TEXT NOT NULL,
+            recipient_id INTEGER,                       -- NULL: every staff account
+            channel TEXT NOT NULL CHECK(channel IN ('in_app', 'sms', 'email')),
+            message TEXT NOT NULL,
+            created_date TEXT DEFAULT (datetime('now')),
+            status TEXT NOT NULL DEFAULT 'Pending' CHECK(status IN ('Pending', 'Sent', 'Failed', 'Skipped')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL DEFAULT (datetime('now')),
+            last_error TEXT,
+            sent_date TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending
+        ON notification_outbox(next_attempt_at, id) WHERE status = 'Pending'
+    """)
+
+
+def _m013_attachments(conn):
+    # Content-addressed announcement attachments (see attachments.py); files linked from
+    # announcement content by the old form are copied into the store
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sha256 TEXT NOT NULL UNIQUE,                -- of the uploaded bytes
+            kind TEXT NOT NULL CHECK(kind IN ('image', 'file')),
+            original_name TEXT,
+            mime TEXT NOT NULL,
+            bytes INTEGER NOT NULL,                     -- as stored (after recompression)
+            original_bytes INTEGER NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            path TEXT NOT NULL,
+            thumb_path TEXT,
+            created_date TEXT DEFAULT (datetime('now'))
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS announcement_attachments (
+            announcement_id INTEGER NOT NULL REFERENCES announcements(id) ON DELETE CASCADE,
+            attachment_id INTEGER NOT NULL REFERENCES attachments(id),
+            position INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (announcement_id, attachment_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_announcement_attachments_attachment ON announcement_attachments(attachment_id)")
+    staged = []
+    attachments.backfill_legacy(conn, staged)
+    return staged
+
+
+def _m014_covering_unread_index(conn):
+    # The unread badge sums unread_count: carried in the partial index, it is answered
+    # from the index alone instead of visiting every unread thread's row
+    conn.execute("DROP INDEX IF EXISTS idx_message_threads_unread")
+    conn.execute("""
+        CREATE INDEX idx_message_threads_unread ON message_threads(last_message_at, id, unread_count)
+        WHERE unread_count > 0
+    """)
+
+
+def _m015_catalog_version(conn):
+    # Bumped by triggers whenever a product is added or removed or its name, category or
+    # price changes; stock updates leave it alone. The promotion engine is keyed on it.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+    bump = "UPDATE catalog_version SET version = version + 1 WHERE id = 1;"
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_catalog_version_insert AFTER INSERT ON products BEGIN {bump} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_catalog_version_delete AFTER DELETE ON products BEGIN {bump} END")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_version_update
+        AFTER UPDATE OF name, category, srp ON products
+        WHEN OLD.name IS NOT NEW.name OR OLD.category IS NOT NEW.category OR OLD.srp IS NOT NEW.srp
+        BEGIN {bump} END
+    """)
+
+
+MIGRATIONS = [
+    (1, "initial schema", _m001_initial_schema),
+    (2, "foreign keys and query indexes", _m002_foreign_keys_and_indexes),
+    (3, "daily summary rollup", _m003_daily_summary),
+    (4, "farmer monthly stats rollup", _m004_farmer_monthly_stats),
+    (5, "promotions", _m005_promotions),
+    (6, "milk price schedules", _m006_price_schedules),
+    (7, "production batches", _m007_production_batches),
+    (8, "inventory lots", _m008_inventory_lots),
+    (9, "stock ledger checkpoints", _m009_stock_checkpoints),
+    (10, "message threads", _m010_message_threads),
+    (11, "notification deliveries", _m011_notification_deliveries),
+    (12, "notification outbox", _m012_notification_outbox),
+    (13, "announcement attachments", _m013_attachments),
+    (14, "covering unread-threads index", _m014_covering_unread_index),
+    (15, "catalog version counter", _m015_catalog_version),
+]
+
+
+def current_version(conn):
+    if not _table_exists(conn, "schema_version"):
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(pool):
+    with pool.writer() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_date TEXT DEFAULT (datetime('now'))
+            )
+        """)
+        applied = current_version(conn)
+
+    pending = [m for m in MIGRATIONS if m[0] > applied]
+    if not pending:
+        return
+
+    with pool.foreign_keys_disabled():
+        for version, description, step in pending:
+            with attachments.staging() as staged, pool.writer() as conn:
+                staged += step(conn) or []
+                _check_foreign_keys(conn, version)
+                conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+
+
+def _check_foreign_keys(conn, version):
+    # Steps run with enforcement off, so a table rebuild would carry orphaned rows over
+    # silently and the first DELETE/UPDATE touching them would fail later
+    orphans = conn.execute("PRAGMA foreign_key_check").fetchall()
+    if orphans:
+        details = ", ".join(f"{table} rowid {rowid} -> {parent}" for table, rowid, parent, _ in orphans[:10])
+        raise MigrationError(f"Migration {version} left {len(orphans)} row(s) referencing missing rows: {details}")
@@ -0,0 +1,132 @@
+from collections import Counter
+
+# ========================
+# NOTIFICATIONS
+# ========================
+# A notification is written once to the notifications table and delivered to each
+# recipient as a row in notification_deliveries, whose primary key (recipient,
+# notification id) is the feed index: every page is a keyset range scan. Each
+# recipient's notification_inboxes row keeps an unread counter and a read watermark,
+# so "mark all as read" is one row update and a badge is one primary-key lookup.
+# Staff ("Internal") notifications fan out to every staff account, each with its
+# own read state. Old notifications that everyone has read are compacted away.
+
+RECIPIENT_TYPES = ("Internal", "Farmer", "Customer")
+
+PAGE_SIZE = 20
+KEEP_DAYS = 90
+
+# Cursor above every real notification id: the first page starts here
+FIRST_PAGE = 2 ** 63 - 1
+
+FEED_PAGE = """
+    SELECT n.id, n.message, n.created_date
+    FROM notification_deliveries d
+    JOIN notifications n ON n.id = d.notification_id
+    WHERE d.recipient_type = ? AND d.recipient_id = ? AND d.notification_id < ?
+    ORDER BY d.notification_id DESC
+    LIMIT ?
+"""
+
+INBOX = "SELECT unread_count, read_through FROM notification_inboxes WHERE recipient_type = ? AND recipient_id = ?"
+
+LATEST_DELIVERY = """
+    SELECT MAX(notification_id) FROM notification_deliveries
+    WHERE recipient_type = ? AND recipient_id = ?
+"""
+
+# Newest notification older than the retention window
+RETENTION_CUTOFF = """
+    SELECT id FROM notifications
+    WHERE created_date < datetime('now', ?)
+    ORDER BY created_date DESC, id DESC
+    LIMIT 1
+"""
+
+
+def notify(conn, recipient_type, recipient_id, message):
+    """Write one notification and deliver it; an Internal one with recipient_id None reaches every staff account."""
+    notify_many(conn, recipient_type, [(recipient_id, message)])
+
+
+def notify_many(conn, recipient_type, items):
+    # items: [(recipient_id, message), ...], all in the caller's transaction
+    if recipient_type not in RECIPIENT_TYPES:
+        raise ValueError(f"Unknown recipient type: {recipient_type}")
+    staff = None
+    deliveries = []
+    for recipient_id, message in items:
+        if recipient_id is None and recipient_type != "Internal":
+            raise ValueError(f"A {recipient_type} notification needs a recipient")
+        notification_id = conn.execute("INSERT INTO notifications (user_type, user_id, message) VALUES (?, ?, ?)",
+                                       (recipient_type, recipient_id, message)).lastrowid
+        if recipient_id is None:
+            if staff is None:
+                staff = [row[0] for row in conn.execute("SELECT id FROM internal_users")]
+            deliveries += [(recipient_type, user_id, notification_id) for user_id in staff]
+        else:
+            deliveries.append((recipient_type, recipient_id, notification_id))
+
+    conn.executemany("INSERT INTO notification_deliveries (recipient_type, recipient_id, notification_id) VALUES (?, ?, ?)",
+                     deliveries)
+    conn.executemany("""
+        INSERT INTO notification_inboxes (recipient_type, recipient_id, unread_count) VALUES (?, ?, ?)
+        ON CONFLICT(recipient_type, recipient_id) DO UPDATE SET unread_count = unread_count + excluded.unread_count
+    """, [(t, r, n) for (t, r), n in Counter((t, r) for t, r, _ in deliveries).items()])
+
+
+def inbox(read_one, recipient_type, recipient_id):
+    # (unread count, read watermark); a recipient with nothing delivered yet has no row
+    row = read_one(INBOX, (recipient_type, recipient_id))
+    return (row["unread_count"], row["read_through"]) if row else (0, 0)
+
+
+def feed_page(read_all, recipient_type, recipient_id, cursor=FIRST_PAGE):
+    """One page of a recipient's feed, newest first, and the cursor for the next page (None on the last).
+
+    read_all is the caller's (cached) query function, e.g. ConnectionPool.read_all.
+    """
+    rows = read_all(FEED_PAGE, (recipient_type, recipient_id, cursor, PAGE_SIZE + 1))
+    if len(rows) <= PAGE_SIZE:
+        return rows, None
+    rows = rows[:PAGE_SIZE]
+    return rows, rows[-1]["id"]
+
+
+def mark_read_through(conn, recipient_type, recipient_id, notification_id):
+    """Mark everything up to notification_id as read; anything delivered later stays unread.
+
+    The unread count is recounted from the deliveries above the new watermark only.
+    """
+    conn.execute("""
+        UPDATE notification_inboxes
+        SET read_through = ?,
+            unread_count = (SELECT COUNT(*) FROM notification_deliveries d
+                            WHERE d.recipient_type = notification_inboxes.recipient_type
+                              AND d.recipient_id = notification_inboxes.recipient_id
+                              AND d.notification_id > ?)
+        WHERE recipient_type = ? AND recipient_id = ? AND read_through < ?
+    """, (notification_id, notification_id, recipient_type, recipient_id, notification_id))
+
+
+def compact(conn, keep_days=KEEP_DAYS):
+    """Delete deliveries older than keep_days that their recipient has read, then notifications nobody holds.
+
+    Unread notifications are kept however old they are. Returns the number of deliveries removed.
+    """
+    cutoff = conn.execute(RETENTION_CUTOFF, (f"-{keep_days} days",)).fetchone()
+    if cutoff is None:
+        return 0
+    removed = conn.execute("""
+        DELETE FROM notification_deliveries
+        WHERE notification_id <= ?
+          AND notification_id <= (SELECT i.read_through FROM notification_inboxes i
+                                  WHERE i.recipient_type = notification_deliveries.recipient_type
+                                    AND i.recipient_id = notification_deliveries.recipient_id)
+    """, (cutoff[0],)).rowcount
+    conn.execute("""
+        DELETE FROM notifications
+        WHERE id <= ?
+          AND NOT EXISTS (SELECT 1 FROM notification_deliveries d WHERE d.notification_id = notifications.id)
+    """, (cutoff[0],))
+    return removed
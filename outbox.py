@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+from itertools import groupby
+
+import notifications
+
+# ========================
+# NOTIFICATION OUTBOX
+# ========================
+# Business code never delivers a notification itself: it adds a row to
+# notification_outbox inside its own transaction, so the event and its
+# notification commit (or roll back) together and the page only pays for one insert.
+# A single background thread drains the outbox in batches:
+# - in-app rows are turned into notification deliveries in one write transaction;
+# - SMS and e-mail rows go to a pluggable Gateway outside the write lock, then
+#   their outcome is recorded.
+# A failed send is retried with backoff. Delivery is at-least-once: a crash
+# during a send means that row is sent again.
+
+IN_APP, SMS, EMAIL = "in_app", "sms", "email"
+CHANNELS = (IN_APP, SMS, EMAIL)
+
+PENDING, SENT, FAILED, SKIPPED = "Pending", "Sent", "Failed", "Skipped"
+
+BATCH_SIZE = 200
+IDLE_SECONDS = 2.0            # poll interval when nobody calls wake()
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30       # 30 s, 1 min, 2 min, 4 min between attempts
+KEEP_DAYS = 30                # sent and skipped rows are purged after this
+
+# Due rows, oldest first, with the recipient's contact for external channels
+PENDING_BATCH = """
+    SELECT o.id, o.recipient_type, o.recipient_id, o.channel, o.message, o.attempts,
+           COALESCE(f.contact, c.contact) AS address
+    FROM notification_outbox o
+    LEFT JOIN dairy_farmers f ON o.recipient_type = 'Farmer' AND f.id = o.recipient_id
+    LEFT JOIN customers c ON o.recipient_type = 'Customer' AND c.id = o.recipient_id
+    WHERE o.status = 'Pending' AND o.next_attempt_at <= datetime('now')
+    ORDER BY o.next_attempt_at, o.id
+    LIMIT ?
+"""
+
+# Checked on a reader first, so an idle poll never takes the write lock
+ANY_DUE = """
+    SELECT 1 FROM notification_outbox
+    WHERE status = 'Pending' AND next_attempt_at <= datetime('now')
+    LIMIT 1
+"""
+
+
+def enqueue(conn, recipient_type, recipient_id, message, channels=(IN_APP,)):
+    """Queue one notification on each channel, in the caller's transaction."""
+    enqueue_many(conn, recipient_type, [(recipient_id, message)], channels)
+
+
+def enqueue_many(conn, recipient_type, items, channels=(IN_APP,)):
+    # items: [(recipient_id, message), ...]. Checked here so a bad row can never block the worker.
+    if recipient_type not in notifications.RECIPIENT_TYPES:
+        raise ValueError(f"Unknown recipient type: {recipient_type}")
+    if recipient_type != "Internal" and any(recipient_id is None for recipient_id, _ in items):
+        raise ValueError(f"A {recipient_type} notification needs a recipient")
+    for channel in channels:
+        if channel not in CHANNELS:
+            raise ValueError(f"Unknown notification channel: {channel}")
+    conn.executemany("INSERT INTO notification_outbox (recipient_type, recipient_id, channel, message) VALUES (?, ?, ?, ?)",
+                     [(recipient_type, recipient_id, channel, message) for recipient_id, message in items for channel in channels])
+
+
+def purge(conn, keep_days=KEEP_DAYS):
+    # Ids grow with created_date, so everything below the first recent row is old
+    first_recent = conn.execute("""
+        SELECT id FROM notification_outbox WHERE created_date >= datetime('now', ?) ORDER BY id LIMIT 1
+    """, (f"-{keep_days} days",)).fetchone()
+    bound = first_recent[0] if first_recent else conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM notification_outbox").fetchone()[0]
+    return conn.execute("DELETE FROM notification_outbox WHERE id < ? AND status IN ('Sent', 'Skipped')", (bound,)).rowcount
+
+
+# ========================
+# GATEWAYS
+# ========================
+class Gateway:
+    """Sends one SMS or e-mail. Raise to have the outbox retry it later."""
+
+    def send(self, channel, address, message):
+        raise NotImplementedError
+
+
+class FileGateway(Gateway):
+    """Local stand-in for an SMS/e-mail provider: appends each message to a JSON-lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, channel, address, message):
+        line = json.dumps({"sent": time.strftime("%Y-%m-%d %H:%M:%S"), "channel": channel,
+                           "to": address, "message": message}, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+# ========================
+# DISPATCHER
+# ========================
+class OutboxDispatcher:
+    """Background thread that drains notification_outbox; one per server process."""
+
+    def __init__(self, pool, gateway, batch_size=BATCH_SIZE, idle_seconds=IDLE_SECONDS):
+        self.pool = pool
+        self.gateway = gateway
+        self.batch_size = batch_size
+        self.idle_seconds = idle_seconds
+        self.last_error = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="outbox", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wake(self):
+        # Called after queueing; the worker waits for the caller's commit on the write lock
+        self._wake.set()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                drained = self.drain_once()
+                self.last_error = None
+            except Exception as e:
+                # Keep the worker alive (e.g. a locked database); the rows stay pending
+                self.last_error = str(e)
+                drained = 0
+            if drained < self.batch_size:
+                self._wake.wait(self.idle_seconds)
+                self._wake.clear()
+
+    def drain_once(self):
+        """Dispatch one batch of due rows; returns how many were handled."""
+        if self.pool.read_one(ANY_DUE, cached=False) is None:
+            return 0
+        with self.pool.writer() as conn:
+            batch = conn.execute(PENDING_BATCH, (self.batch_size,)).fetchall()
+            in_app = [row for row in batch if row["channel"] == IN_APP]
+            for recipient_type, rows in groupby(sorted(in_app, key=lambda r: r["recipient_type"]), key=lambda r: r["recipient_type"]):
+                notifications.notify_many(conn, recipient_type, [(row["recipient_id"], row["message"]) for row in rows])
+            conn.executemany("""
+                UPDATE notification_outbox SET status = 'Sent', attempts = attempts + 1, sent_date = datetime('now')
+                WHERE id = ?
+            """, [(row["id"],) for row in in_app])
+
+        # External sends happen without holding the writer
+        outcomes = [self._send(row) for row in batch if row["channel"] != IN_APP]
+        if outcomes:
+            with self.pool.writer() as conn:
+                conn.executemany("""
+                    UPDATE notification_outbox
+                    SET status = ?, attempts = attempts + 1, last_error = ?,
+                        next_attempt_at = datetime('now', ?),
+                        sent_date = CASE WHEN ? = 'Sent' THEN datetime('now') END
+                    WHERE id = ?
+                """, [(status, error, f"+{delay} seconds", status, row_id) for row_id, status, error, delay in outcomes])
+        return len(batch)
+
+    def _send(self, row):
+        # (id, status, error, seconds until the next attempt)
+        if not row["address"]:
+            return row["id"], SKIPPED, "No contact on file", 0
+        try:
+            self.gateway.send(row["channel"], row["address"], row["message"])
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            status = FAILED if attempts >= MAX_ATTEMPTS else PENDING
+            return row["id"], status, str(e), RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+        return row["id"], SENT, None, 0
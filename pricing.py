@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+
+# ========================
+# MILK GRADING & PRICING RULES
+# ========================
+# Every function takes scalars or equal-length arrays, so the single-delivery form,
+# a 300-row route sheet and a year of history go through exactly the same rules.
+# Rates come from the price_schedules tables; grading standards and tier rules are fixed.
+
+# Minimum quality standards; anything outside is rejected
+MIN_FAT = 3.0
+MIN_SNF = 7.5
+MAX_TEMPERATURE = 15
+
+TIERS = ["Bronze", "Silver", "Gold", "Platinum"]
+
+# Monthly litres that move a farmer up one tier
+TIER_UPGRADES = {"Bronze": ("Silver", 1500), "Silver": ("Gold", 3000), "Gold": ("Platinum", 5000)}
+
+COMPONENTS = ["fat", "snf", "volume"]
+
+# Price schedules are recompiled when either table is written
+SOURCE_TABLES = ("price_schedules", "price_schedule_steps")
+
+
+def quality_score(litres, fat, snf, temperature):
+    litres, fat, snf, temperature = (np.asarray(v, dtype=float) for v in (litres, fat, snf, temperature))
+    score = (np.minimum(fat / 4.0 * 40, 40)                                       # Fat max 40 points
+             + np.minimum(snf / 9.0 * 30, 30)                                     # SNF max 30 points
+             + np.select([temperature <= 6, temperature <= 10], [20.0, 10.0], 0.0)
+             + np.where(litres >= 50, 10.0, 5.0))
+    return np.where(litres > 0, score, 0.0)
+
+
+def is_rejected(fat, snf, temperature):
+    return (np.asarray(fat) < MIN_FAT) | (np.asarray(snf) < MIN_SNF) | (np.asarray(temperature) > MAX_TEMPERATURE)
+
+
+def rejection_reasons(fat, snf, temperature):
+    # Human-readable reason per delivery ("" when it passes)
+    fat, snf, temperature = (np.atleast_1d(np.asarray(v, dtype=float)) for v in (fat, snf, temperature))
+    reasons = []
+    for f, s, t in zip(fat, snf, temperature):
+        failed = []
+        if f < MIN_FAT:
+            failed.append(f"Fat {f:.2f}% < {MIN_FAT}%")
+        if s < MIN_SNF:
+            failed.append(f"SNF {s:.2f}% < {MIN_SNF}%")
+        if t > MAX_TEMPERATURE:
+            failed.append(f"Temp {t:.2f}°C > {MAX_TEMPERATURE}°C")
+        reasons.append(", ".join(failed))
+    return reasons
+
+
+def tier_after(tier, monthly_litres):
+    # One step up at most, the same as a single delivery
+    upgrade = TIER_UPGRADES.get(tier)
+    if upgrade and monthly_litres >= upgrade[1]:
+        return upgrade[0]
+    return tier
+
+
+def next_tier_target(tier):
+    # (next tier, litres needed this month); Gold shows its Platinum target, Platinum stays at the top
+    return TIER_UPGRADES.get(tier, ("Platinum", TIER_UPGRADES["Gold"][1]))
+
+
+# ========================
+# PRICE SCHEDULES
+# ========================
+class PriceSchedule:
+    """One set of rates, compiled to sorted threshold arrays for np.searchsorted bucketing."""
+
+    def __init__(self, row, steps):
+        # row: price_schedules row (mapping); steps: {component: [(threshold, bonus), ...]}
+        self.id = row["id"]
+        self.name = row["name"]
+        self.effective_date = row["effective_date"]
+        self.base_price = float(row["base_price"])
+        self.consistency_bonus = float(row["consistency_bonus"])
+        self.loyalty = {tier: float(row[f"loyalty_{tier.lower()}"]) for tier in TIERS}
+        self.ladders = {}
+        for component in COMPONENTS:
+            ladder = sorted(steps.get(component, []))
+            self.ladders[component] = (np.array([t for t, _ in ladder], dtype=float),
+                                       np.array([b for _, b in ladder], dtype=float))
+
+    def ladder_bonus(self, component, values):
+        # Bonus of the highest threshold each value reaches, 0 below the first step
+        thresholds, bonuses = self.ladders[component]
+        values = np.asarray(values, dtype=float)
+        if not len(thresholds):
+            return np.zeros_like(values)
+        step = np.searchsorted(thresholds, values, side="right") - 1
+        return np.where(step >= 0, bonuses[step.clip(min=0)], 0.0)
+
+    def loyalty_bonus(self, tier):
+        if isinstance(tier, str):
+            return self.loyalty.get(tier, 0.0)
+        return pd.Series(tier).map(self.loyalty).fillna(0.0).to_numpy(dtype=float)
+
+    def quality_premium(self, fat, snf):
+        return self.ladder_bonus("fat", fat) + self.ladder_bonus("snf", snf)
+
+    def price(self, litres, fat, snf, tier, delivered_yesterday):
+        """Per-liter price, bonus amount and payment for accepted milk."""
+        litres = np.asarray(litres, dtype=float)
+        quality_premium = self.quality_premium(fat, snf)
+        bonus_per_liter = (quality_premium + self.ladder_bonus("volume", litres) + self.loyalty_bonus(tier)
+                           + np.where(np.asarray(delivered_yesterday, dtype=bool), self.consistency_bonus, 0.0))
+        price_per_liter = self.base_price + bonus_per_liter
+        return {
+            "quality_premium": quality_premium,
+            "price_per_liter": price_per_liter,
+            "total_bonus": litres * bonus_per_liter,
+            "total_payment": np.round(litres * price_per_liter, 2),
+        }
+
+    def steps_frame(self):
+        # Ladders as an editable table (component, threshold, bonus)
+        return pd.DataFrame([(component, t, b) for component in COMPONENTS for t, b in zip(*self.ladders[component])],
+                            columns=["component", "threshold", "bonus"])
+
+
+class PriceBook:
+    """Every schedule in effective-date order; picks the one in force for each delivery date."""
+
+    def __init__(self, schedules):
+        self.schedules = sorted(schedules, key=lambda s: s.effective_date)
+        self.effective_dates = np.array([s.effective_date for s in self.schedules], dtype=str)
+
+    def index_on(self, dates):
+        # ISO dates sort as strings; -1 where a date is earlier than the first schedule
+        return np.searchsorted(self.effective_dates, np.asarray(dates, dtype=str), side="right") - 1
+
+    def schedule_on(self, day):
+        if not self.schedules:
+            return None
+        i = int(self.index_on([str(day)])[0])
+        return self.schedules[max(i, 0)]
+
+    def price(self, dates, litres, fat, snf, tier, delivered_yesterday):
+        # Each schedule prices the slice of deliveries it was in force for
+        litres, fat, snf = (np.asarray(v, dtype=float) for v in (litres, fat, snf))
+        tier, delivered_yesterday = np.asarray(tier, dtype=object), np.asarray(delivered_yesterday, dtype=bool)
+        index = self.index_on(dates).clip(min=0)
+        out = {key: np.zeros(len(litres)) for key in ("quality_premium", "price_per_liter", "total_bonus", "total_payment")}
+        for i in np.unique(index):
+            rows = index == i
+            priced = self.schedules[i].price(litres[rows], fat[rows], snf[rows], tier[rows], delivered_yesterday[rows])
+            for key, values in priced.items():
+                out[key][rows] = values
+        return out
+
+
+def load_price_book(conn):
+    rows = conn.execute("SELECT * FROM price_schedules ORDER BY effective_date").fetchall()
+    steps = {}
+    for step in conn.execute("SELECT schedule_id, component, threshold, bonus FROM price_schedule_steps"):
+        steps.setdefault(step["schedule_id"], {}).setdefault(step["component"], []).append((step["threshold"], step["bonus"]))
+    return PriceBook([PriceSchedule(row, steps.get(row["id"], {})) for row in rows])
+
+
+_books = {}   # pool path -> (table versions, price book)
+
+def price_book_for(pool):
+    # Recompiled only after a price schedule write commits
+    stamp = pool.table_versions(SOURCE_TABLES)
+    cached = _books.get(pool.path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with pool.reader() as conn:
+        book = load_price_book(conn)
+    _books[pool.path] = (stamp, book)
+    return book
+
+
+def save_schedule(conn, name, effective_date, base_price, consistency_bonus, loyalty, steps, notes, created_by):
+    # steps: iterable of (component, threshold, bonus); loyalty: {tier: ₱/L}
+    schedule_id = conn.execute("""
+        INSERT INTO price_schedules (name, effective_date, base_price, consistency_bonus,
+                                     loyalty_bronze, loyalty_silver, loyalty_gold, loyalty_platinum, notes, created_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (name, effective_date, base_price, consistency_bonus,
+          loyalty["Bronze"], loyalty["Silver"], loyalty["Gold"], loyalty["Platinum"], notes, created_by)).lastrowid
+    conn.executemany("INSERT INTO price_schedule_steps (schedule_id, component, threshold, bonus) VALUES (?, ?, ?, ?)",
+                     [(schedule_id, component, float(threshold), float(bonus)) for component, threshold, bonus in steps])
+    return schedule_id
+
+
+# ========================
+# WHAT-IF REPRICING
+# ========================
+def delivered_previous_day(farmer_ids, dates):
+    """For each delivery, whether the same farmer also delivered the day before (within the data given)."""
+    days = pd.to_datetime(pd.Series(np.asarray(dates)))
+    farmer_ids = pd.Series(np.asarray(farmer_ids))
+    seen = pd.MultiIndex.from_arrays([farmer_ids, days]).unique()
+    return pd.MultiIndex.from_arrays([farmer_ids, days - pd.Timedelta(days=1)]).isin(seen)
+
+
+def reprice(collections, schedule):
+    """Price historical deliveries under one schedule.
+
+    collections: DataFrame with farmer_id, collection_date, litres, fat, snf, loyalty_tier and
+    total_payment (queries.COLLECTIONS_FOR_REPRICING). Rejections were recorded with 0 litres and stay at ₱0.
+    Tiers are the farmers' current tiers; the history of tier changes isn't stored.
+    """
+    repriced = collections.copy()
+    yesterday = delivered_previous_day(repriced["farmer_id"], repriced["collection_date"])
+    priced = schedule.price(repriced["litres"], repriced["fat"].fillna(0), repriced["snf"].fillna(0),
+                            repriced["loyalty_tier"].fillna("Bronze"), yesterday)
+    repriced["proposed_payment"] = np.where(repriced["litres"] > 0, priced["total_payment"], 0.0)
+    repriced["difference"] = repriced["proposed_payment"] - repriced["total_payment"].fillna(0)
+    return repriced
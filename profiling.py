@@ -0,0 +1,273 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+
+# ========================
+# RERUN PROFILING
+# ========================
+# Streamlit runs the whole script on every interaction, so a slow page is the sum of
+# many small steps. The Profiler records one span tree per rerun:
+# - section(name) starts a named step that lasts until the next section() at the same
+#   level (imports, setup, KPI cards, trend chart, ...);
+# - span(name) is a nested block, and traced(name) wraps a function (the fragments).
+# The last RUNS_KEPT trees are kept in the session's state and export as Chrome
+# trace_event JSON (chrome://tracing, ui.perfetto.dev). With DAIRY_PROFILE=cprofile each
+# rerun also runs under cProfile, started and stopped on the rerun's own script thread.
+# Everything is a no-op unless DAIRY_PROFILE is set.
+
+PROFILE_MODE = os.environ.get("DAIRY_PROFILE", "").strip().lower()
+ENABLED = PROFILE_MODE not in ("", "0", "off", "false")
+CPROFILE = PROFILE_MODE == "cprofile"
+
+RUNS_KEPT = 20
+STATE_KEY = "profile_runs"
+HOTSPOT_LINES = 30
+
+_EPOCH = time.perf_counter()     # trace timestamps are microseconds since import
+_OFF = nullcontext()
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "children", "is_section")
+
+    def __init__(self, name, start, is_section=False):
+        self.name = name
+        self.start = start
+        self.end = None
+        self.children = []
+        self.is_section = is_section
+
+    @property
+    def seconds(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def walk(self, depth=0):
+        # (depth, span) for this span and everything under it, in start order
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+class Run(Span):
+    """One rerun (or one fragment rerun) of the script."""
+
+    __slots__ = ("label", "started_at", "fragment", "touched", "profile", "_stack", "_thread")
+
+    def __init__(self, label, fragment=False, cprofile=False):
+        super().__init__(label, time.perf_counter())
+        self.label = label
+        self.started_at = time.time()
+        self.fragment = fragment
+        self.touched = self.start
+        self._stack = [self]
+        self._thread = threading.get_ident()
+        self.profile = None
+        if cprofile:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                profile = None      # Python 3.12+: another session's rerun holds the profiler
+            self.profile = profile
+
+    def open(self, name, is_section=False):
+        now = time.perf_counter()
+        if is_section and self._stack[-1].is_section:
+            self._close_top(now)
+        span = Span(name, now, is_section)
+        self._stack[-1].children.append(span)
+        self._stack.append(span)
+        self.touched = now
+        return span
+
+    def close(self, span):
+        # Closes span and any sections still open inside it
+        now = time.perf_counter()
+        while len(self._stack) > 1:
+            if self._close_top(now) is span:
+                break
+        self.touched = now
+
+    def _close_top(self, at):
+        span = self._stack.pop()
+        span.end = at
+        return span
+
+    def finish(self, at=None):
+        # A rerun cut short by st.stop() or st.rerun() is closed at its last recorded step
+        if self.end is not None:
+            return
+        at = at if at is not None else self.touched
+        while len(self._stack) > 1:
+            self._close_top(at)
+        self.end = at
+        if self.profile is not None:
+            if threading.get_ident() == self._thread:
+                self.profile.disable()
+            else:
+                # Finished late by the next rerun on another thread: disable() would unhook
+                # that thread instead of this run's, so this run keeps no cProfile report
+                self.profile = None
+
+    def hotspots(self, limit=HOTSPOT_LINES):
+        """The cProfile report for this rerun, by cumulative time; None when cProfile was off."""
+        if self.profile is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).strip_dirs().sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+class Profiler:
+    """Per-session rerun profiler.
+
+    state is the mapping the runs are kept in (st.session_state in the app). fragment_run
+    tells whether the script is running only fragments right now: a traced fragment then
+    gets a run of its own instead of joining the previous full rerun.
+    """
+
+    def __init__(self, state, fragment_run=lambda: False, enabled=ENABLED, cprofile=CPROFILE):
+        self.state = state
+        self.fragment_run = fragment_run
+        self.enabled = enabled
+        self.cprofile = cprofile
+
+    def runs(self):
+        if STATE_KEY not in self.state:
+            self.state[STATE_KEY] = deque(maxlen=RUNS_KEPT)
+        return self.state[STATE_KEY]
+
+    def _start(self, label, fragment=False):
+        runs = self.runs()
+        if runs and runs[-1].end is None:
+            runs[-1].finish()
+        run = Run(label, fragment, self.cprofile)
+        runs.append(run)
+        return run
+
+    def _current(self):
+        runs = self.runs()
+        if runs and runs[-1].end is None:
+            return runs[-1]
+        return None
+
+    def begin(self, label="Rerun"):
+        """Start this rerun's tree; call once at the top of the script."""
+        if self.enabled:
+            self._start(label)
+
+    def end(self):
+        if self.enabled:
+            run = self._current()
+            if run is not None:
+                run.finish(time.perf_counter())
+
+    def label(self, label):
+        if self.enabled:
+            run = self._current()
+            if run is not None:
+                run.label = run.name = label
+
+    def section(self, name):
+        if self.enabled:
+            run = self._current()
+            if run is not None:
+                run.open(name, is_section=True)
+
+    def span(self, name):
+        if not self.enabled:
+            return _OFF
+        return self._span(name)
+
+    def _span(self, name):
+        run = self._current()
+        if run is None or (not run.fragment and self.fragment_run()):
+            # No rerun is open here (or only the previous full rerun's): this call is a run of its own
+            return _StandaloneRun(self, name)
+        return _OpenSpan(run, name)
+
+    def traced(self, name):
+        """Decorator: each call is a span; a fragment rerun on its own becomes its own run."""
+        def decorate(func):
+            if not self.enabled:
+                return func
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self._span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def chrome_trace(self):
+        return chrome_trace(self.runs())
+
+
+class _OpenSpan:
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+
+    def __enter__(self):
+        self.span = self.run.open(self.name)
+        return self.span
+
+    def __exit__(self, *exc):
+        self.run.close(self.span)
+        return False
+
+
+class _StandaloneRun:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.run = self.profiler._start(f"{self.name} (fragment)", fragment=True)
+        return self.run
+
+    def __exit__(self, *exc):
+        self.run.finish(time.perf_counter())
+        return False
+
+
+# ========================
+# CHROME TRACE EXPORT
+# ========================
+def _micros(t):
+    return round((t - _EPOCH) * 1e6, 1)
+
+
+def chrome_trace(runs):
+    """Finished runs as a Chrome trace_event document (complete "X" events, one track per session)."""
+    events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": 1, "args": {"name": "Reruns"}}]
+    for run in runs:
+        if run.end is None:
+            continue
+        for depth, span in run.walk():
+            if span.end is None:
+                continue
+            event = {"name": span.name, "cat": "rerun" if depth == 0 else "section" if span.is_section else "span",
+                     "ph": "X", "pid": os.getpid(), "tid": 1, "ts": _micros(span.start), "dur": round((span.end - span.start) * 1e6, 1)}
+            if depth == 0:
+                event["args"] = {"started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run.started_at)),
+                                 "fragment": run.fragment}
+            events.append(event)
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def chrome_trace_json(runs):
+    # bytes for st.download_button or a .json file
+    return json.dumps(chrome_trace(runs)).encode("utf-8")
+
+
+def write_chrome_trace(runs, path):
+    with open(path, "wb") as f:
+        f.write(chrome_trace_json(runs))
@@ -0,0 +1,132 @@
+import numpy as np
+
+# ========================
+# PROMOTION RULE ENGINE
+# ========================
+# Promotions live in the promotions / promotion_targets tables. The rules active on a
+# given day are compiled into arrays once per promotion and catalog version, then every rule is
+# applied to the whole cart in one set of array operations: the cost of a checkout
+# total grows with cart size, not with the number of rules times lines in Python.
+
+RULE_TYPES = ["Buy X Get Y", "Bundle", "Percent Off"]
+BUY_X_GET_Y, BUNDLE, PERCENT_OFF = range(3)
+
+# Compiled engines are rebuilt when either of these tables is written, or when the
+# catalog version moves. Stock updates write products on every sale and delivery, so
+# the products table version would rebuild the engine on almost every rerun.
+SOURCE_TABLES = ("promotions", "promotion_targets")
+
+# Kept by triggers (migration 15): only moves when a product's name, category or price changes
+CATALOG_VERSION = "SELECT version FROM catalog_version WHERE id = 1"
+
+ACTIVE_RULES = """
+    SELECT id, name, rule_type, category, buy_qty, free_qty, min_lines, percent
+    FROM promotions
+    WHERE is_active = 1 AND start_date <= ? AND (end_date IS NULL OR end_date >= ?)
+    ORDER BY id
+"""
+
+ACTIVE_RULE_TARGETS = """
+    SELECT pt.promotion_id, pt.product_id
+    FROM promotion_targets pt
+    JOIN promotions pr ON pr.id = pt.promotion_id
+    WHERE pr.is_active = 1 AND pr.start_date <= ? AND (pr.end_date IS NULL OR pr.end_date >= ?)
+"""
+
+
+class PromoEngine:
+    """Active promotions for one day, compiled to a rules x products membership matrix."""
+
+    def __init__(self, rules, targets, products):
+        # rules: rows of ACTIVE_RULES; targets: (promotion_id, product_id); products: (id, category)
+        self.names = [rule["name"] for rule in rules]
+        self.product_ids = np.array(sorted(pid for pid, _ in products), dtype=np.int64)
+        category_of = dict(products)
+        rule_row = {rule["id"]: i for i, rule in enumerate(rules)}
+
+        self.members = np.zeros((len(rules), len(self.product_ids)), dtype=bool)
+        for promotion_id, product_id in targets:
+            col = np.searchsorted(self.product_ids, product_id)
+            if col < len(self.product_ids) and self.product_ids[col] == product_id:
+                self.members[rule_row[promotion_id], col] = True
+        categories = np.array([category_of[pid] for pid in self.product_ids], dtype=object)
+        for i, rule in enumerate(rules):
+            if rule["category"]:
+                self.members[i] |= categories == rule["category"]
+
+        # One parameter column per rule; values a rule type doesn't use are neutral
+        def column(key, default):
+            return np.array([default if rule[key] is None else rule[key] for rule in rules], dtype=float)
+
+        self.kind = np.array([RULE_TYPES.index(rule["rule_type"]) for rule in rules], dtype=np.int64)
+        self.buy_qty = column("buy_qty", 0.0)
+        self.free_qty = column("free_qty", 0.0)
+        self.min_lines = column("min_lines", 1.0)
+        self.rate = column("percent", 0.0) / 100
+
+    def __len__(self):
+        return len(self.names)
+
+    def evaluate(self, product_ids, qty, unit_price):
+        """Discount each rule gives this cart, as an array aligned with self.names."""
+        if not len(self.names):
+            return np.zeros(0)
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        qty = np.asarray(qty, dtype=float)
+        unit_price = np.asarray(unit_price, dtype=float)
+        if not len(product_ids) or not len(self.product_ids):
+            return np.zeros(len(self.names))
+
+        # Rule x line membership; products unknown to the engine match no rule
+        cols = np.searchsorted(self.product_ids, product_ids).clip(max=len(self.product_ids) - 1)
+        known = self.product_ids[cols] == product_ids
+        hit = self.members[:, cols] & (known & (qty > 0))
+        line_total = qty * unit_price
+        target_total = (hit * line_total).sum(axis=1)
+
+        # Buy X Get Y: every buy_qty units on a line earn free_qty of that line free
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rewards = np.floor(qty / self.buy_qty[:, None]) * self.free_qty[:, None]
+        # A rule saved with buy_qty below 1 earns nothing rather than dividing by ~0
+        rewards = np.where(self.buy_qty[:, None] >= 1, np.nan_to_num(rewards, nan=0.0, posinf=0.0), 0.0).clip(0, qty)
+        free_goods = (hit * rewards * unit_price).sum(axis=1)
+
+        # Bundle: percent off the targeted lines once enough distinct targets are in the cart
+        bundle = np.where(hit.sum(axis=1) >= self.min_lines, target_total * self.rate, 0.0)
+
+        # Percent Off: percent off every targeted line with at least buy_qty units
+        percent_off = (hit & (qty >= self.buy_qty[:, None])) @ line_total * self.rate
+
+        return np.select([self.kind == BUY_X_GET_Y, self.kind == BUNDLE, self.kind == PERCENT_OFF],
+                         [free_goods, bundle, percent_off], 0.0)
+
+    def apply(self, product_ids, qty, unit_price):
+        """(total discount, [(promo name, discount), ...]) for the promos that apply."""
+        discounts = self.evaluate(product_ids, qty, unit_price)
+        cart_total = float(np.dot(np.asarray(qty, dtype=float), np.asarray(unit_price, dtype=float)))
+        # Stacked promos never make the cart negative
+        total = min(float(discounts.sum()), cart_total)
+        applied = [(name, float(d)) for name, d in zip(self.names, discounts) if d > 0]
+        return round(total, 2), applied
+
+
+def compile_rules(conn, day):
+    day = day.isoformat()
+    rules = conn.execute(ACTIVE_RULES, (day, day)).fetchall()
+    targets = [tuple(row) for row in conn.execute(ACTIVE_RULE_TARGETS, (day, day))]
+    products = [tuple(row) for row in conn.execute("SELECT id, category FROM products")]
+    return PromoEngine(rules, targets, products)
+
+
+_engines = {}   # pool path -> ((day, table versions, catalog stamp), engine)
+
+def engine_for(pool, day):
+    # Recompiled only when the day changes, a promotion write commits or the catalog changes
+    stamp = (day, pool.table_versions(SOURCE_TABLES), pool.read_one(CATALOG_VERSION, cached=False)[0])
+    cached = _engines.get(pool.path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with pool.reader() as conn:
+        engine = compile_rules(conn, day)
+    _engines[pool.path] = (stamp, engine)
+    return engine
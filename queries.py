@@ -0,0 +1,315 @@
+from datetime import date, timedelta
+
+import inventory
+import messaging
+import notifications
+import outbox
+
+# ========================
+# SHARED PAGE QUERIES
+# ========================
+# Dashboard, farmer and portal reads live here so the query-plan check and the
+# benchmarks exercise exactly the SQL the pages run.
+# Date filters are plain comparisons or rollup keys so they can use an index.
+
+def month_key(day):
+    # Key used by farmer_monthly_stats.month
+    return day.strftime('%Y-%m')
+
+
+# === DASHBOARD ===
+# KPI cards and the trend chart read the daily_summary rollup, not the fact tables
+DAILY_SUMMARY_FOR_DATES = """
+    SELECT d.day AS summary_date,
+           COALESCE(ds.litres, 0) AS litres,
+           COALESCE(ds.revenue, 0) AS revenue,
+           COALESCE(ds.deliveries, 0) AS deliveries,
+           COALESCE(ds.distinct_farmers, 0) AS distinct_farmers,
+           COALESCE(ds.sale_count, 0) AS sale_count
+    FROM (SELECT ? AS day, 0 AS pos UNION ALL SELECT ?, 1) d
+    LEFT JOIN daily_summary ds ON ds.summary_date = d.day
+    ORDER BY d.pos
+"""
+
+DASHBOARD_STOCK_KPIS = """
+    SELECT
+        (SELECT COALESCE(SUM(current_stock * srp), 0) FROM products WHERE srp > 0) AS inv_value,
+        (SELECT COUNT(*) FROM products
+         WHERE current_stock <= low_stock_threshold AND current_stock > 0 AND category != 'Raw Milk') AS low_stock_count,
+        (SELECT COUNT(*) FROM dairy_farmers) AS total_farmers
+"""
+
+DASHBOARD_TREND_30D = """
+    SELECT summary_date AS date, litres AS milk_litres, revenue
+    FROM daily_summary
+    WHERE summary_date >= date('now', '-30 days')
+    ORDER BY summary_date
+"""
+
+TOP_FARMERS_FOR_MONTH = """
+    SELECT
+        df.name AS Farmer,
+        ROUND(fms.litres, 1) AS Liters,
+        fms.payment AS Earnings
+    FROM farmer_monthly_stats fms
+    JOIN dairy_farmers df ON fms.farmer_id = df.id
+    WHERE fms.month = ?
+    ORDER BY fms.litres DESC
+    LIMIT 10
+"""
+
+# Each branch reads only the rows on or after its 20th-newest date (found by a covering
+# scan of the date index, then SEARCH on it) before the final merge. Same-date events
+# are ordered by type and newest id first, so the feed is stable.
+RECENT_ACTIVITY = """
+    SELECT type, date, activity FROM (
+        SELECT 'Milk Collection' AS type, mc.id, collection_date AS date,
+               df.name || ' delivered ' || ROUND(mc.class_a_litres + mc.class_b_litres, 1) || 'L → ₱' || COALESCE(mc.total_payment, 0) AS activity
+        FROM milk_collections mc
+        JOIN dairy_farmers df ON mc.farmer_id = df.id
+        WHERE mc.collection_date >= (SELECT MIN(collection_date) FROM (
+            SELECT collection_date FROM milk_collections ORDER BY collection_date DESC LIMIT 20))
+        UNION ALL
+        SELECT 'Sale' AS type, s.id, sale_date AS date,
+               'Sale #' || s.id || ' → ₱' || s.total_amount || ' (' || s.payment_type || ')' AS activity
+        FROM sales s
+        WHERE s.sale_date >= (SELECT MIN(sale_date) FROM (
+            SELECT sale_date FROM sales ORDER BY sale_date DESC LIMIT 20))
+    )
+    ORDER BY date DESC, type, id DESC
+    LIMIT 20
+"""
+
+# === FARMERS (Milk Collection, Manage Farmers, Farmer Portal) ===
+# Always returns one row, zeros when the farmer has no deliveries that month
+FARMER_MONTH_STATS = """
+    SELECT
+        COALESCE(SUM(litres), 0) AS litres,
+        COALESCE(SUM(payment), 0) AS payment,
+        COALESCE(SUM(deliveries), 0) AS deliveries
+    FROM farmer_monthly_stats
+    WHERE farmer_id = ? AND month = ?
+"""
+
+# Consistency bonus: everyone who delivered yesterday, in one lookup on the date index
+FARMERS_DELIVERED_YESTERDAY = """
+    SELECT DISTINCT farmer_id
+    FROM milk_collections
+    WHERE collection_date = date('now', '-1 day') AND farmer_id IS NOT NULL
+"""
+
+TODAYS_COLLECTIONS = """
+    SELECT
+        df.name AS Farmer,
+        ROUND(mc.class_a_litres + mc.class_b_litres, 1) AS Liters,
+        mc.fat_percentage AS "Fat %",
+        mc.snf_percentage AS "SNF %",
+        mc.quality_score AS Score,
+        mc.total_payment AS "Payment ₱"
+    FROM milk_collections mc
+    JOIN dairy_farmers df ON mc.farmer_id = df.id
+    WHERE mc.collection_date = date('now')
+    ORDER BY Liters DESC
+"""
+
+# Collection export for a date range (inclusive), oldest first, streamed in chunks
+COLLECTIONS_BETWEEN = """
+    SELECT mc.id AS "Collection #", mc.collection_date AS Date, df.name AS Farmer, df.loyalty_tier AS Tier,
+           ROUND(mc.class_a_litres + mc.class_b_litres, 2) AS Liters,
+           mc.fat_percentage AS "Fat %", mc.snf_percentage AS "SNF %", mc.quality_score AS Score,
+           mc.total_payment AS "Payment ₱", mc.recorded_by AS "Recorded By", mc.notes AS Notes
+    FROM milk_collections mc
+    JOIN dairy_farmers df ON mc.farmer_id = df.id
+    WHERE mc.collection_date BETWEEN ? AND ?
+    ORDER BY mc.collection_date, mc.id
+"""
+
+# Pricing what-if: every delivery since a date, with what was actually paid (date index range scan)
+COLLECTIONS_FOR_REPRICING = """
+    SELECT mc.farmer_id, df.name AS farmer, date(mc.collection_date) AS collection_date,
+           mc.class_a_litres + mc.class_b_litres AS litres,
+           mc.fat_percentage AS fat, mc.snf_percentage AS snf,
+           df.loyalty_tier, COALESCE(mc.total_payment, 0) AS total_payment
+    FROM milk_collections mc
+    JOIN dairy_farmers df ON mc.farmer_id = df.id
+    WHERE mc.collection_date >= ?
+"""
+
+FARMER_LIFETIME_STATS = """
+    SELECT
+        COALESCE(SUM(litres), 0) AS total_litres,
+        COALESCE(SUM(payment), 0) AS total_earnings,
+        COALESCE(SUM(deliveries), 0) AS deliveries
+    FROM farmer_monthly_stats
+    WHERE farmer_id = ?
+"""
+
+FARMER_MONTHLY_TREND = """
+    SELECT month, litres AS liters, payment AS earnings
+    FROM farmer_monthly_stats
+    WHERE farmer_id = ?
+    ORDER BY month
+"""
+
+FARMER_LIST_WITH_TOTALS = """
+    SELECT
+        df.id,
+        df.name,
+        df.contact,
+        df.address,
+        df.loyalty_tier,
+        COALESCE(SUM(fms.litres), 0) AS total_litres,
+        COALESCE(SUM(fms.payment), 0) AS total_earnings,
+        COALESCE(SUM(fms.deliveries), 0) AS total_deliveries
+    FROM dairy_farmers df
+    LEFT JOIN farmer_monthly_stats fms ON fms.farmer_id = df.id
+    GROUP BY df.id
+    ORDER BY total_litres DESC
+"""
+
+FARMER_SUPPLY_HISTORY = """
+    SELECT collection_date AS Date,
+           ROUND(class_a_litres + class_b_litres, 1) AS Liters,
+           total_payment AS "Payment ₱",
+           notes AS Notes
+    FROM milk_collections
+    WHERE farmer_id = ?
+    ORDER BY collection_date DESC
+"""
+
+FARMER_ANNOUNCEMENTS = """
+    SELECT id, title, content, created_date
+    FROM announcements
+    WHERE target_type IN ('All', 'Dairy Farmer')
+    ORDER BY created_date DESC
+    LIMIT ?
+"""
+
+# === PRODUCTION ===
+PRODUCTION_HISTORY_SINCE = """
+    SELECT pb.id AS Batch, pb.batch_date AS Date, pb.operator AS Operator, p.name AS Product,
+           pb.units AS "Units Produced", pb.raw_litres AS "Raw Used (L)", pb.waste_litres AS "Waste (L)",
+           pb.yield_percent AS "Yield %", pb.expiry_date AS Expiry, COALESCE(pb.notes, '') AS Notes
+    FROM production_batches pb
+    JOIN products p ON p.id = pb.product_id
+    WHERE pb.batch_date >= ?
+    ORDER BY pb.batch_date DESC, pb.id DESC
+"""
+
+# batch_date defaults to date('now') (UTC), so "today" is compared on the same clock
+UNITS_PRODUCED_TODAY = "SELECT COALESCE(SUM(units), 0) AS units FROM production_batches WHERE batch_date = date('now')"
+
+# Yield is the share of raw milk taken from stock that ended up in product
+PRODUCTION_YIELD_SINCE = """
+    SELECT p.name AS Product, COUNT(*) AS Batches, SUM(pb.units) AS Units,
+           ROUND(SUM(pb.raw_litres), 2) AS "Raw Used (L)", ROUND(SUM(pb.waste_litres), 2) AS "Waste (L)",
+           ROUND(100.0 * SUM(pb.raw_litres - pb.waste_litres) / NULLIF(SUM(pb.raw_litres), 0), 1) AS "Yield %"
+    FROM production_batches pb
+    JOIN products p ON p.id = pb.product_id
+    WHERE pb.batch_date >= ?
+    GROUP BY pb.product_id
+    ORDER BY Units DESC
+"""
+
+# === INVENTORY ===
+# Lots with stock left that expire on or before a date. Driven from products so each
+# product is one range seek on the FEFO index checkout picks from.
+EXPIRING_LOTS = """
+    SELECT p.name AS Product, l.id AS Lot, l.batch_id AS Batch, l.expiry_date AS Expiry,
+           l.quantity_remaining AS Remaining, p.unit AS Unit,
+           ROUND(l.quantity_remaining * p.srp, 0) AS "Value (₱)"
+    FROM products p
+    CROSS JOIN inventory_lots l
+    WHERE l.product_id = p.id AND l.quantity_remaining > 0
+      AND l.expiry_date IS NULL = 0 AND l.expiry_date <= ?
+    ORDER BY l.expiry_date, p.name
+"""
+
+# === MANAGE CUSTOMERS ===
+CUSTOMER_LIST_WITH_TOTALS = """
+    SELECT
+        c.id,
+        c.name,
+        c.type,
+        c.contact,
+        c.discount_type || ' ' || c.discount_value ||
+            CASE WHEN c.discount_type = 'Percentage' THEN '%' ELSE ' ₱' END AS discount,
+        c.loyalty_points,
+        c.current_balance,
+        COALESCE(SUM(s.total_amount), 0) AS lifetime_spend,
+        COUNT(s.id) AS total_purchases
+    FROM customers c
+    LEFT JOIN sales s ON s.customer_type = 'Registered Buyer' AND s.customer_id = c.id
+    GROUP BY c.id
+    ORDER BY lifetime_spend DESC
+"""
+
+# === CUSTOMER PORTAL ===
+CUSTOMER_INFO = """
+    SELECT discount_type, discount_value, loyalty_points, current_balance
+    FROM customers WHERE id = ?
+"""
+
+CUSTOMER_PRICE_LIST = "SELECT name, unit, srp FROM products WHERE srp > 0 ORDER BY name"
+
+CUSTOMER_PURCHASE_HISTORY = """
+    SELECT sale_date AS Date, total_amount AS Amount, payment_type AS "Payment Method"
+    FROM sales
+    WHERE customer_type = 'Registered Buyer' AND customer_id = ?
+    ORDER BY sale_date DESC
+"""
+
+CUSTOMER_ANNOUNCEMENTS = """
+    SELECT id, title, content, created_date
+    FROM announcements
+    WHERE target_type = 'All' OR target_type = ?
+    ORDER BY created_date DESC
+    LIMIT ?
+"""
+
+# Portals list this many announcements at first, then this many more per "Show older"
+ANNOUNCEMENTS_PAGE = 10
+
+
+def page_queries(day=None, farmer_id=1, customer_id=1, customer_type="Reseller"):
+    # (name, sql, params) for every dashboard and portal read, with representative parameters
+    day = day or date.today()
+    today = day.isoformat()
+    yesterday = (day - timedelta(days=1)).isoformat()
+    month = month_key(day)
+    return [
+        ("dashboard.daily_kpis", DAILY_SUMMARY_FOR_DATES, (today, yesterday)),
+        ("dashboard.stock_kpis", DASHBOARD_STOCK_KPIS, ()),
+        ("dashboard.trend_30d", DASHBOARD_TREND_30D, ()),
+        ("dashboard.top_farmers", TOP_FARMERS_FOR_MONTH, (month,)),
+        ("dashboard.recent_activity", RECENT_ACTIVITY, ()),
+        ("milk_collection.farmer_month_stats", FARMER_MONTH_STATS, (farmer_id, month)),
+        ("milk_collection.todays_collections", TODAYS_COLLECTIONS, ()),
+        ("milk_collection.export_year", COLLECTIONS_BETWEEN, ((day - timedelta(days=365)).isoformat(), today)),
+        ("milk_collection.delivered_yesterday", FARMERS_DELIVERED_YESTERDAY, ()),
+        ("pricing.collections_last_year", COLLECTIONS_FOR_REPRICING, ((day - timedelta(days=365)).isoformat(),)),
+        ("production.history_30d", PRODUCTION_HISTORY_SINCE, ((day - timedelta(days=30)).isoformat(),)),
+        ("production.units_today", UNITS_PRODUCED_TODAY, ()),
+        ("production.yield_30d", PRODUCTION_YIELD_SINCE, ((day - timedelta(days=30)).isoformat(),)),
+        ("inventory.stock_as_of", inventory.STOCK_AS_OF, {"day": (day.replace(day=1) - timedelta(days=1)).isoformat()}),
+        ("inventory.expiring_7d", EXPIRING_LOTS, ((day + timedelta(days=7)).isoformat(),)),
+        ("manage_farmers.farmer_list", FARMER_LIST_WITH_TOTALS, ()),
+        ("manage_farmers.monthly_trend", FARMER_MONTHLY_TREND, (farmer_id,)),
+        ("farmer_portal.lifetime_stats", FARMER_LIFETIME_STATS, (farmer_id,)),
+        ("farmer_portal.supply_history", FARMER_SUPPLY_HISTORY, (farmer_id,)),
+        ("farmer_portal.announcements", FARMER_ANNOUNCEMENTS, (ANNOUNCEMENTS_PAGE,)),
+        ("messages.thread_page", messaging.THREAD_PAGE, messaging.FIRST_PAGE + (messaging.PAGE_SIZE + 1,)),
+        ("messages.unread_thread_page", messaging.UNREAD_THREAD_PAGE, messaging.FIRST_PAGE + (messaging.PAGE_SIZE + 1,)),
+        ("messages.unread_summary", messaging.UNREAD_SUMMARY, ()),
+        ("messages.thread_messages", messaging.THREAD_MESSAGES, (1, messaging.MESSAGES_SHOWN)),
+        ("notifications.feed_page", notifications.FEED_PAGE, ("Internal", 1, notifications.FIRST_PAGE, notifications.PAGE_SIZE + 1)),
+        ("notifications.inbox", notifications.INBOX, ("Farmer", farmer_id)),
+        ("notifications.latest_delivery", notifications.LATEST_DELIVERY, ("Customer", customer_id)),
+        ("notifications.retention_cutoff", notifications.RETENTION_CUTOFF, (f"-{notifications.KEEP_DAYS} days",)),
+        ("notifications.outbox_batch", outbox.PENDING_BATCH, (outbox.BATCH_SIZE,)),
+        ("manage_customers.customer_list", CUSTOMER_LIST_WITH_TOTALS, ()),
+        ("customer_portal.info", CUSTOMER_INFO, (customer_id,)),
+        ("customer_portal.price_list", CUSTOMER_PRICE_LIST, ()),
+        ("customer_portal.purchase_history", CUSTOMER_PURCHASE_HISTORY, (customer_id,)),
+        ("customer_portal.announcements", CUSTOMER_ANNOUNCEMENTS, (customer_type, ANNOUNCEMENTS_PAGE)),
+    ]
@@ -0,0 +1,215 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# ========================
+# QUERY TRACING
+# ========================
+# The pool reports every query it runs (and every cache hit) to a QueryTracer.
+# Each query is reduced to a fingerprint (literals and IN-lists replaced by ?), so
+# the same statement with different values aggregates into one row per page.
+# Recent samples live in a ring buffer. Queries slower than the threshold are
+# kept with their EXPLAIN QUERY PLAN. Samples can also be appended to a table in
+# a separate SQLite file, so tracing never competes with the app's own writer.
+
+SLOW_QUERY_SECONDS = 0.05
+RING_SIZE = 5000             # recent samples kept for per-page percentiles
+LATENCY_SAMPLES = 512        # recent latencies kept per query for its p95
+SLOW_LOG_SIZE = 200
+LOG_BATCH = 500              # samples buffered before a write to the log file
+PARAMS_CHARS = 200
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+_fingerprints = {}
+
+def fingerprint(sql):
+    """The statement with whitespace collapsed and literal values replaced by ?."""
+    fp = _fingerprints.get(sql)
+    if fp is None:
+        fp = _SPACE.sub(" ", sql).strip()
+        fp = _NUMBER.sub("?", _STRING.sub("?", fp))
+        fp = _IN_LIST.sub("IN (?, ...)", fp)
+        _fingerprints[sql] = fp
+    return fp
+
+
+def thread_name():
+    # Default page label: work outside a page is labelled by its thread (e.g. [outbox])
+    return f"[{threading.current_thread().name}]"
+
+
+def explain(conn, sql, params=()):
+    """EXPLAIN QUERY PLAN as indented text, one step per line."""
+    try:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except sqlite3.Error as e:
+        return f"(no plan: {e})"
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return "\n".join(lines)
+
+
+class QueryStats:
+    """Running totals for one fingerprint on one page."""
+
+    def __init__(self, page, fp):
+        self.page = page
+        self.fingerprint = fp
+        self.calls = 0
+        self.cache_hits = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def as_dict(self):
+        p95 = float(np.percentile(self.latencies, 95)) if self.latencies else 0.0
+        return {
+            "page": self.page, "query": self.fingerprint, "calls": self.calls, "cache_hits": self.cache_hits,
+            "total_ms": self.total_seconds * 1000, "mean_ms": self.total_seconds * 1000 / self.calls if self.calls else 0.0,
+            "p95_ms": p95 * 1000, "max_ms": self.max_seconds * 1000, "rows": self.rows,
+        }
+
+
+class QueryTracer:
+    """Collects query timings for the Performance page; safe to share between threads."""
+
+    def __init__(self, slow_seconds=SLOW_QUERY_SECONDS, log_path=None, page_of=thread_name):
+        self.slow_seconds = slow_seconds
+        self.page_of = page_of
+        self.started = time.time()
+        self.samples = deque(maxlen=RING_SIZE)      # (page, fingerprint, seconds, rows, kind)
+        self.slow = deque(maxlen=SLOW_LOG_SIZE)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._log = None
+        self._pending = []
+        if log_path:
+            self._log = sqlite3.connect(log_path, check_same_thread=False, isolation_level=None)
+            self._log.execute("PRAGMA journal_mode = WAL")
+            self._log.execute("""
+                CREATE TABLE IF NOT EXISTS query_log (
+                    recorded_at TEXT NOT NULL,
+                    page TEXT,
+                    fingerprint TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    seconds REAL NOT NULL,
+                    rows INTEGER,
+                    plan TEXT                   -- slow queries only
+                )
+            """)
+
+    def _entry(self, page, fp):
+        stats = self._stats.get((page, fp))
+        if stats is None:
+            stats = self._stats[(page, fp)] = QueryStats(page, fp)
+        return stats
+
+    def cache_hit(self, sql):
+        page = self.page_of()
+        with self._lock:
+            self._entry(page, fingerprint(sql)).cache_hits += 1
+
+    def record(self, sql, params, seconds, rows, conn=None, kind="read"):
+        """One executed statement. conn is used to explain it when it was slow."""
+        page = self.page_of()
+        fp = fingerprint(sql)
+        plan = None
+        if seconds >= self.slow_seconds and conn is not None:
+            plan = explain(conn, sql, params)
+        with self._lock:
+            stats = self._entry(page, fp)
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows
+            stats.latencies.append(seconds)
+            self.samples.append((page, fp, seconds, rows, kind))
+            if plan is not None:
+                self.slow.appendleft({
+                    "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"), "page": page, "query": fp, "kind": kind,
+                    "ms": seconds * 1000, "rows": rows, "params": repr(params)[:PARAMS_CHARS], "plan": plan,
+                })
+            if self._log is not None:
+                self._pending.append((time.strftime("%Y-%m-%d %H:%M:%S"), page, fp, kind, seconds, rows, plan))
+                if len(self._pending) >= LOG_BATCH or plan is not None:
+                    self._flush()
+
+    def _flush(self):
+        # Caller holds the lock
+        if not self._pending:
+            return
+        try:
+            self._log.executemany("INSERT INTO query_log VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending)
+        except sqlite3.Error:
+            return      # keep the samples and try again with the next batch
+        self._pending = []
+
+    def flush(self):
+        if self._log is not None:
+            with self._lock:
+                self._flush()
+
+    def stats(self):
+        """One dict per (page, query), slowest total first."""
+        with self._lock:
+            rows = [stats.as_dict() for stats in self._stats.values()]
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    def page_stats(self):
+        """Per page: statements run, total time and p95 latency over the recent samples."""
+        with self._lock:
+            samples = list(self.samples)
+        by_page = {}
+        for page, _, seconds, _, _ in samples:
+            by_page.setdefault(page, []).append(seconds)
+        return sorted(({"page": page, "queries": len(latencies), "total_ms": sum(latencies) * 1000,
+                        "p95_ms": float(np.percentile(latencies, 95)) * 1000, "max_ms": max(latencies) * 1000}
+                       for page, latencies in by_page.items()), key=lambda row: row["total_ms"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._flush()
+            self._stats.clear()
+            self.samples.clear()
+            self.slow.clear()
+            self.started = time.time()
+
+
+class TracedConnection:
+    """The writer connection as handed out while tracing: execute and executemany are timed.
+
+    For a SELECT run on the writer, only the time to the first row is counted.
+    """
+
+    def __init__(self, conn, tracer):
+        self._conn = conn
+        self._tracer = tracer
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        cursor = self._conn.execute(sql, params)
+        self._tracer.record(sql, params, time.perf_counter() - started, max(cursor.rowcount, 0), self._conn, "write")
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        started = time.perf_counter()
+        cursor = self._conn.executemany(sql, seq_of_params)
+        self._tracer.record(sql, seq_of_params[0] if seq_of_params else (), time.perf_counter() - started,
+                            max(cursor.rowcount, 0), self._conn, "write")
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)